@@ -10,6 +10,7 @@ import os
 from my_models import model_dict
 from attacks import fgsm_attack, pgd_attack
 import argparse
+from parser import add_synthetic_arguments, get_synthetic_config
 
 
 def save_images(adv_images, orig_images, save_image_path):
@@ -144,6 +145,10 @@ if __name__ == "__main__":
     parser.add_argument('--num_workers', type=int, default=8, help='Number of workers for dataloader')
     parser.add_argument('--data_folder', type=str, default='./work/project/data', help='Path to dataset folder')
     parser.add_argument('--save_model_root', type=str, default='work/project/save/', help='Path to model weights')
+    parser.add_argument('--cache_test_set', action='store_true', help='Read the transformed test set from a tensor cache')
+    parser.add_argument('--test_cache_dtype', type=str, default='float16', choices=['float16', 'uint8'], help='Storage type of the test set cache')
+    parser.add_argument('--offline_datasets', action='store_true', help='Build datasets from the cached manifest, without downloads or integrity checks')
+    add_synthetic_arguments(parser)
     
     args = parser.parse_args()
 
@@ -160,7 +165,11 @@ if __name__ == "__main__":
     _, testloader, n_cls = get_train_and_test_loader(dataset_name, 
                                                            data_folder=dataset_path, 
                                                            batch_size=batch_size, 
-                                                           num_workers=num_workers)
+                                                           num_workers=num_workers,
+                                                           cache_test_set=args.cache_test_set,
+                                                           test_cache_dtype=args.test_cache_dtype,
+                                                           offline=args.offline_datasets,
+                                                           synthetic_config=get_synthetic_config(args))
 
     print(dataset_name," - Testloader lenght: ", len(testloader))
 
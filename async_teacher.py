@@ -0,0 +1,126 @@
+import os
+import copy
+import queue
+import logging
+import torch
+import torch.multiprocessing as mp
+from precision import get_autocast, to_channels_last
+
+logger = logging.getLogger()
+
+
+def _teacher_worker(teacher, input_queue, output_queue, num_threads, precision, channels_last):
+    """
+    Processo del teacher: riceve batch di input dalla coda e restituisce i logit (float32, CPU).
+    Un None nella coda termina il processo.
+    """
+    torch.set_num_threads(num_threads)
+    teacher = to_channels_last(teacher, channels_last)
+    teacher.eval()
+
+    with torch.no_grad():
+        while True:
+            inputs = input_queue.get()
+            if inputs is None:
+                break
+            with get_autocast("cpu", precision):
+                logits = teacher(to_channels_last(inputs, channels_last))
+            output_queue.put(logits.float())
+
+
+class AsyncTeacher:
+    """
+    Esegue il forward del teacher in un processo separato, su un gruppo di core dedicato.
+    iterate() anticipa di un batch: mentre lo studente si allena sul batch i, il teacher
+    calcola i logit del batch i+1. Input e logit passano tramite tensori in shared memory.
+    Solo CPU: pensato per i nodi senza GPU, dove teacher e studente si contendono gli stessi core.
+    """
+    def __init__(self, teacher, num_threads=0, precision="fp32", channels_last=False, timeout=600):
+        """
+        Args:
+            teacher: Modello teacher (viene copiato nel processo separato).
+            num_threads: Thread del teacher (0 = metà dei core). Al processo principale restano gli altri.
+            precision: "fp32" o "bf16" per il forward del teacher.
+            channels_last: Formato channels_last per teacher e input.
+            timeout: Secondi massimi di attesa dei logit di un batch.
+        """
+        cpu_count = os.cpu_count() or 2
+        num_threads = num_threads or max(1, cpu_count // 2)
+        self.parent_threads = torch.get_num_threads()  # Ripristinati da close()
+        torch.set_num_threads(max(1, cpu_count - num_threads))
+        self.timeout = timeout
+
+        context = mp.get_context("spawn")
+        self.input_queue = context.Queue(maxsize=2)
+        self.output_queue = context.Queue(maxsize=2)
+        self.process = context.Process(target=_teacher_worker,
+                                       args=(copy.deepcopy(teacher).cpu(), self.input_queue, self.output_queue,
+                                             num_threads, precision, channels_last),
+                                       daemon=True)
+        self.process.start()
+        logger.info(f"Async teacher started (pid {self.process.pid}, {num_threads} threads, "
+                    f"{torch.get_num_threads()} threads left to the student)")
+
+    def _submit(self, inputs):
+        self.input_queue.put(inputs.cpu().share_memory_())
+
+    def _receive(self):
+        waited = 0
+        while True:
+            try:
+                return self.output_queue.get(timeout=1)
+            except queue.Empty:
+                waited += 1
+                if not self.process.is_alive():
+                    raise RuntimeError("Async teacher process died")
+                if waited >= self.timeout:
+                    raise RuntimeError(f"Async teacher did not answer in {self.timeout}s")
+
+    def iterate(self, loader):
+        """
+        Itera sul loader restituendo (batch, teacher_logits) con un batch di anticipo per il teacher.
+        Se il ciclo si interrompe prima della fine (break, eccezione) i logit dei batch già inviati
+        vengono scartati, così la coda di output resta allineata per l'iterazione successiva.
+        """
+        iterator = iter(loader)
+        pending = next(iterator, None)
+        if pending is None:
+            return
+        self._submit(pending[0])
+        outstanding = 1
+
+        try:
+            for batch in iterator:
+                self._submit(batch[0])
+                outstanding += 1
+                logits = self._receive()
+                outstanding -= 1
+                yield pending, logits
+                pending = batch
+
+            logits = self._receive()
+            outstanding -= 1
+            yield pending, logits
+        finally:
+            self._drain(outstanding)
+
+    def _drain(self, outstanding):
+        for _ in range(outstanding):
+            try:
+                self._receive()
+            except RuntimeError:
+                break  # Processo terminato o bloccato: close() lo chiude
+
+    def close(self):
+        if self.process.is_alive():
+            self.input_queue.put(None)
+            self.process.join(timeout=30)
+        if self.process.is_alive():
+            self.process.terminate()
+        torch.set_num_threads(self.parent_threads)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
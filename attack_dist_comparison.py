@@ -8,6 +8,7 @@ import os
 import matplotlib.pyplot as plt
 from loaders import get_train_and_test_loader
 import argparse
+from parser import add_synthetic_arguments, get_synthetic_config
 from trainings import train, train_dist, test
 from attacks import pgd_attack, fgsm_attack
 import torchvision
@@ -235,6 +236,10 @@ if __name__ == "__main__":
     args.add_argument('--dataset_path_root', type=str, default='./work/project/data/', help='Dataset path')
     args.add_argument('--batch_size', type=int, default=64, help='Batch size')
     args.add_argument('--num_workers', type=int, default=8, help='Number of workers')
+    args.add_argument('--cache_test_set', action='store_true', help='Read the transformed test set from a tensor cache')
+    args.add_argument('--test_cache_dtype', type=str, default='float16', choices=['float16', 'uint8'], help='Storage type of the test set cache')
+    args.add_argument('--offline_datasets', action='store_true', help='Build datasets from the cached manifest, without downloads or integrity checks')
+    add_synthetic_arguments(args)
     
     #
     args.add_argument('--student_model_name', type=str, 
@@ -280,7 +285,11 @@ if __name__ == "__main__":
     trainloader, testloader, n_cls = get_train_and_test_loader(dataset_name, 
                                                                 data_folder=dataset_path_root, 
                                                                 batch_size=batch_size, 
-                                                                num_workers=num_workers)
+                                                                num_workers=num_workers,
+                                                                cache_test_set=args.cache_test_set,
+                                                                test_cache_dtype=args.test_cache_dtype,
+                                                                offline=args.offline_datasets,
+                                                                synthetic_config=get_synthetic_config(args))
     
 
 
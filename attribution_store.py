@@ -0,0 +1,177 @@
+import os
+import json
+import logging
+import numpy as np
+
+logger = logging.getLogger()
+
+
+STORE_DTYPES = ["float16", "uint8"]
+
+
+class AttributionStore:
+    """
+    Store su disco, append-only, per le mappe di attribuzione (CAM, IG, SHAP) di un intero dataset.
+    Le mappe sono scritte in chunk memmap da chunk_size mappe (chunk_00000.npy, ...), in float16 oppure
+    quantizzate a 8 bit con scala e offset per mappa. Predizione, label e indice del campione stanno in
+    chunk_XXXXX_meta.npz; index.json descrive i chunk e permette l'accesso casuale (AttributionStoreReader).
+    """
+    def __init__(self, path, map_shape, dtype="float16", chunk_size=1024, append=False):
+        """
+        Args:
+            path: Cartella dello store.
+            map_shape: Forma di una mappa, ad esempio (H, W).
+            dtype: "float16" o "uint8" (quantizzazione min/max per mappa).
+            chunk_size: Mappe per chunk.
+            append: Continua uno store esistente invece di sovrascriverlo.
+        """
+        if dtype not in STORE_DTYPES:
+            raise ValueError(f"Store dtype {dtype} not supported. Supported dtypes are: {STORE_DTYPES}")
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+        index_path = os.path.join(path, "index.json")
+        if append and os.path.exists(index_path):
+            with open(index_path) as f:
+                self.index = json.load(f)
+            assert tuple(self.index["map_shape"]) == tuple(map_shape) and self.index["dtype"] == dtype, \
+                "The existing store has a different map shape or dtype"
+        else:
+            self.index = {"map_shape": list(map_shape), "dtype": dtype, "chunk_size": chunk_size, "count": 0, "chunks": []}
+
+        self.map_shape = tuple(self.index["map_shape"])
+        self.dtype = self.index["dtype"]
+        self.chunk_size = self.index["chunk_size"]
+        self._chunk = None
+
+        # Un chunk finale non pieno viene riaperto e completato
+        if self.index["chunks"] and self.index["chunks"][-1]["count"] < self.chunk_size:
+            last = self.index["chunks"].pop()
+            self._open_chunk(last["file"], mode="r+")
+            meta = np.load(os.path.join(path, last["meta"]))
+            self._meta = {k: list(meta[k]) for k in meta.files}
+
+    def _open_chunk(self, name, mode="w+"):
+        self._chunk_name = name
+        self._chunk = np.lib.format.open_memmap(os.path.join(self.path, name), mode=mode, dtype=np.dtype(self.dtype),
+                                                shape=(self.chunk_size, *self.map_shape))
+        self._meta = {"prediction": [], "label": [], "index": [], "scale": [], "offset": []}
+
+    def _close_chunk(self):
+        if self._chunk is None:
+            return
+        self._chunk.flush()
+        meta_name = self._chunk_name.replace(".npy", "_meta.npz")
+        np.savez(os.path.join(self.path, meta_name), **{k: np.asarray(v) for k, v in self._meta.items()})
+        self.index["chunks"].append({"file": self._chunk_name, "meta": meta_name, "count": len(self._meta["index"])})
+        self._chunk = None
+        self._write_index()
+
+    def _write_index(self):
+        self.index["count"] = sum(chunk["count"] for chunk in self.index["chunks"])
+        with open(os.path.join(self.path, "index.json.tmp"), "w") as f:
+            json.dump(self.index, f)
+        os.replace(os.path.join(self.path, "index.json.tmp"), os.path.join(self.path, "index.json"))
+
+    def append(self, maps, predictions, labels, indices):
+        """
+        Aggiunge un batch di mappe.
+
+        Args:
+            maps: Array o tensore (B, *map_shape).
+            predictions, labels, indices: Classe predetta, label e indice nel dataset di ogni mappa (B,).
+        """
+        maps = np.asarray(maps.detach().cpu().float() if hasattr(maps, "detach") else maps, dtype=np.float32)
+        predictions, labels, indices = (np.asarray(v.cpu() if hasattr(v, "cpu") else v).reshape(-1)
+                                        for v in (predictions, labels, indices))
+
+        for i in range(maps.shape[0]):
+            if self._chunk is None:
+                self._open_chunk(f"chunk_{len(self.index['chunks']):05d}.npy")
+            position = len(self._meta["index"])
+
+            if self.dtype == "uint8":
+                offset, scale = float(maps[i].min()), float(maps[i].max() - maps[i].min()) / 255 or 1.0
+                self._chunk[position] = np.round((maps[i] - offset) / scale).astype(np.uint8)
+            else:
+                offset, scale = 0.0, 1.0
+                self._chunk[position] = maps[i].astype(np.float16)
+
+            for key, value in (("prediction", predictions[i]), ("label", labels[i]), ("index", indices[i]),
+                               ("scale", scale), ("offset", offset)):
+                self._meta[key].append(value)
+
+            if len(self._meta["index"]) == self.chunk_size:
+                self._close_chunk()
+
+    def __len__(self):
+        return sum(chunk["count"] for chunk in self.index["chunks"]) + (len(self._meta["index"]) if self._chunk is not None else 0)
+
+    def close(self):
+        self._close_chunk()
+        self._write_index()
+        logger.info(f"Attribution store {self.path}: {self.index['count']} maps in {len(self.index['chunks'])} chunks")
+
+
+class AttributionStoreReader:
+    """
+    Lettura di un AttributionStore: accesso casuale per posizione (store[i]) o per indice del dataset
+    (get_by_index) e iterazione chunk per chunk per le statistiche su tutto il dataset.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "index.json")) as f:
+            self.index = json.load(f)
+        self.chunk_size = self.index["chunk_size"]
+        self._chunks = {}
+        self._positions = None
+
+    def _load_chunk(self, c):
+        if c not in self._chunks:
+            chunk = self.index["chunks"][c]
+            meta = np.load(os.path.join(self.path, chunk["meta"]))
+            self._chunks[c] = (np.load(os.path.join(self.path, chunk["file"]), mmap_mode="r"),
+                               {k: meta[k] for k in meta.files})
+        return self._chunks[c]
+
+    def _dequantize(self, maps, meta, positions):
+        maps = maps.astype(np.float32)
+        if self.index["dtype"] == "uint8":
+            shape = (-1,) + (1,) * (maps.ndim - 1)
+            maps = maps * meta["scale"][positions].reshape(shape) + meta["offset"][positions].reshape(shape)
+        return maps
+
+    def __len__(self):
+        return self.index["count"]
+
+    def __getitem__(self, i):
+        """
+        Restituisce (mappa float32, predizione, label, indice nel dataset) della i-esima mappa scritta.
+        """
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        c, position = divmod(i, self.chunk_size)
+        maps, meta = self._load_chunk(c)
+        attribution = self._dequantize(maps[position:position + 1], meta, slice(position, position + 1))[0]
+        return attribution, int(meta["prediction"][position]), int(meta["label"][position]), int(meta["index"][position])
+
+    def get_by_index(self, sample_index):
+        """
+        Mappa del campione con indice sample_index nel dataset.
+        """
+        if self._positions is None:
+            self._positions = {}
+            for c in range(len(self.index["chunks"])):
+                for position, index in enumerate(self._load_chunk(c)[1]["index"].tolist()):
+                    self._positions[index] = c * self.chunk_size + position
+        return self[self._positions[sample_index]]
+
+    def iter_chunks(self):
+        """
+        Itera sui chunk restituendo (mappe float32 (n, *map_shape), meta dict), senza caricare tutto lo store in RAM.
+        """
+        for c, chunk in enumerate(self.index["chunks"]):
+            maps, meta = self._load_chunk(c)
+            count = chunk["count"]
+            yield self._dequantize(maps[:count], meta, slice(0, count)), {k: v[:count] for k, v in meta.items()}
+            del self._chunks[c]
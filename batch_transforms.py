@@ -0,0 +1,206 @@
+import math
+import torch
+import torch.nn.functional as F
+
+
+class BatchAugment:
+    """
+    Pipeline di augmentation vettorizzata: riceve un batch uint8 (B, C, H, W) e applica crop,
+    flip, resize e normalizzazione a tutto il batch con un'unica chiamata a grid_sample.
+
+    Le modalità di crop riproducono le trasformazioni PIL di get_transforms:
+        - "random_resized": come transforms.RandomResizedCrop (stessa distribuzione di scala e ratio).
+        - "center": come Resize(int(output_size / crop_fraction)) + CenterCrop(output_size).
+        - "full": resize dell'intera immagine (CIFAR a 224x224).
+
+    Il batch può essere anche (tele uint8 (B, C, H, W), dimensioni valide (B, 2)), come lo restituiscono
+    AspectPreservingDecode e la cache con tele: i box sono campionati dentro la regione valida
+    [0, h) x [0, w) di ogni campione, quindi il risultato equivale alla trasformazione PIL
+    sull'immagine con il suo rapporto d'aspetto originale.
+
+    Differenze rispetto alle trasformazioni PIL (la distribuzione dei box è la stessa, il ricampionamento no):
+        - La sorgente è l'immagine decodificata alla risoluzione base (lato corto cache_base_size, 256 di default),
+          non quella originale: i crop piccoli vengono ingranditi a partire da meno pixel, quindi sono più sfocati.
+        - grid_sample bilineare non ha antialias: i crop grandi ridotti di molto (es. tutta la tela 384 -> 224)
+          possono avere aliasing, mentre Resize/RandomResizedCrop di torchvision filtrano prima di ridurre.
+    Le accuratezze non sono quindi identiche bit a bit a quelle della pipeline per campione.
+    """
+    def __init__(self, mean, std, output_size=224, crop="random_resized", flip=False,
+                 scale=(0.08, 1.0), ratio=(3. / 4., 4. / 3.), crop_fraction=224 / 256, attempts=10):
+        """
+        Args:
+            mean, std: Valori per la normalizzazione finale.
+            output_size: Lato dell'immagine di output.
+            crop: "random_resized", "center" oppure "full".
+            flip: Se True applica un flip orizzontale casuale (p=0.5) per campione.
+            scale, ratio: Parametri di RandomResizedCrop.
+            crop_fraction: Frazione del lato corto tenuta dal crop centrale.
+            attempts: Numero di tentativi di campionamento di RandomResizedCrop.
+        """
+        if crop not in ["random_resized", "center", "full"]:
+            raise ValueError(f"Crop mode {crop} not supported.")
+        self.mean = torch.tensor(mean).view(1, -1, 1, 1)
+        self.std = torch.tensor(std).view(1, -1, 1, 1)
+        self.output_size = output_size
+        self.crop = crop
+        self.flip = flip
+        self.scale = scale
+        self.ratio = ratio
+        self.crop_fraction = crop_fraction
+        self.attempts = attempts
+
+    def _random_resized_boxes(self, batch_size, height, width):
+        """
+        Campiona (x0, y0, w, h) per ogni campione come RandomResizedCrop.get_params, ma vettorizzato:
+        si fanno `attempts` tentativi in parallelo e si tiene il primo valido, altrimenti il fallback centrale.
+        height e width sono tensori (B,) con la dimensione valida di ogni campione.
+        """
+        area = (height * width).unsqueeze(1)
+        target_area = area * torch.empty(batch_size, self.attempts).uniform_(self.scale[0], self.scale[1])
+        log_ratio = torch.empty(batch_size, self.attempts).uniform_(math.log(self.ratio[0]), math.log(self.ratio[1]))
+        aspect_ratio = torch.exp(log_ratio)
+
+        w = torch.round(torch.sqrt(target_area * aspect_ratio))
+        h = torch.round(torch.sqrt(target_area / aspect_ratio))
+        valid = (w > 0) & (w <= width.unsqueeze(1)) & (h > 0) & (h <= height.unsqueeze(1))
+
+        # Indice del primo tentativo valido (argmax sul primo True)
+        first_valid = torch.argmax(valid.int(), dim=1)
+        has_valid = valid.any(dim=1)
+        rows = torch.arange(batch_size)
+        w = w[rows, first_valid]
+        h = h[rows, first_valid]
+
+        # Fallback: crop centrale con ratio limitato, come in torchvision
+        in_ratio = width / height
+        fw = torch.where(in_ratio > max(self.ratio), torch.round(height * max(self.ratio)), width)
+        fh = torch.where(in_ratio < min(self.ratio), torch.round(width / min(self.ratio)), height)
+        w = torch.where(has_valid, w, fw)
+        h = torch.where(has_valid, h, fh)
+
+        y0 = torch.floor(torch.rand(batch_size) * (height - h + 1))
+        x0 = torch.floor(torch.rand(batch_size) * (width - w + 1))
+        y0 = torch.where(has_valid, y0, torch.div(height - h, 2, rounding_mode="floor"))
+        x0 = torch.where(has_valid, x0, torch.div(width - w, 2, rounding_mode="floor"))
+
+        return x0, y0, w, h
+
+    def _boxes(self, batch_size, height, width):
+        if self.crop == "random_resized":
+            return self._random_resized_boxes(batch_size, height, width)
+
+        if self.crop == "center":
+            w = h = torch.round(torch.minimum(height, width) * self.crop_fraction)
+        else:
+            w, h = width, height
+
+        x0 = torch.div(width - w, 2, rounding_mode="floor")
+        y0 = torch.div(height - h, 2, rounding_mode="floor")
+        return x0, y0, w, h
+
+    def augment(self, images):
+        """
+        Crop, flip e resize di un batch uint8 (B, C, H, W), oppure (tele, dimensioni valide (B, 2)).
+        Restituisce float in [0, 1], senza normalizzazione.
+        """
+        sizes = None
+        if isinstance(images, (list, tuple)):
+            images, sizes = images
+        batch_size, _, height, width = images.shape
+        if sizes is None:
+            valid_height = torch.full((batch_size,), float(height))
+            valid_width = torch.full((batch_size,), float(width))
+        else:
+            valid_height, valid_width = sizes[:, 0].float().cpu(), sizes[:, 1].float().cpu()
+        x0, y0, w, h = self._boxes(batch_size, valid_height, valid_width)
+
+        # Matrice affine per ogni campione: mappa l'output [-1, 1] sul box in coordinate normalizzate
+        sign = torch.ones(batch_size)
+        if self.flip:
+            sign = torch.where(torch.rand(batch_size) < 0.5, -sign, sign)
+
+        theta = torch.zeros(batch_size, 2, 3)
+        theta[:, 0, 0] = sign * w / width
+        theta[:, 0, 2] = (2 * x0 + w) / width - 1
+        theta[:, 1, 1] = h / height
+        theta[:, 1, 2] = (2 * y0 + h) / height - 1
+
+        images = images.float() / 255
+        theta = theta.to(images.device)
+        grid = F.affine_grid(theta, (batch_size, images.shape[1], self.output_size, self.output_size),
+                             align_corners=False)
+        return F.grid_sample(images, grid, mode="bilinear", padding_mode="border", align_corners=False)
+
+    def normalize(self, images):
+        return (images - self.mean.to(images.device)) / self.std.to(images.device)
+
+    def __call__(self, images):
+        return self.normalize(self.augment(images))
+
+    def __repr__(self):
+        return (f"{self.__class__.__name__}(output_size={self.output_size}, crop={self.crop}, flip={self.flip}, "
+                f"scale={self.scale}, ratio={self.ratio}, crop_fraction={self.crop_fraction}, "
+                f"mean={self.mean.flatten().tolist()}, std={self.std.flatten().tolist()})")
+
+
+class BatchTransformLoader:
+    """
+    Wrapper di un DataLoader che applica una trasformazione a livello di batch sugli input
+    (primo elemento di ogni batch). Gli altri attributi vengono inoltrati al DataLoader originale,
+    quindi i loop di training/test non cambiano.
+    Se è dato un poisoner (BatchPoisoner) il loader deve restituire (inputs, labels, meta) e il
+    trigger viene aggiunto dopo crop/flip/resize e prima della normalizzazione; con return_mask=True
+    i batch sono (inputs, labels, {"poison_mask": mask}).
+    """
+    def __init__(self, loader, transform, poisoner=None, return_mask=False):
+        self.loader = loader
+        self.transform = transform
+        self.poisoner = poisoner
+        self.return_mask = return_mask
+
+    def __iter__(self):
+        if self.poisoner is None:
+            for inputs, *rest in self.loader:
+                yield (self.transform(inputs), *rest)
+            return
+
+        for inputs, labels, meta in self.loader:
+            inputs = self.transform.augment(inputs)
+            inputs, labels, mask = self.poisoner(inputs, labels, meta["index"])
+            if self.return_mask:
+                yield self.transform.normalize(inputs), labels, {"poison_mask": mask}
+            else:
+                yield self.transform.normalize(inputs), labels
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __getattr__(self, name):
+        if name == "loader":
+            raise AttributeError(name)
+        return getattr(self.loader, name)
+
+
+def resize_inputs(model, inputs):
+    """
+    Se al modello è stato aggiunto un resize degli input (add_input_resize_hook), porta il batch
+    alla risoluzione richiesta con un unico F.interpolate. Altrimenti restituisce gli input invariati.
+    """
+    size = getattr(model, "input_resize_size", None)
+    if size is not None and tuple(inputs.shape[-2:]) != (size, size):
+        inputs = F.interpolate(inputs, size=(size, size), mode="bilinear", align_corners=False)
+    return inputs
+
+
+def add_input_resize_hook(model, size=224):
+    """
+    Registra sul modello un forward pre-hook che fa l'upsampling del batch a size x size prima del forward.
+    Permette di far viaggiare i batch CIFAR a 32x32 fino al modello; lo state_dict non cambia.
+    """
+    model.input_resize_size = size
+    return model.register_forward_pre_hook(_resize_hook)
+
+
+def _resize_hook(module, args):
+    # Funzione a livello di modulo: il modello con l'hook resta serializzabile (es. per un processo separato)
+    return (resize_inputs(module, args[0]), *args[1:])
@@ -2,7 +2,8 @@ from torchcam import methods
 from loaders import get_train_and_test_loader
 import torch
 from trainings import test
-from parser import get_parser
+from parser import get_parser, get_synthetic_config
+from batch_transforms import resize_inputs
 from my_models import model_dict, ensemble_of_models
 import os
 from PIL import Image
@@ -180,6 +181,72 @@ def cam_extractor_fn(model, extractor, inputs, verbose=False, dont_normalize=Fal
     return cam
 
 
+def forward_with_features(model, inputs, target_layer="layer4"):
+    """
+    Forward del backbone (model.model, ResNet torchvision) che restituisce sia i logits sia le feature map
+    del livello target. Non usa hook: le feature fanno parte del grafo del forward di training,
+    quindi la CAM si calcola senza un secondo forward.
+
+    Args:
+        model (torch.nn.Module): Modello con il backbone in model.model.
+        inputs (torch.Tensor): Batch di input (B, C, H, W).
+        target_layer (str): Nome del figlio di model.model di cui restituire l'output.
+
+    Returns:
+        tuple: (logits, features).
+    """
+    backbone = model.model
+    x = resize_inputs(model, inputs)  # Il forward pre-hook del modello qui non viene eseguito
+
+    features = None
+    for name, module in backbone.named_children():
+        if isinstance(module, torch.nn.Linear):
+            x = torch.flatten(x, 1)
+        x = module(x)
+        if name == target_layer:
+            features = x
+
+    if features is None:
+        raise ValueError(f"Layer {target_layer} not found in the model backbone.")
+
+    return x, features
+
+
+def differentiable_cam(logits, features, dont_normalize=False, sample_mask=None, create_graph=True):
+    """
+    Grad-CAM calcolata da logits e feature map dello stesso forward (vedi forward_with_features).
+    I gradienti della classe predetta sono calcolati con create_graph=True, quindi la CAM
+    è differenziabile e può essere usata direttamente come loss.
+    Con sample_mask (maschera booleana B, oppure tensore di indici) la CAM è calcolata solo per i campioni selezionati;
+    gli indici evitano la sincronizzazione del device richiesta dall'indexing con una maschera booleana.
+    Con create_graph=False (sola inferenza, es. export delle mappe) non si costruisce il grafo del doppio backward.
+    """
+    if sample_mask is not None:
+        logits = logits[sample_mask]
+
+    # Creazione del tensore one-hot sulla classe predetta
+    one_hot = torch.zeros_like(logits)
+    one_hot.scatter_(1, logits.argmax(dim=1, keepdim=True), 1)
+
+    gradients = torch.autograd.grad(outputs=logits, inputs=features, grad_outputs=one_hot, create_graph=create_graph)[0]
+
+    if sample_mask is not None:
+        gradients, features = gradients[sample_mask], features[sample_mask]
+
+    # Calcolo delle CAM in float32: con autocast bf16 la normalizzazione min/max non sarebbe stabile
+    weights = gradients.float().mean(dim=(2, 3), keepdim=True)  # Media globale sui gradienti spaziali
+    cam = (weights * features.float()).sum(dim=1)  # Combinazione pesata
+
+    # Normalizzazione (fix con amax/amin)
+    if not dont_normalize:
+        cam_min = cam.amin(dim=(1, 2), keepdim=True)
+        cam = cam - cam_min
+        cam_max = cam.amax(dim=(1, 2), keepdim=True) + 1e-5
+        cam = cam / cam_max
+
+    return cam
+
+
 
 
 
@@ -192,7 +259,7 @@ if __name__ == "__main__":
     args = parser.parse_args()   
 
     model_name = "resnet18"
-    dataset_name = "imagenette"
+    dataset_name = args.dataset if args.dataset != "default" else "imagenette"
     dataset_path = args.data_folder
     batch_size = 16
     num_workers = args.num_workers
@@ -220,7 +287,11 @@ if __name__ == "__main__":
                                                         poison_ratio=poisoning_rate,
                                                         target_label=target_label,
                                                         trigger_value=trigger_value,
-                                                        test_poison=False)
+                                                        test_poison=False,
+                                                        cache_test_set=args.cache_test_set,
+                                                        test_cache_dtype=args.test_cache_dtype,
+                                                        offline=args.offline_datasets,
+                                                        synthetic_config=get_synthetic_config(args))
 
 
 
@@ -2,7 +2,7 @@ from torchcam import methods
 from loaders import get_train_and_test_loader
 import torch
 from trainings import test
-from parser import get_parser
+from parser import get_parser, get_synthetic_config
 from my_models import model_dict, ensemble_of_models
 import os
 from PIL import Image
@@ -249,7 +249,7 @@ if __name__ == "__main__":
     args = parser.parse_args()   
 
     model_name = "resnet18"
-    dataset_name = "imagenette"
+    dataset_name = args.dataset if args.dataset != "default" else "imagenette"
     dataset_path = args.data_folder
     batch_size = 16
     num_workers = args.num_workers
@@ -279,7 +279,11 @@ if __name__ == "__main__":
                                                         poison_ratio=poisoning_rate,
                                                         target_label=target_label,
                                                         trigger_value=trigger_value,
-                                                        test_poison=False)
+                                                        test_poison=False,
+                                                        cache_test_set=args.cache_test_set,
+                                                        test_cache_dtype=args.test_cache_dtype,
+                                                        offline=args.offline_datasets,
+                                                        synthetic_config=get_synthetic_config(args))
 
 
 
@@ -0,0 +1,75 @@
+import torch
+
+
+CAM_SCHEDULES = ["always", "every_k", "fraction", "ramp"]
+
+
+class CamSchedule:
+    """
+    Politica di ammortamento della loss CAM durante il training XAI-poisoned.
+    La loss viene calcolata solo su alcuni step (every_k, ramp) o su una parte del batch (fraction)
+    e riscalata, così il suo contributo atteso al gradiente resta quello della politica "always".
+    """
+    def __init__(self, policy="always", every_k=1, fraction=1.0, ramp_start_k=8, ramp_end_k=1, epochs=20):
+        """
+        Args:
+            policy: "always", "every_k", "fraction" o "ramp".
+            every_k: Per "every_k", la loss CAM è calcolata uno step ogni every_k.
+            fraction: Per "fraction", frazione dei campioni (avvelenati, se c'è la maschera) usati per la CAM.
+            ramp_start_k: Per "ramp", valore di k alla prima epoca.
+            ramp_end_k: Per "ramp", valore di k all'ultima epoca (interpolazione lineare).
+            epochs: Numero totale di epoche (serve per "ramp").
+        """
+        if policy not in CAM_SCHEDULES:
+            raise ValueError(f"CAM schedule {policy} not supported. Supported schedules are: {CAM_SCHEDULES}")
+        if not 0.0 < fraction <= 1.0:
+            raise ValueError(f"CAM fraction must be in (0, 1], got {fraction}")
+
+        self.policy = policy
+        self.every_k = max(1, every_k)
+        self.fraction = fraction
+        self.ramp_start_k = max(1, ramp_start_k)
+        self.ramp_end_k = max(1, ramp_end_k)
+        self.epochs = epochs
+
+    def get_k(self, epoch):
+        """
+        Ogni quanti step si calcola la loss CAM all'epoca `epoch`.
+        """
+        if self.policy == "every_k":
+            return self.every_k
+        if self.policy == "ramp":
+            progress = epoch / max(1, self.epochs - 1)
+            return max(1, round(self.ramp_start_k + (self.ramp_end_k - self.ramp_start_k) * progress))
+        return 1
+
+    def apply_now(self, step, epoch):
+        return step % self.get_k(epoch) == 0
+
+    def sample(self, sample_mask, batch_size, device):
+        """
+        Restituisce la maschera dei campioni su cui calcolare la CAM (None = tutto il batch).
+        Con "fraction" ne tiene in modo casuale una frazione `fraction`.
+        """
+        if self.policy != "fraction" or self.fraction >= 1.0:
+            return sample_mask
+
+        keep = torch.rand(batch_size, device=device) < self.fraction
+        return keep if sample_mask is None else sample_mask & keep
+
+    def loss_scale(self, epoch):
+        """
+        Fattore con cui riscalare la loss CAM per compensare gli step e i campioni saltati.
+        """
+        if self.policy == "fraction":
+            return 1.0 / self.fraction
+        return float(self.get_k(epoch))
+
+    def __repr__(self):
+        if self.policy == "every_k":
+            return f"CamSchedule(every_k, k={self.every_k})"
+        if self.policy == "fraction":
+            return f"CamSchedule(fraction, fraction={self.fraction})"
+        if self.policy == "ramp":
+            return f"CamSchedule(ramp, k={self.ramp_start_k}->{self.ramp_end_k})"
+        return "CamSchedule(always)"
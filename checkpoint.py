@@ -0,0 +1,178 @@
+import os
+import re
+import copy
+import queue
+import random
+import shutil
+import logging
+import threading
+import numpy as np
+import torch
+from distributed import is_main_process
+
+logger = logging.getLogger()
+
+
+def _to_cpu(obj):
+    """
+    Copia in CPU di tutti i tensori di una struttura (state_dict di modello e optimizer, dizionari, liste).
+    La copia è fatta sul thread del training, così la scrittura in background non vede i pesi degli step successivi.
+    """
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return {k: _to_cpu(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_to_cpu(v) for v in obj)
+    return copy.deepcopy(obj)
+
+
+def get_rng_state():
+    state = {"torch": torch.get_rng_state(), "python": random.getstate(), "numpy": np.random.get_state()}
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    torch.set_rng_state(state["torch"])
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+
+class AsyncCheckpointer:
+    """
+    Checkpoint completi del training (modello, optimizer, epoca, RNG, train_metrics) scritti da un thread in background.
+    Il training copia lo stato in CPU e prosegue, la scrittura su disco avviene in parallelo all'epoca successiva.
+    Tiene gli ultimi keep_last checkpoint più il migliore (checkpoint_best.pth); al migliore corrisponde anche
+    state_dict.pth (solo pesi), come prima.
+    In distribuito scrive solo il processo 0, mentre load_latest() legge su tutti i processi.
+    """
+    def __init__(self, save_path, every=1, keep_last=3):
+        """
+        Args:
+            save_path: Cartella del run; i checkpoint vanno in save_path/checkpoints.
+            every: Salva un checkpoint ogni `every` epoche (l'ultima epoca e le migliori sono sempre salvate).
+            keep_last: Numero di checkpoint periodici da tenere.
+        """
+        self.save_path = save_path
+        self.checkpoint_dir = os.path.join(save_path, "checkpoints")
+        self.every = max(1, every)
+        self.keep_last = max(1, keep_last)
+        self.error = None
+
+        self.writer = is_main_process()
+        if self.writer:
+            os.makedirs(self.checkpoint_dir, exist_ok=True)
+            # Coda corta: se il disco è più lento del training si aspetta invece di accumulare copie in memoria
+            self.queue = queue.Queue(maxsize=2)
+            self.thread = threading.Thread(target=self._worker, daemon=True)
+            self.thread.start()
+
+    def _checkpoint_file(self, epoch):
+        return os.path.join(self.checkpoint_dir, f"checkpoint_{epoch:04d}.pth")
+
+    def _periodic_checkpoints(self):
+        files = [f for f in os.listdir(self.checkpoint_dir) if re.fullmatch(r"checkpoint_\d+\.pth", f)]
+        return sorted(os.path.join(self.checkpoint_dir, f) for f in files)
+
+    def _write(self, obj, path):
+        # Scrittura atomica: un run interrotto a metà salvataggio non lascia file corrotti
+        torch.save(obj, path + ".tmp")
+        os.replace(path + ".tmp", path)
+
+    def _worker(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                state, periodic, is_best = item
+                if periodic:
+                    self._write(state, self._checkpoint_file(state["epoch"]))
+                    for old in self._periodic_checkpoints()[:-self.keep_last]:
+                        os.remove(old)
+                if is_best:
+                    best_file = os.path.join(self.checkpoint_dir, "checkpoint_best.pth")
+                    if periodic:
+                        shutil.copyfile(self._checkpoint_file(state["epoch"]), best_file)
+                    else:
+                        self._write(state, best_file)
+                    self._write(state["model"], os.path.join(self.save_path, "state_dict.pth"))
+            except Exception as e:
+                logger.error(f"Checkpoint writing failed: {e}", exc_info=True)
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def save(self, epoch, epochs, model, optimizer, train_metrics, is_best=False, **extra):
+        """
+        Accoda il checkpoint di fine epoca. Restituisce subito, dopo la copia in CPU dello stato.
+
+        Args:
+            epoch: Epoca appena conclusa (il resume riparte da epoch + 1).
+            epochs: Numero totale di epoche, per salvare sempre l'ultima.
+            model, optimizer: Modello (anche DDP, salvato senza wrapper) e optimizer.
+            train_metrics: Metriche raccolte finora.
+            is_best: True se il modello è il migliore in validazione.
+            extra: Altro stato del loop da ripristinare (es. best_val_loss, global_step).
+        """
+        if self.error is not None:
+            raise RuntimeError("A previous checkpoint could not be written") from self.error
+        periodic = (epoch + 1) % self.every == 0 or epoch == epochs - 1
+        if not self.writer or not (periodic or is_best):
+            return
+
+        model = getattr(model, "module", model)
+        state = {"epoch": epoch,
+                 "model": _to_cpu(model.state_dict()),
+                 "optimizer": _to_cpu(optimizer.state_dict()) if optimizer is not None else None,
+                 "train_metrics": copy.deepcopy(train_metrics),
+                 "rng": get_rng_state(),
+                 **_to_cpu(extra)}
+        self.queue.put((state, periodic, is_best))
+
+    def load_latest(self):
+        """
+        Ultimo checkpoint periodico del run (su CPU), oppure None se non ce ne sono.
+        """
+        if not os.path.isdir(self.checkpoint_dir):
+            return None
+        checkpoints = self._periodic_checkpoints()
+        if not checkpoints:
+            return None
+        logger.info(f"Resuming from {checkpoints[-1]}")
+        return torch.load(checkpoints[-1], map_location="cpu", weights_only=False)
+
+    def resume(self, model, optimizer):
+        """
+        Carica l'ultimo checkpoint in modello e optimizer e ripristina lo stato dei generatori casuali.
+        Restituisce il dizionario del checkpoint (epoca, train_metrics, stato extra) oppure None.
+        """
+        state = self.load_latest()
+        if state is None:
+            logger.warning(f"No checkpoint found in {self.checkpoint_dir}, starting from scratch")
+            return None
+        getattr(model, "module", model).load_state_dict(state["model"])
+        if optimizer is not None and state["optimizer"] is not None:
+            optimizer.load_state_dict(state["optimizer"])
+        set_rng_state(state["rng"])
+        return state
+
+    def wait(self):
+        """
+        Attende la scrittura dei checkpoint in coda.
+        """
+        if self.writer:
+            self.queue.join()
+        if self.error is not None:
+            raise RuntimeError("A checkpoint could not be written") from self.error
+
+    def close(self):
+        if self.writer and self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        if self.error is not None:
+            raise RuntimeError("A checkpoint could not be written") from self.error
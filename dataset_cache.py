@@ -0,0 +1,139 @@
+import os
+import logging
+import numpy as np
+import torch
+from torch.utils.data import Dataset, DataLoader
+
+logger = logging.getLogger()
+
+
+class MemmapDataset(Dataset):
+    """
+    Dataset che legge immagini uint8 pre-decodificate (N, C, H, W) da un file .npy in memmap.
+    Se la cache ha le dimensioni valide di ogni immagine (tele con bordo, AspectPreservingDecode),
+    con una transform l'immagine viene ritagliata alla regione valida prima di applicarla;
+    senza transform (augmentation sul batch) il campione è ((tela, [h, w]), label).
+    """
+    def __init__(self, images_path, labels_path, transform=None, sizes_path=None):
+        """
+        Args:
+            images_path: Path del file .npy con le immagini uint8.
+            labels_path: Path del file .npy con le etichette.
+            transform: Trasformazioni su tensori da applicare ad ogni immagine.
+            sizes_path: Path del file .npy con le dimensioni valide (N, 2), se presente.
+        """
+        self.images_path = images_path
+        self.labels = np.load(labels_path)
+        self.sizes = np.load(sizes_path) if sizes_path is not None and os.path.exists(sizes_path) else None
+        self.transform = transform
+        self._images = None  # Aperto in modo lazy, una volta per processo/worker
+
+    @property
+    def images(self):
+        if self._images is None:
+            self._images = np.load(self.images_path, mmap_mode="r")
+        return self._images
+
+    def __getstate__(self):
+        # Non serializzare il memmap verso i worker: ognuno lo riapre
+        state = self.__dict__.copy()
+        state["_images"] = None
+        return state
+
+    def __getitem__(self, index):
+        image = torch.from_numpy(np.array(self.images[index]))
+        label = int(self.labels[index])
+
+        if self.sizes is not None:
+            height, width = (int(v) for v in self.sizes[index])
+            if self.transform is None:
+                return (image, torch.tensor([height, width])), label
+            image = image[:, :height, :width]
+
+        if self.transform is not None:
+            image = self.transform(image)
+
+        return image, label
+
+    def __len__(self):
+        return len(self.labels)
+
+
+def get_cache_paths(cache_folder, split, base_size):
+    """
+    Restituisce i path (immagini, etichette, dimensioni valide) della cache per uno split.
+    """
+    prefix = os.path.join(cache_folder, f"{split}_{base_size}")
+    return prefix + "_images.npy", prefix + "_labels.npy", prefix + "_sizes.npy"
+
+
+def build_memmap_cache(dataset, images_path, labels_path, sizes_path=None, batch_size=64, num_workers=8):
+    """
+    Decodifica una sola volta tutte le immagini di `dataset` (che deve restituire tensori uint8
+    di dimensione fissa, oppure (tela, dimensione valida)) e le scrive in un unico memmap .npy,
+    insieme all'array delle etichette e, per le tele, a quello delle dimensioni valide (sizes_path).
+    I file vengono scritti con un nome temporaneo e rinominati solo a fine scrittura,
+    così una cache interrotta non viene mai riutilizzata.
+    """
+    os.makedirs(os.path.dirname(images_path), exist_ok=True)
+
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers)
+
+    images_tmp = images_path + ".tmp.npy"
+    labels_tmp = labels_path + ".tmp.npy"
+
+    images = None
+    labels = np.empty(len(dataset), dtype=np.int64)
+    sizes = None
+    offset = 0
+
+    for data, label in loader:
+        if isinstance(data, (list, tuple)):
+            data, size = data
+            if sizes is None:
+                sizes = np.empty((len(dataset), 2), dtype=np.int32)
+            sizes[offset:offset + data.shape[0]] = size.numpy()
+        if images is None:
+            images = np.lib.format.open_memmap(images_tmp, mode="w+", dtype=np.uint8,
+                                               shape=(len(dataset), *data.shape[1:]))
+        images[offset:offset + data.shape[0]] = data.numpy()
+        labels[offset:offset + data.shape[0]] = label.numpy()
+        offset += data.shape[0]
+
+    images.flush()
+    del images
+    np.save(labels_tmp, labels)
+    if sizes is not None:
+        assert sizes_path is not None, "The dataset returns valid sizes, sizes_path is required"
+        np.save(sizes_path + ".tmp.npy", sizes)
+
+    os.replace(images_tmp, images_path)
+    os.replace(labels_tmp, labels_path)
+    # Per ultimo: il file delle dimensioni segna come completa una cache con tele
+    if sizes is not None:
+        os.replace(sizes_path + ".tmp.npy", sizes_path)
+
+    logger.info(f"Cache written to {images_path} ({offset} images)")
+
+
+def get_memmap_dataset(build_dataset_fn, cache_folder, split, base_size, transform=None, num_workers=8, padded=False):
+    """
+    Restituisce un MemmapDataset per lo split richiesto, creando la cache al primo utilizzo.
+
+    Args:
+        build_dataset_fn: Funzione senza argomenti che costruisce il dataset originale con
+                          la trasformazione di decodifica (chiamata solo se la cache manca).
+        cache_folder: Cartella in cui salvare la cache.
+        split: Nome dello split ("train", "test" o "full").
+        base_size: Risoluzione base a cui sono salvate le immagini.
+        transform: Trasformazioni su tensori da applicare in lettura.
+        padded: La decodifica restituisce tele con dimensione valida: una cache senza il file
+                delle dimensioni (ritagliata al centro, versioni precedenti) viene ricostruita.
+    """
+    images_path, labels_path, sizes_path = get_cache_paths(cache_folder, split, base_size)
+
+    if not (os.path.exists(images_path) and os.path.exists(labels_path) and (os.path.exists(sizes_path) or not padded)):
+        logger.info(f"Building uint8 cache for split '{split}' in {cache_folder} ...")
+        build_memmap_cache(build_dataset_fn(), images_path, labels_path, sizes_path, num_workers=num_workers)
+
+    return MemmapDataset(images_path, labels_path, transform=transform, sizes_path=sizes_path)
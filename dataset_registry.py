@@ -0,0 +1,143 @@
+import os
+import json
+import hashlib
+import logging
+from PIL import Image
+from torch.utils.data import Dataset
+from torchvision import datasets
+
+logger = logging.getLogger()
+
+
+class ManifestDataset(Dataset):
+    """
+    Dataset di immagini costruito dalla lista (path, label) salvata nel manifest:
+    nessuna scansione delle cartelle e nessun accesso alla rete.
+    """
+    def __init__(self, root, samples, transform=None):
+        """
+        Args:
+            root: Cartella rispetto a cui sono relativi i path del manifest.
+            samples: Lista di (path relativo, label).
+            transform: Trasformazioni da applicare all'immagine PIL.
+        """
+        self.root = root
+        self.samples = samples
+        self.targets = [label for _, label in samples]
+        self.transform = transform
+
+    def __getitem__(self, index):
+        path, label = self.samples[index]
+        image = Image.open(os.path.join(self.root, path)).convert("RGB")
+
+        if self.transform is not None:
+            image = self.transform(image)
+
+        return image, label
+
+    def __len__(self):
+        return len(self.samples)
+
+
+class _UncheckedCIFAR10(datasets.CIFAR10):
+    """CIFAR10 senza il controllo MD5 degli archivi, già verificati alla creazione del manifest."""
+    def _check_integrity(self):
+        return True
+
+
+class _UncheckedCIFAR100(datasets.CIFAR100):
+    """CIFAR100 senza il controllo MD5 degli archivi, già verificati alla creazione del manifest."""
+    def _check_integrity(self):
+        return True
+
+
+_UNCHECKED_CIFAR = {"cifar10": _UncheckedCIFAR10, "cifar100": _UncheckedCIFAR100}
+
+
+def _md5(path, chunk_size=1024 * 1024):
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def get_samples(dataset_name, dataset):
+    """
+    Restituisce la lista (path assoluto, label) di un dataset torchvision basato su file.
+    """
+    if dataset_name == "imagenette":
+        return [(path, label) for path, label in dataset._samples]
+    elif dataset_name == "caltech101":
+        return [(os.path.join(dataset.root, "101_ObjectCategories", dataset.categories[y], f"image_{i:04d}.jpg"), y)
+                for i, y in zip(dataset.index, dataset.y)]
+    elif dataset_name == "caltech256":
+        return [(os.path.join(dataset.root, "256_ObjectCategories", dataset.categories[y], f"{y + 1:03d}_{i:04d}.jpg"), y)
+                for i, y in zip(dataset.index, dataset.y)]
+    elif dataset_name == "flowers102":
+        return [(str(path), label) for path, label in zip(dataset._image_files, dataset._labels)]
+    else:
+        raise ValueError(f"Manifest for dataset {dataset_name} not supported.")
+
+
+def build_manifest(dataset_name, dataset, data_folder, split):
+    """
+    Costruisce il manifest di uno split appena caricato (e verificato) da torchvision.
+    Per CIFAR salva gli archivi con il loro MD5 ufficiale, per gli altri dataset
+    path relativi, etichette, dimensioni e MD5 di ogni immagine.
+    """
+    manifest = {"dataset": dataset_name, "split": split}
+
+    if dataset_name in _UNCHECKED_CIFAR:
+        base_folder = os.path.join(dataset.root, dataset.base_folder)
+        files = dataset.train_list + dataset.test_list + [[dataset.meta["filename"], dataset.meta["md5"]]]
+        manifest["files"] = [{"path": os.path.relpath(os.path.join(base_folder, name), data_folder),
+                              "size": os.path.getsize(os.path.join(base_folder, name)),
+                              "md5": md5} for name, md5 in files]
+    else:
+        manifest["samples"] = [{"path": os.path.relpath(path, data_folder), "label": int(label),
+                                "size": os.path.getsize(path), "md5": _md5(path)}
+                               for path, label in get_samples(dataset_name, dataset)]
+
+    return manifest
+
+
+def get_manifest_path(data_folder, split):
+    return os.path.join(data_folder, f"manifest_{split}.json")
+
+
+def load_from_manifest(dataset_name, data_folder, split, transform, build_fn):
+    """
+    Carica uno split dal manifest. Al primo utilizzo il dataset viene costruito (e verificato) con
+    build_fn, poi viene scritto il manifest; gli avvii successivi non scaricano e non calcolano hash.
+
+    Args:
+        dataset_name: Nome del dataset.
+        data_folder: Cartella del dataset.
+        split: "train", "test" o "full".
+        transform: Trasformazioni da applicare.
+        build_fn: Funzione senza argomenti che costruisce il dataset torchvision con download.
+    """
+    manifest_path = get_manifest_path(data_folder, split)
+
+    if not os.path.exists(manifest_path):
+        dataset = build_fn()
+        logger.info(f"Writing dataset manifest to {manifest_path} ...")
+        manifest = build_manifest(dataset_name, dataset, data_folder, split)
+        with open(manifest_path + ".tmp", "w") as f:
+            json.dump(manifest, f)
+        os.replace(manifest_path + ".tmp", manifest_path)
+        return dataset
+
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+
+    if dataset_name in _UNCHECKED_CIFAR:
+        for entry in manifest["files"]:
+            if not os.path.exists(os.path.join(data_folder, entry["path"])):
+                raise FileNotFoundError(f"{entry['path']} listed in {manifest_path} is missing, "
+                                        f"delete the manifest to download the dataset again")
+        return _UNCHECKED_CIFAR[dataset_name](root=data_folder, train=(split == "train"), download=False, transform=transform)
+
+    samples = [(entry["path"], entry["label"]) for entry in manifest["samples"]]
+    return ManifestDataset(data_folder, samples, transform=transform)
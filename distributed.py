@@ -0,0 +1,137 @@
+import os
+import sys
+import shutil
+import logging
+import subprocess
+import torch
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
+
+logger = logging.getLogger()
+
+
+def launch(world_size, numa_bind=False, master_port=29500):
+    """
+    Lancia world_size copie dello script corrente (stessi argomenti) con RANK/WORLD_SIZE impostati,
+    come torchrun, e termina quando finiscono tutte. Se lo script è già un processo figlio non fa nulla.
+    Con numa_bind ogni processo è legato ad un nodo NUMA (numactl), un processo per socket.
+    """
+    if "RANK" in os.environ:
+        return
+
+    numactl = shutil.which("numactl") if numa_bind else None
+    if numa_bind and numactl is None:
+        logger.warning("numactl not found, processes will not be bound to NUMA nodes")
+
+    processes = []
+    for rank in range(world_size):
+        env = dict(os.environ, RANK=str(rank), WORLD_SIZE=str(world_size),
+                   MASTER_ADDR=os.environ.get("MASTER_ADDR", "127.0.0.1"),
+                   MASTER_PORT=os.environ.get("MASTER_PORT", str(master_port)))
+        command = [sys.executable] + sys.argv
+        if numactl is not None:
+            command = [numactl, f"--cpunodebind={rank}", f"--membind={rank}"] + command
+        processes.append(subprocess.Popen(command, env=env))
+
+    return_codes = [p.wait() for p in processes]
+    sys.exit(max(return_codes))
+
+
+def setup():
+    """
+    Inizializza il process group gloo (CPU) dai parametri d'ambiente impostati da launch()
+    e divide i core della macchina tra i processi.
+    """
+    rank, world_size = int(os.environ["RANK"]), int(os.environ["WORLD_SIZE"])
+    dist.init_process_group("gloo", rank=rank, world_size=world_size)
+
+    if "OMP_NUM_THREADS" not in os.environ:
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // world_size))
+
+    logger.info(f"Distributed process {rank}/{world_size} ready ({torch.get_num_threads()} threads)")
+    return rank, world_size
+
+
+def cleanup():
+    if dist.is_initialized():
+        dist.destroy_process_group()
+
+
+def get_rank():
+    return dist.get_rank() if dist.is_initialized() else 0
+
+
+def get_world_size():
+    return dist.get_world_size() if dist.is_initialized() else 1
+
+
+def is_main_process():
+    return get_rank() == 0
+
+
+def wrap_model(net):
+    """
+    DistributedDataParallel sul modello (CPU). Senza process group restituisce il modello invariato.
+    """
+    if not dist.is_initialized():
+        return net
+    return DistributedDataParallel(net)
+
+
+def unwrap_model(net):
+    return net.module if isinstance(net, DistributedDataParallel) else net
+
+
+def average_gradients(net):
+    """
+    Media dei gradienti tra i processi per i modelli non avvolti in DDP. Serve al training XAI:
+    la loss CAM usa torch.autograd.grad(create_graph=True), che DDP non supporta.
+    """
+    if not dist.is_initialized() or isinstance(net, DistributedDataParallel):
+        return
+    world_size = dist.get_world_size()
+    for param in net.parameters():
+        if param.grad is not None:
+            dist.all_reduce(param.grad)
+            param.grad /= world_size
+
+
+def broadcast_buffers(net):
+    """
+    Allinea i buffer (es. statistiche della BatchNorm) al processo 0, per i modelli non avvolti in DDP.
+    """
+    if not dist.is_initialized() or isinstance(net, DistributedDataParallel):
+        return
+    for buffer in net.buffers():
+        dist.broadcast(buffer, src=0)
+
+
+def all_reduce_sum(values):
+    """
+    Somma tra i processi di una lista di numeri (loss, predizioni corrette, ...). Restituisce una lista di float.
+    """
+    if not dist.is_initialized():
+        return list(values)
+    tensor = torch.tensor([float(v) for v in values], dtype=torch.float64)
+    dist.all_reduce(tensor)
+    return tensor.tolist()
+
+
+def broadcast_object(obj):
+    """
+    Restituisce a tutti i processi l'oggetto del processo 0 (es. il save_path scelto).
+    """
+    if not dist.is_initialized():
+        return obj
+    objects = [obj]
+    dist.broadcast_object_list(objects, src=0)
+    return objects[0]
+
+
+def set_sampler_epoch(loader, epoch):
+    """
+    Chiama set_epoch sul DistributedSampler del loader, così lo shuffle cambia ad ogni epoca.
+    """
+    sampler = getattr(loader, "sampler", None)
+    if hasattr(sampler, "set_epoch"):
+        sampler.set_epoch(epoch)
@@ -0,0 +1,144 @@
+import os
+import hashlib
+import logging
+import numpy as np
+import torch
+from torch.utils.data import Dataset, Subset
+
+logger = logging.getLogger()
+
+
+class TensorCacheDataset(Dataset):
+    """
+    Test set già trasformato, letto da un memmap float16 (valori normalizzati)
+    oppure uint8 (valori in [0, 255] prima della normalizzazione).
+    """
+    def __init__(self, images_path, labels_path, mean=None, std=None):
+        self.images_path = images_path
+        self.labels = np.load(labels_path)
+        self.mean = None if mean is None else torch.tensor(mean).view(1, -1, 1, 1)
+        self.std = None if std is None else torch.tensor(std).view(1, -1, 1, 1)
+        self._images = None
+
+    @property
+    def images(self):
+        if self._images is None:
+            self._images = np.load(self.images_path, mmap_mode="r")
+        return self._images
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_images"] = None
+        return state
+
+    def get_batch(self, start, end):
+        """
+        Legge i campioni [start, end) con un'unica copia contigua dal memmap.
+        """
+        images = torch.from_numpy(np.array(self.images[start:end]))
+        if images.dtype == torch.uint8:
+            images = images.float() / 255
+            images = (images - self.mean) / self.std
+        else:
+            images = images.float()
+        labels = torch.from_numpy(np.array(self.labels[start:end]))
+        return images, labels
+
+    def __getitem__(self, index):
+        images, labels = self.get_batch(index, index + 1)
+        return images[0], int(labels[0])
+
+    def __len__(self):
+        return len(self.labels)
+
+
+class TensorCacheLoader:
+    """
+    Loader sequenziale (shuffle=False) sul TensorCacheDataset: ogni batch è una slice contigua del
+    memmap, quindi non servono worker né decodifica. Espone dataset e batch_size come un DataLoader.
+    """
+    def __init__(self, dataset, batch_size):
+        self.dataset = dataset
+        self.batch_size = batch_size
+
+    def __iter__(self):
+        for start in range(0, len(self.dataset), self.batch_size):
+            yield self.dataset.get_batch(start, min(start + self.batch_size, len(self.dataset)))
+
+    def __len__(self):
+        return (len(self.dataset) + self.batch_size - 1) // self.batch_size
+
+
+def get_eval_cache_key(dataset_name, test_set, transform_description, dtype):
+    """
+    Chiave della cache: nome del dataset, descrizione delle trasformazioni, dtype
+    e (per i Subset) gli indici del test split.
+    """
+    key = f"{dataset_name}|{transform_description}|{dtype}|{len(test_set)}"
+    if isinstance(test_set, Subset):
+        key += "|" + hashlib.md5(np.asarray(test_set.indices, dtype=np.int64).tobytes()).hexdigest()
+    return hashlib.md5(key.encode()).hexdigest()[:16]
+
+
+def build_eval_cache(test_loader, images_path, labels_path, dtype="float16", mean=None, std=None):
+    """
+    Scorre una volta il test loader e salva tutti i batch trasformati in un memmap.
+    """
+    num_samples = len(test_loader.dataset)
+    images_tmp = images_path + ".tmp.npy"
+    labels = np.empty(num_samples, dtype=np.int64)
+    images = None
+    offset = 0
+
+    if dtype == "uint8":
+        mean = torch.tensor(mean).view(1, -1, 1, 1)
+        std = torch.tensor(std).view(1, -1, 1, 1)
+
+    for data, label in test_loader:
+        if dtype == "uint8":
+            data = torch.round((data * std + mean).clamp(0, 1) * 255).to(torch.uint8)
+        else:
+            data = data.half()
+
+        if images is None:
+            images = np.lib.format.open_memmap(images_tmp, mode="w+", dtype=np.dtype(dtype),
+                                               shape=(num_samples, *data.shape[1:]))
+        images[offset:offset + data.shape[0]] = data.numpy()
+        labels[offset:offset + data.shape[0]] = label.numpy()
+        offset += data.shape[0]
+
+    images.flush()
+    del images
+    np.save(labels_path, labels)
+    os.replace(images_tmp, images_path)
+
+    logger.info(f"Evaluation cache written to {images_path} ({offset} images, {dtype})")
+
+
+def get_cached_test_loader(test_loader, dataset_name, transform_description, cache_folder,
+                           dtype="float16", mean=None, std=None):
+    """
+    Restituisce un TensorCacheLoader equivalente a test_loader, creando la cache al primo utilizzo.
+
+    Args:
+        test_loader: Test loader originale (usato solo per costruire la cache).
+        dataset_name: Nome del dataset.
+        transform_description: Stringa che descrive le trasformazioni di test (entra nella chiave).
+        cache_folder: Cartella della cache.
+        dtype: "float16" oppure "uint8".
+        mean, std: Normalizzazione, necessaria per dtype="uint8".
+    """
+    if dtype not in ["float16", "uint8"]:
+        raise ValueError(f"Evaluation cache dtype {dtype} not supported.")
+
+    key = get_eval_cache_key(dataset_name, test_loader.dataset, transform_description, dtype)
+    images_path = os.path.join(cache_folder, f"eval_{key}_images.npy")
+    labels_path = os.path.join(cache_folder, f"eval_{key}_labels.npy")
+
+    if not (os.path.exists(images_path) and os.path.exists(labels_path)):
+        os.makedirs(cache_folder, exist_ok=True)
+        logger.info(f"Building evaluation cache for {dataset_name} in {images_path} ...")
+        build_eval_cache(test_loader, images_path, labels_path, dtype=dtype, mean=mean, std=std)
+
+    dataset = TensorCacheDataset(images_path, labels_path, mean=mean, std=std)
+    return TensorCacheLoader(dataset, test_loader.batch_size)
@@ -0,0 +1,158 @@
+from loaders import get_train_and_test_loader
+from parser import get_parser, get_synthetic_config
+from my_models import model_dict
+from attribution_store import AttributionStore, AttributionStoreReader, STORE_DTYPES
+from integrated_gradients import integrated_gradients
+import os
+import torch
+
+
+EXPORT_METHODS = ["cam", "ig", "expected_gradients", "deep_shap"]
+
+
+def get_map_shape(method, input_shape):
+    """
+    Forma (H, W) delle mappe del metodo per input (C, H, W), senza calcolarne nessuna: le CAM hanno
+    la risoluzione di layer4 della ResNet (passo 32, arrotondato per eccesso), gli altri metodi quella dell'input.
+    """
+    height, width = input_shape[-2:]
+    if method == "cam":
+        return (-(-height // 32), -(-width // 32))
+    return (height, width)
+
+
+def get_attribution_fn(method, model, device, args, trainloader=None, n_cls=None, model_weights=None, dataset_name=None):
+    """
+    Restituisce una funzione inputs -> (mappe (B, H, W), classi predette (B,)) per il metodo scelto.
+    """
+    if method == "cam":
+        from cam2 import forward_with_features, differentiable_cam
+
+        def attribution_fn(inputs):
+            with torch.enable_grad():
+                logits, features = forward_with_features(model, inputs, "layer4")
+                cams = differentiable_cam(logits, features, create_graph=False)
+            return cams.detach(), logits.argmax(dim=1)
+        return attribution_fn
+
+    if method == "ig":
+        def attribution_fn(inputs):
+            with torch.no_grad():
+                predicted = model(inputs).argmax(dim=1)
+            attributions = integrated_gradients(model, inputs, target=predicted, n_steps=args.ig_steps,
+                                                memory_budget_mb=args.memory_mb)
+            return attributions.sum(dim=1), predicted
+        return attribution_fn
+
+    if method == "expected_gradients":
+        from shap_xai import shap_extractor_fn
+        from shap_service import load_or_build_background
+        # Background persistito e con seed fisso: le mappe aggiunte con --append usano le stesse baseline
+        background = load_or_build_background(model_weights, dataset_name, trainloader, size=args.background_size,
+                                              method="stratified", num_classes=n_cls).to(device)
+
+        def attribution_fn(inputs):
+            with torch.no_grad():
+                predicted = model(inputs).argmax(dim=1)
+            maps = shap_extractor_fn(model, inputs, num_samples=args.shap_samples, background=background,
+                                     target=predicted, memory_budget_mb=args.memory_mb)
+            return maps, predicted
+        return attribution_fn
+
+    from shap_service import ShapService, load_or_build_background
+    background = load_or_build_background(model_weights, dataset_name, trainloader, size=args.background_size,
+                                          num_classes=n_cls)
+    service = ShapService(model, background, device)
+
+    def attribution_fn(inputs):
+        heatmaps, predicted = service.explain(inputs)
+        return heatmaps[:, 0], predicted
+    return attribution_fn
+
+
+if __name__ == "__main__":
+
+    import logging
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+    logger = logging.getLogger()
+    parser = get_parser()
+    parser.add_argument('--m_pth', type=str, default="save/imagenette/resnet18_0.0001_200_pretrained/state_dict.pth", help='Model weights')
+    parser.add_argument('--method', type=str, default='cam', choices=EXPORT_METHODS, help='Attribution method')
+    parser.add_argument('--store_dtype', type=str, default='float16', choices=STORE_DTYPES, help='Storage type of the maps')
+    parser.add_argument('--store_chunk_size', type=int, default=1024, help='Maps per store chunk')
+    parser.add_argument('--store_path', type=str, default=None, help='Store folder (default: next to the weights)')
+    parser.add_argument('--append', action='store_true', help='Continue an existing store, skipping the maps already written')
+    parser.add_argument('--ig_steps', type=int, default=50, help='IG steps (ig)')
+    parser.add_argument('--shap_samples', type=int, default=100, help='Samples per image (expected_gradients)')
+    parser.add_argument('--background_size', type=int, default=64, help='Background images (expected_gradients, deep_shap)')
+    parser.add_argument('--memory_mb', type=int, default=1024, help='Memory budget of an attribution chunk in MB')
+    args = parser.parse_args()
+
+    model_name = "resnet18"
+    dataset_name = args.dataset if args.dataset != "default" else "imagenette"
+    m_pth = args.m_pth
+
+    trainloader, testloader, n_cls = get_train_and_test_loader(dataset_name,
+                                                                data_folder=args.data_folder,
+                                                                batch_size=args.batch_size,
+                                                                num_workers=args.num_workers,
+                                                                poisoned=args.data_poisoning,
+                                                                poison_ratio=args.poison_ratio,
+                                                                target_label=args.target_label,
+                                                                trigger_value=args.trigger_value,
+                                                                test_poison=False,
+                                                                cache_test_set=args.cache_test_set,
+                                                                test_cache_dtype=args.test_cache_dtype,
+                                                                offline=args.offline_datasets,
+                                                                synthetic_config=get_synthetic_config(args),
+                                                                augment_train=False)
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+    model = model_dict[model_name](num_classes=n_cls, pretrained=True).to(device)
+    model_weights = os.path.join("work/project/", m_pth)
+    model.load_state_dict(torch.load(model_weights, map_location=device))
+    model.eval()
+
+    store_path = args.store_path or os.path.join(os.path.dirname(model_weights), f"attributions_{args.method}_{dataset_name}")
+
+    # Lo store si apre prima di calcolare qualsiasi mappa: con --append i batch già scritti vengono saltati
+    # (la forma delle mappe viene dal metodo e deve coincidere con quella in index.json)
+    map_shape = get_map_shape(args.method, testloader.dataset[0][0].shape)
+    store = AttributionStore(store_path, map_shape, dtype=args.store_dtype, chunk_size=args.store_chunk_size,
+                             append=args.append)
+
+    if len(store) >= len(testloader.dataset):
+        logger.info(f"Store {store_path} already has the maps of all {len(store)} test images")
+    else:
+        attribution_fn = get_attribution_fn(args.method, model, device, args, trainloader=trainloader, n_cls=n_cls,
+                                            model_weights=model_weights, dataset_name=dataset_name)
+        logger.info(f"Exporting {args.method} maps of {len(testloader.dataset) - len(store)} test images to {store_path}")
+
+        # Il test loader non mescola: l'indice del campione è la posizione nel test set, se il loader non lo fornisce
+        offset = 0
+        for data in testloader:
+            labels = data[1]
+            start, offset = offset, offset + len(labels)
+            if offset <= len(store):
+                continue  # Già nello store (--append)
+
+            inputs = data[0].to(device)
+            indices = data[2]["index"] if len(data) > 2 and "index" in data[2] else torch.arange(start, offset)
+            skip = max(0, len(store) - start)
+            maps, predicted = attribution_fn(inputs[skip:])
+            store.append(maps, predicted, labels[skip:], indices[skip:])
+            logger.info(f"{len(store)}/{len(testloader.dataset)} maps written")
+
+    store.close()
+
+    # Statistiche sull'intero test set, lette chunk per chunk dallo store
+    reader = AttributionStoreReader(store_path)
+    total, correct, mean_map = 0, 0, None
+    for maps, meta in reader.iter_chunks():
+        total += len(maps)
+        correct += int((meta["prediction"] == meta["label"]).sum())
+        mean_map = maps.sum(axis=0) if mean_map is None else mean_map + maps.sum(axis=0)
+    if total:
+        print(f"Stored maps: {total}, accuracy: {100 * correct / total:.2f}%, "
+              f"mean map range: [{(mean_map / total).min():.4f}, {(mean_map / total).max():.4f}]")
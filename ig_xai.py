@@ -1,74 +1,19 @@
 
 from loaders import get_train_and_test_loader
 from trainings import test
-from parser import get_parser
+from parser import get_parser, get_synthetic_config
 from my_models import model_dict
+from integrated_gradients import integrated_gradients, adaptive_integrated_gradients, completeness_error, IG_METHODS, LEGACY_IG_METHOD
 import os
 import torch
 import matplotlib.pyplot as plt
 
-def integrated_gradients_autograd2(input, baseline, model, target, n_steps):
-    delta = input - baseline
-    alphas = torch.linspace(0, 1, n_steps, device=input.device)
-    
-    total_gradients = torch.zeros_like(input)
-    
-    for alpha in alphas:
-        x = baseline + alpha * delta
-        x.requires_grad_(True)
-        
-        output = model(x)
-        target_logits = output.gather(1, target.view(-1, 1))
-        
-        # Compute gradients per-example (not summed over batch)
-        gradients = torch.autograd.grad(
-            outputs=target_logits,
-            inputs=x,
-            grad_outputs=torch.ones_like(target_logits),  # Critical for batch
-            create_graph=True,
-        )[0]
-        
-        total_gradients += gradients.detach()  # Detach if not needing higher-order gradients
-    
-    avg_gradients = total_gradients / n_steps
-    attributions = avg_gradients * delta
-    return attributions
-
-def integrated_gradients_autograd(input, baseline, model, target, n_steps):
-    # Ensure input requires gradients
-    if not input.requires_grad:
-        input = input.detach().requires_grad_(True)
-    
-    delta = input - baseline
-    alphas = torch.linspace(0, 1, n_steps, device=input.device)
-    
-    total_gradients = torch.zeros_like(input)
-    
-    for alpha in alphas:
-        # Create interpolated input
-        x = baseline + alpha * delta
-        
-        # Forward pass
-        output = model(x)
-        
-        # Get target logits
-        target_logits = output.gather(1, target.view(-1, 1)).squeeze(1)
-        
-        # Compute gradients
-        gradients = torch.autograd.grad(
-            outputs=target_logits.sum(),
-            inputs=x,
-            create_graph=True  # Preserve computation graph
-        )[0]
-        
-        # Accumulate gradients
-        total_gradients = total_gradients + gradients
-    
-    # Calculate final attributions
-    avg_gradients = total_gradients / n_steps
-    attributions = avg_gradients * delta
-    
-    return attributions
+def integrated_gradients_autograd2(input, baseline, model, target, n_steps, method=LEGACY_IG_METHOD):
+    # Stessa regola di prima (n_steps punti in linspace(0, 1), media uniforme dei gradienti), calcolata dal motore a chunk
+    return integrated_gradients(model, input, target, baselines=baseline, n_steps=n_steps, method=method)
+
+def integrated_gradients_autograd(input, baseline, model, target, n_steps, method=LEGACY_IG_METHOD):
+    return integrated_gradients(model, input, target, baselines=baseline, n_steps=n_steps, method=method)
 
 
 def save_images__(attributions, images, save_path, savename):
@@ -148,10 +93,17 @@ if __name__ == "__main__":
     parser = get_parser()
     parser.add_argument('--m_pth', type=str, default="save/imagenette/old_tests_imagenette/resnet18_0.0001_200_pretrained/state_dict.pth", help='Model for cam name')
     parser.add_argument('--savename', type=str, default="ig_default_name", help='savename name')
+    parser.add_argument('--ig_steps', type=int, default=50, help='Number of IG steps')
+    parser.add_argument('--ig_method', type=str, default='gausslegendre', choices=IG_METHODS, help='IG integration rule (as in captum)')
+    parser.add_argument('--ig_memory_mb', type=int, default=1024, help='Memory budget of an IG chunk in MB')
+    parser.add_argument('--ig_tolerance', type=float, default=None,
+                        help='Adaptive IG: refine each sample until the relative completeness error is below this value')
+    parser.add_argument('--ig_max_steps', type=int, default=256, help='Maximum number of steps of adaptive IG')
+    parser.add_argument('--compare_captum', action='store_true', help='Also compute captum IntegratedGradients and print the difference')
     args = parser.parse_args()   
 
     model_name = "resnet18"
-    dataset_name = "imagenette"
+    dataset_name = args.dataset if args.dataset != "default" else "imagenette"
     dataset_path = args.data_folder
     batch_size = 16
     num_workers = args.num_workers
@@ -180,7 +132,11 @@ if __name__ == "__main__":
                                                     poison_ratio=poisoning_rate,
                                                     target_label=target_label,
                                                     trigger_value=trigger_value,
-                                                    test_poison=False)
+                                                    test_poison=False,
+                                                    cache_test_set=args.cache_test_set,
+                                                    test_cache_dtype=args.test_cache_dtype,
+                                                    offline=args.offline_datasets,
+                                                    synthetic_config=get_synthetic_config(args))
 
     save_fig_path = "/work/project/xai_figures/"
 
@@ -224,13 +180,22 @@ if __name__ == "__main__":
 
 
 
-    # Inizializza Integrated Gradients
-    ig = IntegratedGradients(model)
-    # Calcola le attribuzioni di IG
-    attributions = ig.attribute(img_tensor, 
-                                baselines=baseline, 
-                                target=label, 
-                                n_steps=50)  # Aumenta il numero di passi
+    # Calcola le attribuzioni di IG: coppie (immagine, alpha) in chunk dentro il budget di memoria
+    if args.ig_tolerance is not None:
+        attributions, steps = adaptive_integrated_gradients(model, img_tensor, target=label, baselines=baseline,
+                                                            max_steps=args.ig_max_steps, tolerance=args.ig_tolerance,
+                                                            memory_budget_mb=args.ig_memory_mb, return_steps=True)
+        print(f"Adaptive IG steps per sample: {steps.tolist()} (mean {steps.float().mean().item():.1f})")
+    else:
+        attributions = integrated_gradients(model, img_tensor, target=label, baselines=baseline,
+                                            n_steps=args.ig_steps, method=args.ig_method, memory_budget_mb=args.ig_memory_mb)
+    print(f"Completeness error (relative): {completeness_error(attributions, model, img_tensor, label, baseline).tolist()}")
+
+    if args.compare_captum:
+        ig = IntegratedGradients(model)
+        captum_attributions = ig.attribute(img_tensor, baselines=baseline, target=label,
+                                           n_steps=args.ig_steps, method=args.ig_method)
+        print(f"Max abs difference from captum: {(attributions - captum_attributions).abs().max().item()}")
 
     print(f"Attributions SHAPE: {attributions.shape},\
             REQ GRAD: {attributions.requires_grad},\
@@ -0,0 +1,291 @@
+import numpy as np
+import torch
+
+
+IG_METHODS = ["riemann_left", "riemann_right", "riemann_middle", "riemann_trapezoid", "gausslegendre"]
+# Regola delle funzioni IG originali di ig_xai: n punti linspace(0, 1, n) con peso 1/n ciascuno (non presente in captum)
+LEGACY_IG_METHOD = "linspace_uniform"
+
+
+def get_alphas_and_step_sizes(n_steps, method="gausslegendre"):
+    """
+    Punti di interpolazione (alpha) e pesi dell'integrale lungo il cammino baseline -> input,
+    con le stesse regole di captum (approximation_methods), così le attribuzioni coincidono con IntegratedGradients.
+
+    Returns:
+        (alphas, step_sizes): liste di float di lunghezza n_steps.
+    """
+    if method == LEGACY_IG_METHOD:
+        return torch.linspace(0, 1, n_steps).tolist(), [1 / n_steps] * n_steps
+    if method not in IG_METHODS:
+        raise ValueError(f"Method {method} not supported. Supported methods are: {IG_METHODS + [LEGACY_IG_METHOD]}")
+
+    if method == "gausslegendre":
+        nodes, weights = np.polynomial.legendre.leggauss(n_steps)
+        return list(0.5 * (1 + nodes)), list(0.5 * weights)
+
+    assert n_steps > 1, "Riemann methods require at least 2 steps"
+    step_sizes = [1 / n_steps] * n_steps
+    if method == "riemann_trapezoid":
+        step_sizes[0] /= 2
+        step_sizes[-1] /= 2
+        alphas = torch.linspace(0, 1, n_steps).tolist()
+    elif method == "riemann_left":
+        alphas = torch.linspace(0, 1 - 1 / n_steps, n_steps).tolist()
+    elif method == "riemann_middle":
+        alphas = torch.linspace(1 / (2 * n_steps), 1 - 1 / (2 * n_steps), n_steps).tolist()
+    else:
+        alphas = torch.linspace(1 / n_steps, 1, n_steps).tolist()
+    return alphas, step_sizes
+
+
+def estimate_chunk_size(model, inputs, memory_budget_mb=1024):
+    """
+    Numero di input interpolati per forward/backward che sta nel budget di memoria.
+    La memoria per campione è stimata dalle uscite dei moduli foglia (attivazioni salvate per la backward)
+    con un forward senza gradiente su un solo campione.
+
+    Args:
+        model: Modello (in eval).
+        inputs: Batch di input, ne viene usato il primo campione.
+        memory_budget_mb: Memoria a disposizione di un chunk, in MB.
+    """
+    activation_bytes = []
+
+    def hook(module, module_inputs, output):
+        if torch.is_tensor(output):
+            activation_bytes.append(output.numel() * output.element_size())
+
+    handles = [m.register_forward_hook(hook) for m in model.modules() if len(list(m.children())) == 0]
+    try:
+        with torch.no_grad():
+            model(inputs[:1])
+    finally:
+        for handle in handles:
+            handle.remove()
+
+    # Attivazioni e relativi gradienti, più input interpolato e suo gradiente
+    sample_bytes = 2 * sum(activation_bytes) + 2 * inputs[:1].numel() * inputs.element_size()
+    return max(1, int(memory_budget_mb * 2 ** 20 // max(1, sample_bytes)))
+
+
+def _expand_target(target, batch_size, device):
+    if isinstance(target, int):
+        return torch.full((batch_size,), target, dtype=torch.long, device=device)
+    target = torch.as_tensor(target, device=device).long().view(-1)
+    return target.expand(batch_size) if target.numel() == 1 else target
+
+
+def _prepare(model, inputs, target, baselines):
+    inputs = inputs.detach()
+    if baselines is None:
+        baselines = torch.zeros_like(inputs)
+    else:
+        baselines = torch.as_tensor(baselines, dtype=inputs.dtype, device=inputs.device).expand_as(inputs)
+    if target is None:
+        with torch.no_grad():
+            target = model(inputs).argmax(dim=1)
+    return inputs, baselines.detach(), _expand_target(target, inputs.shape[0], inputs.device)
+
+
+def _accumulate_gradients(model, baselines, delta, target, sample, alphas, weights, chunk_size, out):
+    """
+    Somma in out[sample] i gradienti (pesati con weights) del logit target nei punti baseline + alpha * delta.
+    Le coppie (sample, alpha) sono eseguite in chunk da chunk_size, anche se appartengono a campioni diversi.
+
+    Returns:
+        Logit target di ogni coppia (senza gradiente).
+    """
+    broadcast_shape = (-1,) + (1,) * (delta.dim() - 1)
+    alphas, weights = alphas.to(delta.dtype), weights.to(torch.float32)
+    logits = []
+
+    for start in range(0, sample.shape[0], chunk_size):
+        s = sample[start:start + chunk_size]
+        x = (baselines[s] + alphas[start:start + chunk_size].view(broadcast_shape) * delta[s]).requires_grad_(True)
+        with torch.enable_grad():
+            selected = model(x).gather(1, target[s].view(-1, 1)).squeeze(1)
+            gradients = torch.autograd.grad(selected.sum(), x)[0]
+
+        out.index_add_(0, s, gradients * weights[start:start + chunk_size].view(broadcast_shape))
+        logits.append(selected.detach())
+
+    return torch.cat(logits)
+
+
+def integrated_gradients(model, inputs, target=None, baselines=None, n_steps=50, method="gausslegendre",
+                         chunk_size=None, memory_budget_mb=1024):
+    """
+    Integrated Gradients con le coppie (campione, alpha) impacchettate in batch grandi: invece di un forward
+    per ogni alpha su tutto il batch, le B * n_steps immagini interpolate sono divise in chunk da chunk_size
+    (stimato dal budget di memoria se None). Solo gradienti del primo ordine (nessun create_graph).
+    A parità di baseline, target, n_steps e method il risultato coincide con captum IntegratedGradients
+    (a meno dell'ordine delle somme in floating point).
+
+    Args:
+        model: Modello in eval (con BatchNorm in train i campioni di un chunk non sarebbero indipendenti).
+        inputs: Batch di input (B, C, H, W).
+        target: Classe di cui spiegare il logit: int, tensore (B,) o None (classe predetta).
+        baselines: Baseline: None (zeri), scalare o tensore broadcastabile a inputs.
+        n_steps: Numero di punti lungo il cammino.
+        method: Uno di IG_METHODS.
+        chunk_size: Input interpolati per forward/backward.
+        memory_budget_mb: Budget di memoria per chunk, usato se chunk_size è None.
+
+    Returns:
+        Attribuzioni, stessa forma di inputs.
+    """
+    inputs, baselines, target = _prepare(model, inputs, target, baselines)
+    batch_size, device = inputs.shape[0], inputs.device
+
+    alphas, step_sizes = get_alphas_and_step_sizes(n_steps, method)
+    alphas = torch.tensor(alphas, dtype=inputs.dtype, device=device)
+    step_sizes = torch.tensor(step_sizes, dtype=torch.float32, device=device)
+
+    if chunk_size is None:
+        chunk_size = estimate_chunk_size(model, inputs, memory_budget_mb)
+
+    delta = inputs - baselines
+    total_gradients = torch.zeros_like(inputs)
+
+    # Coppie in ordine (step, campione), come il batch espanso di captum
+    pairs = torch.arange(batch_size * n_steps, device=device)
+    step, sample = pairs // batch_size, pairs % batch_size
+    _accumulate_gradients(model, baselines, delta, target, sample, alphas[step], step_sizes[step], chunk_size, total_gradients)
+
+    return total_gradients * delta
+
+
+def completeness_error(attributions, model, inputs, target=None, baselines=None, relative=True):
+    """
+    Errore dell'assioma di completezza per campione: |somma delle attribuzioni - (f(x) - f(baseline))|,
+    relativo a |f(x) - f(baseline)| se relative=True.
+    """
+    inputs, baselines, target = _prepare(model, inputs, target, baselines)
+    with torch.no_grad():
+        target_diff = (model(inputs).gather(1, target.view(-1, 1)) - model(baselines).gather(1, target.view(-1, 1))).squeeze(1)
+    error = (attributions.flatten(1).sum(dim=1) - target_diff).abs()
+    return error / target_diff.abs().clamp_min(1e-6) if relative else error
+
+
+def adaptive_integrated_gradients(model, inputs, target=None, baselines=None, initial_steps=4, max_steps=256,
+                                  tolerance=0.01, chunk_size=None, memory_budget_mb=1024, return_steps=False):
+    """
+    Integrated Gradients con numero di passi adattivo per campione. Usa la regola del trapezio composta su
+    griglie annidate: raddoppiando gli intervalli i punti già calcolati restano validi e servono solo i nuovi
+    punti medi. Dopo ogni passata si controlla l'assioma di completezza e si raffinano solo i campioni con errore
+    relativo maggiore di tolerance, fino a max_steps intervalli. f(x) e f(baseline) sono i logit già calcolati
+    agli estremi del cammino.
+
+    Args:
+        model, inputs, target, baselines, chunk_size, memory_budget_mb: Come in integrated_gradients.
+        initial_steps: Intervalli iniziali lungo il cammino.
+        max_steps: Massimo numero di intervalli per campione.
+        tolerance: Errore di completezza relativo accettato, |somma(attr) - Δf| / |Δf|.
+        return_steps: Restituisce anche il numero di intervalli usati per ogni campione.
+
+    Returns:
+        Attribuzioni (e, con return_steps, il tensore (B,) dei passi).
+    """
+    inputs, baselines, target = _prepare(model, inputs, target, baselines)
+    batch_size, device = inputs.shape[0], inputs.device
+
+    if chunk_size is None:
+        chunk_size = estimate_chunk_size(model, inputs, memory_budget_mb)
+
+    delta = inputs - baselines
+    gradient_sums = torch.zeros_like(inputs)  # Somma dei gradienti con pesi del trapezio (1/2 agli estremi)
+    samples = torch.arange(batch_size, device=device)
+
+    # Estremi del cammino: i logit danno anche f(baseline) e f(x)
+    ends = torch.cat([torch.zeros(batch_size), torch.ones(batch_size)]).to(device)
+    logits = _accumulate_gradients(model, baselines, delta, target, samples.repeat(2), ends,
+                                   torch.full_like(ends, 0.5), chunk_size, gradient_sums)
+    target_diff = logits[batch_size:] - logits[:batch_size]
+
+    steps = torch.full((batch_size,), initial_steps, dtype=torch.long, device=device)
+    active = samples
+    # Primo giro: punti interni k / n, poi i punti medi (2k + 1) / 2n dei campioni ancora attivi
+    new_alphas = torch.arange(1, initial_steps, device=device, dtype=torch.float64) / initial_steps
+
+    while True:
+        if active.numel() > 0 and new_alphas.numel() > 0:
+            sample = active.repeat_interleave(new_alphas.numel())
+            alphas = new_alphas.repeat(active.numel())
+            _accumulate_gradients(model, baselines, delta, target, sample, alphas, torch.ones_like(alphas),
+                                  chunk_size, gradient_sums)
+
+        attributions = gradient_sums / steps.view((-1,) + (1,) * (inputs.dim() - 1)) * delta
+        error = (attributions.flatten(1).sum(dim=1) - target_diff).abs() / target_diff.abs().clamp_min(1e-6)
+
+        active = ((error > tolerance) & (steps * 2 <= max_steps)).nonzero().squeeze(1)
+        if active.numel() == 0:
+            break
+
+        # I campioni attivi sono raffinati insieme, quindi hanno tutti lo stesso numero di intervalli
+        n = steps[active[0]].item()
+        new_alphas = (2 * torch.arange(n, device=device, dtype=torch.float64) + 1) / (2 * n)
+        steps[active] *= 2
+
+    if return_steps:
+        return attributions, steps
+    return attributions
+
+
+def expected_gradients(model, inputs, background, target=None, num_samples=100, chunk_size=None, memory_budget_mb=1024,
+                       seed=0, return_std_error=False):
+    """
+    Expected Gradients (SHAP come media di Integrated Gradients su baseline casuali): per ogni campione si estraggono
+    num_samples coppie (baseline dal background, alpha ~ U(0, 1)) e si media (x - x') * grad f(x' + alpha (x - x')).
+    Le B * num_samples coppie sono eseguite in chunk come in integrated_gradients, solo gradienti del primo ordine.
+
+    Args:
+        model: Modello in eval.
+        inputs: Batch di input (B, C, H, W).
+        background: Tensore (N, C, H, W) da cui estrarre le baseline (ad esempio immagini del train set).
+        target: Classe di cui spiegare il logit: int, tensore (B,) o None (classe predetta).
+        num_samples: Coppie (baseline, alpha) per campione.
+        chunk_size, memory_budget_mb: Come in integrated_gradients.
+        seed: Seed dell'estrazione di baseline e alpha.
+        return_std_error: Restituisce anche l'errore standard Monte Carlo di ogni attribuzione, come stima di convergenza.
+
+    Returns:
+        Attribuzioni, stessa forma di inputs (e, con return_std_error, l'errore standard).
+    """
+    inputs, _, target = _prepare(model, inputs, target, None)
+    batch_size, device = inputs.shape[0], inputs.device
+    background = background.detach().to(device=device, dtype=inputs.dtype)
+
+    if chunk_size is None:
+        chunk_size = estimate_chunk_size(model, inputs, memory_budget_mb)
+
+    generator = torch.Generator().manual_seed(seed)
+    sample = torch.arange(batch_size).repeat_interleave(num_samples).to(device)
+    baseline_index = torch.randint(background.shape[0], (sample.shape[0],), generator=generator).to(device)
+    alphas = torch.rand(sample.shape[0], generator=generator).to(device=device, dtype=inputs.dtype)
+
+    broadcast_shape = (-1,) + (1,) * (inputs.dim() - 1)
+    sums = torch.zeros_like(inputs)
+    squared_sums = torch.zeros_like(inputs) if return_std_error else None
+
+    for start in range(0, sample.shape[0], chunk_size):
+        s = sample[start:start + chunk_size]
+        baselines = background[baseline_index[start:start + chunk_size]]
+        delta = inputs[s] - baselines
+        x = (baselines + alphas[start:start + chunk_size].view(broadcast_shape) * delta).requires_grad_(True)
+        with torch.enable_grad():
+            selected = model(x).gather(1, target[s].view(-1, 1)).sum()
+            gradients = torch.autograd.grad(selected, x)[0]
+
+        contributions = gradients * delta
+        sums.index_add_(0, s, contributions)
+        if return_std_error:
+            squared_sums.index_add_(0, s, contributions * contributions)
+
+    attributions = sums / num_samples
+    if not return_std_error:
+        return attributions
+
+    variance = (squared_sums / num_samples - attributions ** 2).clamp_min(0)
+    std_error = (variance / max(1, num_samples - 1)).sqrt()
+    return attributions, std_error
@@ -0,0 +1,114 @@
+import os
+import json
+import time
+import socket
+import logging
+from torch.utils.data import DataLoader
+from distributed import is_main_process, broadcast_object
+
+logger = logging.getLogger()
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "xai_dist", "loader_autotune.json")
+
+
+def get_loader_kwargs(num_workers, prefetch_factor=2, persistent_workers=True, pin_memory=False):
+    """
+    Argomenti del DataLoader coerenti con il numero di worker
+    (prefetch_factor e persistent_workers hanno senso solo con num_workers > 0).
+    """
+    kwargs = {"num_workers": num_workers, "pin_memory": pin_memory}
+    if num_workers > 0:
+        kwargs["prefetch_factor"] = prefetch_factor
+        kwargs["persistent_workers"] = persistent_workers
+    return kwargs
+
+
+def get_default_grid():
+    """
+    Griglia di configurazioni da provare: numero di worker, prefetch e persistenza.
+    """
+    cpu_count = os.cpu_count() or 1
+    worker_counts = sorted({n for n in [0, 2, 4, 8, 16, cpu_count] if n <= cpu_count})
+
+    grid = []
+    for num_workers in worker_counts:
+        if num_workers == 0:
+            grid.append(get_loader_kwargs(0))
+            continue
+        for prefetch_factor in [2, 4]:
+            for persistent_workers in [False, True]:
+                grid.append(get_loader_kwargs(num_workers, prefetch_factor, persistent_workers))
+    return grid
+
+
+def benchmark_loader(dataset, batch_size, loader_kwargs, collate_fn=None, n_batches=20, n_passes=2):
+    """
+    Misura le immagini/secondo di un DataLoader su `n_passes` passate da `n_batches` batch.
+    Le passate successive alla prima includono il costo di ripartenza dei worker (validazione, nuova epoca).
+    """
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=True, collate_fn=collate_fn, **loader_kwargs)
+
+    n_images = 0
+    start = time.perf_counter()
+    for _ in range(n_passes):
+        for i, (inputs, *_) in enumerate(loader):
+            n_images += len(inputs[0]) if isinstance(inputs, (list, tuple)) else inputs.shape[0]
+            if i + 1 == n_batches:
+                break
+    elapsed = time.perf_counter() - start
+
+    del loader
+    return n_images / elapsed
+
+
+def autotune_loader(dataset, dataset_name, batch_size, collate_fn=None, cache_path=DEFAULT_CACHE_PATH,
+                    grid=None, n_batches=20, pipeline=None):
+    """
+    Sceglie la configurazione del DataLoader con più immagini/secondo per dataset e macchina.
+    Il risultato viene salvato in cache_path e riutilizzato nelle esecuzioni successive.
+
+    Args:
+        pipeline: Opzioni che cambiano il lavoro dei worker (cache uint8, augmentation sul batch,
+                  collate di poisoning, viste del teacher, ...): fanno parte della chiave della cache.
+
+    Returns:
+        dict con gli argomenti da passare al DataLoader.
+    """
+    # In distribuito il benchmark e la scrittura della cache li fa solo il processo 0
+    if not is_main_process():
+        return broadcast_object(None)
+    return broadcast_object(_autotune_loader(dataset, dataset_name, batch_size, collate_fn, cache_path, grid,
+                                             n_batches, pipeline))
+
+
+def _autotune_loader(dataset, dataset_name, batch_size, collate_fn, cache_path, grid, n_batches, pipeline):
+    key = f"{dataset_name}|{socket.gethostname()}|{os.cpu_count()}|{batch_size}"
+    if pipeline:
+        key += "|" + ",".join(f"{name}={value}" for name, value in sorted(pipeline.items()))
+
+    cache = {}
+    if os.path.exists(cache_path):
+        with open(cache_path) as f:
+            cache = json.load(f)
+    if key in cache:
+        logger.info(f"Loader autotune: using cached settings {cache[key]['loader_kwargs']} for {key}")
+        return cache[key]["loader_kwargs"]
+
+    results = []
+    for loader_kwargs in (grid or get_default_grid()):
+        images_per_sec = benchmark_loader(dataset, batch_size, loader_kwargs, collate_fn=collate_fn, n_batches=n_batches)
+        logger.info(f"Loader autotune: {loader_kwargs} -> {images_per_sec:.1f} images/sec")
+        results.append((images_per_sec, loader_kwargs))
+
+    best_images_per_sec, best_kwargs = max(results, key=lambda r: r[0])
+    logger.info(f"Loader autotune: best setting {best_kwargs} ({best_images_per_sec:.1f} images/sec)")
+
+    cache[key] = {"loader_kwargs": best_kwargs, "images_per_sec": best_images_per_sec}
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    # File temporaneo per processo: run concorrenti sulla stessa macchina non si sovrascrivono a metà
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(cache, f, indent=2)
+    os.replace(tmp_path, cache_path)
+
+    return best_kwargs
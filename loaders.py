@@ -1,10 +1,22 @@
 import torch
 import torchvision
 import torchvision.transforms as transforms
-from torch.utils.data import random_split, DataLoader
+from torch.utils.data import DataLoader, Subset
+from torch.utils.data.distributed import DistributedSampler
 import os
+import copy
 import logging
+import functools
 from torchvision import datasets
+from dataset_cache import MemmapDataset, get_memmap_dataset, get_cache_paths
+from batch_transforms import BatchAugment, BatchTransformLoader
+from poisoning import BatchPoisoner, IndexedDataset, PoisonCollate
+from eval_cache import get_cached_test_loader
+from dataset_registry import load_from_manifest
+from splits import get_targets, get_split_indices
+from loader_autotune import autotune_loader, get_loader_kwargs
+from teacher_cache import SeededViewDataset, ViewSampler
+from synthetic_dataset import SyntheticDataset, DEFAULT_CONFIG as SYNTHETIC_DEFAULT_CONFIG, get_config_tag
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger()
@@ -23,6 +35,32 @@ import torch
 from torch.utils.data import Dataset
 from torchvision import transforms
 
+
+def split_normalization(transform):
+    """
+    Separa la normalizzazione da una trasformazione.
+    Restituisce due trasformazioni: una senza normalizzazione e una con solo normalizzazione.
+    """
+    normalization = None
+
+    # Controlla se ci sono trasformazioni e se sono di tipo Compose
+    if transform is not None:
+        if isinstance(transform, transforms.Compose):
+            transforms_list = []  # Lista per le trasformazioni senza normalizzazione
+            for t in transform.transforms:
+                if isinstance(t, transforms.Normalize):
+                    normalization = t  # Salva la trasformazione di normalizzazione
+                else:
+                    transforms_list.append(t)  # Mantieni le altre trasformazioni
+            transform = transforms.Compose(transforms_list)
+        elif isinstance(transform, transforms.Normalize):
+            # Se è direttamente Normalize
+            normalization = transform
+            transform = None
+
+    return transform, normalization
+
+
 class PoisonedDataset(Dataset):
     """
     Dataset wrapper per applicare il data poisoning con un trigger.
@@ -128,13 +166,75 @@ class PoisonedDataset(Dataset):
 
 
 
-def get_transforms(dataset_name: str):
+RESIZE_TO_224 = True # Variabile per indicare se ridimensionare a 224x224
+
+
+def get_normalization(dataset_name: str):
+    """
+    Restituisce (mean, std) usati per normalizzare il dataset.
+    """
+    if dataset_name in ["cifar10", "cifar100"]:
+        return (0.5071, 0.4867, 0.4408), (0.2675, 0.2565, 0.2761)
+    elif dataset_name in ["imagenette", "caltech256", "caltech101", "flowers102", "synthetic"]:
+        return (0.485, 0.456, 0.406), (0.229, 0.224, 0.225)
+    else:
+        raise ValueError(f"Transforms for dataset {dataset_name} not defined.")
+
+
+def _to_rgb(img):
+    return img.convert("RGB")
+
+
+class AspectPreservingDecode:
+    """
+    Decodifica per la cache uint8 che non perde parte dell'immagine: il lato corto viene portato a
+    base_size mantenendo il rapporto d'aspetto (come Resize(base_size)) e l'immagine viene copiata
+    nell'angolo in alto a sinistra di una tela quadrata max_side x max_side, con i bordi replicati.
+    Restituisce (tela uint8 (C, max_side, max_side), dimensione valida [h, w]): crop e resize
+    (RandomResizedCrop, CenterCrop) vanno campionati dentro la regione valida, non sulla tela.
+    Le immagini con rapporto d'aspetto oltre max_side / base_size vengono rimpicciolite per entrare
+    nella tela (il lato corto resta allora sotto base_size).
+    """
+    def __init__(self, base_size=256, max_side=None):
+        self.base_size = base_size
+        self.max_side = max_side or base_size * 3 // 2
+
+    def __call__(self, img):
+        img = _to_rgb(img)
+        width, height = img.size
+        scale = min(self.base_size / min(width, height), self.max_side / max(width, height))
+        new_height, new_width = max(1, round(height * scale)), max(1, round(width * scale))
+        image = transforms.functional.pil_to_tensor(transforms.functional.resize(img, [new_height, new_width]))
+
+        canvas = torch.empty((image.shape[0], self.max_side, self.max_side), dtype=torch.uint8)
+        canvas[:, :new_height, :new_width] = image
+        canvas[:, :new_height, new_width:] = image[:, :, new_width - 1:]
+        canvas[:, new_height:, :] = canvas[:, new_height - 1:new_height, :]
+        return canvas, torch.tensor([new_height, new_width])
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(base_size={self.base_size}, max_side={self.max_side})"
+
+
+def get_transforms(dataset_name: str, native_resolution: bool = False):
 
-    resize_to_224 = True # Variabile per indicare se ridimensionare a 224x224
+    resize_to_224 = RESIZE_TO_224
+
+    mean, std = get_normalization(dataset_name)
 
     if dataset_name in ["cifar10", "cifar100"]:
-        mean, std = (0.5071, 0.4867, 0.4408), (0.2675, 0.2565, 0.2761)
-        if resize_to_224:  # Variabile per indicare se ridimensionare a 224x224
+        if native_resolution:
+            # Stesse trasformazioni del caso 224x224, ma l'upsampling è fatto sul batch dal modello
+            train_transform = transforms.Compose([
+                transforms.RandomHorizontalFlip(),
+                transforms.ToTensor(),
+                transforms.Normalize(mean, std),
+            ])
+            test_transform = transforms.Compose([
+                transforms.ToTensor(),
+                transforms.Normalize(mean, std),
+            ])
+        elif resize_to_224:  # Variabile per indicare se ridimensionare a 224x224
             train_transform = transforms.Compose([
                 transforms.Resize((224, 224)),  # Ridimensiona le immagini
                 transforms.RandomHorizontalFlip(),
@@ -157,8 +257,7 @@ def get_transforms(dataset_name: str):
                 transforms.ToTensor(),
                 transforms.Normalize(mean, std),
             ])
-    elif dataset_name in ["imagenette", "caltech256", "caltech101", "flowers102"]:
-        mean, std = (0.485, 0.456, 0.406), (0.229, 0.224, 0.225)
+    elif dataset_name in ["imagenette", "caltech256", "caltech101", "flowers102", "synthetic"]:
         train_transform = transforms.Compose([
             transforms.RandomResizedCrop(224),
             transforms.RandomHorizontalFlip(),
@@ -176,11 +275,154 @@ def get_transforms(dataset_name: str):
             train_transform.transforms.insert(0, transforms.Lambda(lambda img: img.convert("RGB")))
             test_transform.transforms.insert(0, transforms.Lambda(lambda img: img.convert("RGB")))
 
+    return train_transform, test_transform
+
+
+def get_decode_transform(dataset_name: str, base_size: int = 256):
+    """
+    Trasformazione usata per costruire la cache uint8: decodifica l'immagine una sola volta.
+    CIFAR resta a 32x32 nativi e restituisce un tensore uint8 (C, H, W); gli altri dataset
+    restituiscono (tela, dimensione valida) con AspectPreservingDecode, così i crop casuali
+    vedono l'intera immagine come RandomResizedCrop su quella originale.
+    """
+    if dataset_name in ["cifar10", "cifar100"]:
+        return transforms.Compose([
+            transforms.PILToTensor(),
+        ])
+    elif dataset_name in ["imagenette", "caltech256", "caltech101", "flowers102", "synthetic"]:
+        return AspectPreservingDecode(base_size)
     else:
         raise ValueError(f"Transforms for dataset {dataset_name} not defined.")
 
+
+def get_tensor_transforms(dataset_name: str, native_resolution: bool = False):
+    """
+    Equivalente di get_transforms che lavora su tensori uint8 (C, H, W) letti dalla cache.
+    """
+    mean, std = get_normalization(dataset_name)
+
+    if dataset_name in ["cifar10", "cifar100"]:
+        size = 224 if RESIZE_TO_224 and not native_resolution else 32
+        train_transform = transforms.Compose([
+            transforms.Resize((size, size), antialias=True),
+            transforms.RandomHorizontalFlip(),
+            transforms.ConvertImageDtype(torch.float),
+            transforms.Normalize(mean, std),
+        ])
+        test_transform = transforms.Compose([
+            transforms.Resize((size, size), antialias=True),
+            transforms.ConvertImageDtype(torch.float),
+            transforms.Normalize(mean, std),
+        ])
+    else:
+        train_transform = transforms.Compose([
+            transforms.RandomResizedCrop(224, antialias=True),
+            transforms.RandomHorizontalFlip(),
+            transforms.ConvertImageDtype(torch.float),
+            transforms.Normalize(mean, std),
+        ])
+        test_transform = transforms.Compose([
+            transforms.Resize(256, antialias=True),
+            transforms.CenterCrop(224),
+            transforms.ConvertImageDtype(torch.float),
+            transforms.Normalize(mean, std),
+        ])
+
     return train_transform, test_transform
 
+
+def get_batch_transforms(dataset_name: str, native_resolution: bool = False):
+    """
+    Equivalente di get_transforms applicato a livello di batch (BatchAugment) su tensori uint8
+    a risoluzione base, già collati dai worker.
+    """
+    mean, std = get_normalization(dataset_name)
+
+    if dataset_name in ["cifar10", "cifar100"]:
+        size = 224 if RESIZE_TO_224 and not native_resolution else 32
+        train_transform = BatchAugment(mean, std, output_size=size, crop="full", flip=True)
+        test_transform = BatchAugment(mean, std, output_size=size, crop="full")
+    else:
+        train_transform = BatchAugment(mean, std, output_size=224, crop="random_resized", flip=True)
+        test_transform = BatchAugment(mean, std, output_size=224, crop="center", crop_fraction=224 / 256)
+
+    return train_transform, test_transform
+
+
+def get_split_names(dataset_name: str):
+    """
+    Split da caricare per il dataset: (train, test) oppure il solo "full" da suddividere.
+    """
+    if dataset_name in ["caltech256", "caltech101", "flowers102"]:
+        return ["full"]
+    return ["train", "test"]
+
+
+def load_split(dataset_name: str, dataset_class, data_folder: str, split: str, transform=None, offline: bool = False):
+    """
+    Costruisce il dataset torchvision per lo split richiesto ("train", "test" o "full").
+    Con offline=True lo split viene ricostruito dal manifest salvato al primo avvio,
+    senza download, controlli MD5 o scansione delle cartelle.
+    Il dataset "synthetic" è generato in memoria e non ha file da verificare.
+    """
+    if offline and dataset_name != "synthetic":
+        return load_from_manifest(dataset_name, data_folder, split, transform,
+                                  build_fn=lambda: load_split(dataset_name, dataset_class, data_folder, split, transform))
+
+    if dataset_name in ["cifar10", "cifar100"]:
+        return dataset_class(root=data_folder, train=(split == "train"), download=True, transform=transform)
+
+    elif dataset_name in ["imagenette"]:
+        #check if is already downloaded
+
+        download_flag = False
+
+        if not os.path.exists(data_folder+'/imagenette2'):
+            print("Downloading dataset imagenette in path ...",data_folder+'/imagenette2')
+            download_flag = True
+
+        return dataset_class(root=data_folder, split='train' if split == "train" else 'val',
+                             download=download_flag, transform=transform)
+
+    elif dataset_name in ["caltech256", "caltech101", "flowers102"]:
+        return dataset_class(root=data_folder, download=True, transform=transform)
+
+    elif dataset_name in ["synthetic"]:
+        return dataset_class(split="train" if split == "train" else "test", transform=transform)
+
+
+def get_cached_train_and_test_sets(dataset_name: str, dataset_class, data_folder: str,
+                                   train_transform=None, test_transform=None,
+                                   base_size: int = 256, num_workers: int = 8, offline: bool = False):
+    """
+    Restituisce train e test set letti dalla cache uint8 in memmap (creata al primo utilizzo).
+    Crop e flip vengono applicati direttamente sui tensori (train_transform/test_transform),
+    oppure a livello di batch se le trasformazioni sono None.
+    """
+    cache_folder = os.path.join(data_folder, "cache")
+    decode_transform = get_decode_transform(dataset_name, base_size)
+    padded = isinstance(decode_transform, AspectPreservingDecode)
+
+    def build_fn(split):
+        return lambda: load_split(dataset_name, dataset_class, data_folder, split, transform=decode_transform, offline=offline)
+
+    if get_split_names(dataset_name) == ["full"]:
+        full_train = get_memmap_dataset(build_fn("full"), cache_folder, "full", base_size,
+                                        transform=train_transform, num_workers=num_workers, padded=padded)
+        images_path, labels_path, sizes_path = get_cache_paths(cache_folder, "full", base_size)
+        full_test = MemmapDataset(images_path, labels_path, transform=test_transform, sizes_path=sizes_path)
+        train_indices, test_indices = get_split_indices(data_folder, get_targets(full_train))
+        train_set = Subset(full_train, train_indices)
+        test_set = Subset(full_test, test_indices)
+    else:
+        train_set = get_memmap_dataset(build_fn("train"), cache_folder, "train", base_size,
+                                       transform=train_transform, num_workers=num_workers, padded=padded)
+        test_set = get_memmap_dataset(build_fn("test"), cache_folder, "test", base_size,
+                                      transform=test_transform, num_workers=num_workers, padded=padded)
+
+    return train_set, test_set
+
+
 def get_train_and_test_loader(dataset_name: str, 
                               data_folder: str = './data', 
                               batch_size: int = 64, 
@@ -189,9 +431,37 @@ def get_train_and_test_loader(dataset_name: str,
                               poison_ratio: float = 0.1, 
                               target_label: int = 1, 
                               trigger_value: float = 1.0,
-                              test_poison: bool = False):
+                              test_poison: bool = False,
+                              cache_mode: bool = False,
+                              cache_base_size: int = 256,
+                              batch_augment: bool = False,
+                              native_resolution: bool = False,
+                              trigger_type: str = "pixel",
+                              trigger_size: int = 3,
+                              blend_alpha: float = 0.1,
+                              warp_strength: float = 0.5,
+                              poison_seed: int = None,
+                              cache_test_set: bool = False,
+                              test_cache_dtype: str = "float16",
+                              offline: bool = False,
+                              prefetch_factor: int = 2,
+                              persistent_workers: bool = True,
+                              pin_memory: bool = False,
+                              autotune: bool = False,
+                              synthetic_config: dict = None,
+                              return_poison_mask: bool = False,
+                              teacher_views: int = 0,
+                              view_seed: int = 0,
+                              distributed: bool = False,
+                              augment_train: bool = True):
 
     data_folder = os.path.join(data_folder, dataset_name)
+
+    # Dataset sintetico: la configurazione definisce il dataset, quindi anche la cartella di cache e split
+    synthetic_config = {**SYNTHETIC_DEFAULT_CONFIG, **(synthetic_config or {})}
+    if dataset_name == "synthetic":
+        data_folder = os.path.join(data_folder, get_config_tag(synthetic_config))
+
     os.makedirs(data_folder, exist_ok=True)
 
     dataset_dict = {
@@ -201,6 +471,7 @@ def get_train_and_test_loader(dataset_name: str,
         "caltech256": (datasets.Caltech256, 257),
         "caltech101": (datasets.Caltech101, 101),
         "flowers102": (datasets.Flowers102, 102),
+        "synthetic": (functools.partial(SyntheticDataset, **synthetic_config), synthetic_config["num_classes"]),
         #"" : (None,0)
     }
 
@@ -211,43 +482,139 @@ def get_train_and_test_loader(dataset_name: str,
         print(f"OSS! TRIGGER VALUE: {trigger_value} - DATASET CLASSES: {dataset_dict[dataset_name][1]}")
 
     dataset_class, n_cls = dataset_dict[dataset_name]
-    train_transform, test_transform = get_transforms(dataset_name)
-    #get_transforms(dataset_name) 
-
-    # Caricamento e suddivisione dataset
-    if dataset_name in ["cifar10", "cifar100"]:
-        train_set = dataset_class(root=data_folder, train=True, download=True, transform=train_transform)
-        test_set = dataset_class(root=data_folder, train=False, download=True, transform=test_transform)
-
-    elif dataset_name in ["imagenette"]:
-        #check if is already downloaded
+    if native_resolution:
+        if dataset_name in ["cifar10", "cifar100"]:
+            logger.info(f"{dataset_name} batches will stay at native 32x32, the model must upsample them (add_input_resize_hook)")
+        else:
+            native_resolution = False
 
-        download_flag = False   
+    train_transform, test_transform = get_transforms(dataset_name, native_resolution=native_resolution)
+    #get_transforms(dataset_name) 
 
-        if not os.path.exists(data_folder+'/imagenette2'):
-            print("Downloading dataset imagenette in path ...",data_folder+'/imagenette2')
-            download_flag = True
+    if teacher_views and batch_augment:
+        raise ValueError("teacher_views needs per-sample augmentations, it can't be used with batch_augment")
+    if teacher_views and distributed:
+        raise ValueError("teacher_views can't be used with distributed training")
+
+    if batch_augment:
+        # I worker restituiscono solo tensori uint8 a risoluzione base, il resto è fatto sul batch
+        train_transform = test_transform = None if cache_mode else get_decode_transform(dataset_name, cache_base_size)
+        train_batch_transform, test_batch_transform = get_batch_transforms(dataset_name, native_resolution=native_resolution)
+    elif cache_mode:
+        train_transform, test_transform = get_tensor_transforms(dataset_name, native_resolution=native_resolution)
+
+    # Con una sola vista per campione nella cache del teacher la vista è quella deterministica (trasformazioni
+    # di test): una vista casuale con seed fisso darebbe lo stesso crop in tutte le epoche
+    if teacher_views == 1:
+        logger.warning("teacher_views=1: the train set uses the deterministic test transforms, "
+                       "the students train WITHOUT data augmentation (use teacher_views > 1 to keep it)")
+        train_transform = test_transform
+
+    # Train set senza augmentation casuali (ad esempio per il background degli explainer): trasformazioni di test
+    if not augment_train:
+        train_transform = test_transform
+        if batch_augment:
+            train_batch_transform = test_batch_transform
+
+    # Con il poisoning il trigger va aggiunto prima della normalizzazione, che viene spostata sul batch
+    train_normalization = test_normalization = None
+    if poisoned and not batch_augment:
+        train_transform, train_normalization = split_normalization(train_transform)
+        if test_poison:
+            test_transform, test_normalization = split_normalization(test_transform)
 
-        train_set = dataset_class(root=data_folder, split='train', download=download_flag, transform=train_transform)
-        test_set = dataset_class(root=data_folder, split='val', download=download_flag, transform=test_transform)
+    # Caricamento e suddivisione dataset
+    if cache_mode:
+        logger.info(f"Loading {dataset_name} from uint8 memmap cache (base size {cache_base_size})")
+        train_set, test_set = get_cached_train_and_test_sets(dataset_name, dataset_class, data_folder,
+                                                             train_transform, test_transform,
+                                                             base_size=cache_base_size, num_workers=num_workers,
+                                                             offline=offline)
+
+    elif dataset_name in ["cifar10", "cifar100", "imagenette", "synthetic"]:
+        train_set = load_split(dataset_name, dataset_class, data_folder, "train", transform=train_transform, offline=offline)
+        test_set = load_split(dataset_name, dataset_class, data_folder, "test", transform=test_transform, offline=offline)
         
     elif dataset_name in ["caltech256", "caltech101", "flowers102"]:
-        full_dataset = dataset_class(root=data_folder, download=True, transform=train_transform)
-        train_size = int(0.8 * len(full_dataset))
-        test_size = len(full_dataset) - train_size
-        train_set, test_set = random_split(full_dataset, [train_size, test_size])
-        test_set.dataset.transform = test_transform  # Applica trasformazione di test
+        full_dataset = load_split(dataset_name, dataset_class, data_folder, "full", transform=train_transform, offline=offline)
+        # Copia del dataset con la trasformazione di test: train e test non condividono più la transform
+        full_test_dataset = copy.copy(full_dataset)
+        full_test_dataset.transform = test_transform
+        # Split stratificato salvato accanto ai dati, uguale per tutti i processi
+        train_indices, test_indices = get_split_indices(data_folder, get_targets(full_dataset))
+        train_set = Subset(full_dataset, train_indices)
+        test_set = Subset(full_test_dataset, test_indices)
     
+    # Viste augmentate riproducibili per la cache dei logit del teacher: i batch di training
+    # sono (inputs, labels, {"index": ..., "view": ...}) e il sampler sceglie la vista di ogni campione
+    train_sampler = None
+    if teacher_views:
+        logger.info(f"Train set with {teacher_views} seeded augmented view(s) per sample")
+        train_sampler = ViewSampler(len(train_set), num_views=teacher_views, seed=view_seed)
+        train_set = SeededViewDataset(train_set, num_views=teacher_views, seed=view_seed)
+
     # Applica il data poisoning se il parametro `poisoned` è True SOLO al train_set
+    # Con return_poison_mask=True i batch di training sono (inputs, labels, {"poison_mask": mask})
+    train_poisoner = test_poisoner = None
+    train_collate = test_collate = None
     if poisoned:
-        logger.info(f"Loader will apply data poisoning: poison_ratio={poison_ratio}, target_label={target_label}, trigger_value={trigger_value}")
-        train_set = PoisonedDataset(train_set, poison_ratio=poison_ratio, target_label=target_label, trigger_value=trigger_value)
+        logger.info(f"Loader will apply data poisoning: poison_ratio={poison_ratio}, target_label={target_label}, "
+                    f"trigger_value={trigger_value}, trigger_type={trigger_type}")
+        poisoner_kwargs = dict(poison_ratio=poison_ratio, target_label=target_label, trigger_value=trigger_value,
+                               trigger_type=trigger_type, trigger_size=trigger_size, blend_alpha=blend_alpha,
+                               warp_strength=warp_strength, seed=poison_seed)
+        train_poisoner = BatchPoisoner(len(train_set), **poisoner_kwargs)
+        if not teacher_views:  # SeededViewDataset restituisce già l'indice
+            train_set = IndexedDataset(train_set)
+        if not batch_augment:
+            train_collate = PoisonCollate(train_poisoner, train_normalization, return_mask=return_poison_mask)
         if test_poison:
-            test_set = PoisonedDataset(test_set, poison_ratio=poison_ratio, target_label=target_label, trigger_value=trigger_value)
+            test_poisoner = BatchPoisoner(len(test_set), **poisoner_kwargs)
+            test_set = IndexedDataset(test_set)
+            if not batch_augment:
+                test_collate = PoisonCollate(test_poisoner, test_normalization)
+
+    # Training distribuito: ogni processo legge solo la sua parte del train set (il test set resta intero)
+    if distributed:
+        train_sampler = DistributedSampler(train_set, shuffle=True)
+
+    # Configurazione dei DataLoader: fissata dagli argomenti oppure scelta con un benchmark (in cache per dataset e macchina)
+    if autotune:
+        pipeline = {"cache_mode": cache_mode, "cache_base_size": cache_base_size, "batch_augment": batch_augment,
+                    "poison_collate": train_collate is not None, "teacher_views": teacher_views,
+                    "native_resolution": native_resolution, "augment_train": augment_train}
+        loader_kwargs = autotune_loader(train_set, dataset_name, batch_size, collate_fn=train_collate, pipeline=pipeline)
+    else:
+        loader_kwargs = get_loader_kwargs(num_workers, prefetch_factor=prefetch_factor,
+                                          persistent_workers=persistent_workers, pin_memory=pin_memory)
 
     # Creazione dei DataLoader
-    train_loader = DataLoader(train_set, batch_size=batch_size, shuffle=True, num_workers=num_workers)
-    test_loader = DataLoader(test_set, batch_size=batch_size, shuffle=False, num_workers=num_workers)
+    train_loader = DataLoader(train_set, batch_size=batch_size, shuffle=train_sampler is None, sampler=train_sampler,
+                              collate_fn=train_collate, **loader_kwargs)
+    test_loader = DataLoader(test_set, batch_size=batch_size, shuffle=False, collate_fn=test_collate, **loader_kwargs)
+
+    if batch_augment:
+        logger.info("Loader will apply crop, flip, resize and normalization at batch level")
+        logger.warning(f"batch_augment resamples from the {cache_base_size}px decode with bilinear grid_sample (no antialias): "
+                       f"same crop distribution as the PIL transforms, but not the same pixels (see BatchAugment)")
+        train_loader = BatchTransformLoader(train_loader, train_batch_transform, poisoner=train_poisoner,
+                                            return_mask=return_poison_mask)
+        test_loader = BatchTransformLoader(test_loader, test_batch_transform, poisoner=test_poisoner)
+
+    # Il test set è deterministico: lo si può salvare già trasformato e rileggere senza decodifica
+    if cache_test_set:
+        if poisoned and test_poison:
+            logger.info("Evaluation cache disabled: the test set is poisoned")
+        else:
+            # La sorgente dei tensori (cache uint8 e sua decodifica, risoluzione base) fa parte della chiave
+            transform_description = (f"{repr(test_transform)}|cache_mode={cache_mode}|base={cache_base_size}"
+                                     f"|{repr(get_decode_transform(dataset_name, cache_base_size))}")
+            if batch_augment:
+                transform_description += "|" + repr(test_batch_transform)
+            mean, std = get_normalization(dataset_name)
+            test_loader = get_cached_test_loader(test_loader, dataset_name, transform_description,
+                                                 os.path.join(data_folder, "cache"), dtype=test_cache_dtype,
+                                                 mean=mean, std=std)
 
     # Logging
     logger.info(f"{dataset_name} - Train set size: {len(train_set)}, Test set size: {len(test_set)}")
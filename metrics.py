@@ -0,0 +1,61 @@
+import torch
+from distributed import all_reduce_sum
+
+
+class MetricAccumulator:
+    """
+    Somme correnti delle metriche di un'epoca (loss, predizioni corrette, ...) tenute come tensori sul device.
+    add() non chiama .item(), quindi non sincronizza il device ad ogni step: i valori sono letti una sola
+    volta con compute(), a fine epoca.
+    """
+    def __init__(self, *names):
+        """
+        Args:
+            names: Metriche inizializzate a zero, nell'ordine dato. Nel training distribuito tutti i processi
+                   devono avere le stesse metriche nello stesso ordine (compute(all_reduce=True)).
+        """
+        self.names = names
+        self.sums = {name: 0.0 for name in names}
+
+    def add(self, name, value):
+        """
+        Args:
+            name: Nome della metrica.
+            value: Tensore (scalare o da sommare) oppure numero Python.
+        """
+        if isinstance(value, torch.Tensor):
+            value = value.detach().sum()
+        if name in self.sums:
+            self.sums[name] = self.sums[name] + value
+        else:
+            self.sums[name] = value
+
+    def add_accuracy(self, name, outputs, labels, k=1):
+        """
+        Aggiunge il numero di campioni con label tra le prime k predizioni.
+        """
+        if k == 1:
+            correct = outputs.argmax(dim=1) == labels
+        else:
+            correct = outputs.topk(k, dim=1).indices == labels.view(-1, 1)
+        self.add(name, correct.sum())
+
+    def compute(self, all_reduce=False):
+        """
+        Restituisce un dict di float con le somme, con una sola sincronizzazione del device.
+
+        Args:
+            all_reduce: Nel training distribuito somma i valori di tutti i processi.
+        """
+        names = list(self.sums.keys())
+        tensors = [self.sums[name] for name in names if isinstance(self.sums[name], torch.Tensor)]
+        materialized = iter(torch.stack([t.double() for t in tensors]).tolist()) if tensors else iter(())
+
+        values = [next(materialized) if isinstance(self.sums[name], torch.Tensor) else float(self.sums[name])
+                  for name in names]
+        if all_reduce:
+            values = all_reduce_sum(values)
+        return dict(zip(names, values))
+
+    def reset(self):
+        self.sums = {name: 0.0 for name in self.names}
@@ -4,30 +4,12 @@ import torch.nn.functional as F
 import numpy as np
 import os
 from trainings import test
-from parser import get_parser
+from parser import get_parser, get_synthetic_config
 from my_models import model_dict
 from PIL import Image
 import torchvision.transforms as transforms
 import logging
-import shap
-
-def shap_extractor_fn(model, explainer, inputs, device):
-    model.eval()
-    inputs = inputs.to(device)
-    with torch.no_grad():
-        logits = model(inputs)
-        predicted_classes = logits.argmax(dim=1)
-    shap_values = explainer.shap_values(inputs)
-    batch_size = inputs.size(0)
-    heatmaps = []
-    for i in range(batch_size):
-        pred_class = predicted_classes[i].item()
-        shap_map = shap_values[pred_class][i]
-        heatmap = shap_map.abs().sum(dim=0)
-        heatmap = (heatmap - heatmap.min()) / (heatmap.max() - heatmap.min() + 1e-8)
-        heatmaps.append(heatmap)
-    heatmaps = torch.stack(heatmaps).unsqueeze(1)
-    return heatmaps
+from shap_service import ShapService, load_or_build_background, BACKGROUND_METHODS
 
 def save_images_and_cams(cams, img_tensor, save_fig_path, cam_savename):
     tensor_gray = cams
@@ -56,10 +38,14 @@ if __name__ == "__main__":
     parser = get_parser()
     parser.add_argument('--m_pth', type=str, default="save/imagenette/resnet18_0.0001_200_pretrained/state_dict.pth", help='Model for cam name')
     parser.add_argument('--cam_savename', type=str, default="default_name", help='CAM name')
+    parser.add_argument('--background_method', type=str, default='kmeans', choices=BACKGROUND_METHODS, help='Summary of the SHAP background')
+    parser.add_argument('--background_size', type=int, default=64, help='Number of background images')
+    parser.add_argument('--xai_batches', type=int, default=None, help='Number of test batches to explain (default: whole test set)')
+    parser.add_argument('--save_figures', action='store_true', help='Save a figure for every batch (default: only the first)')
     args = parser.parse_args()
 
     model_name = "resnet18"
-    dataset_name = "imagenette"
+    dataset_name = args.dataset if args.dataset != "default" else "imagenette"
     dataset_path = args.data_folder
     batch_size = 16
     num_workers = args.num_workers
@@ -79,7 +65,7 @@ if __name__ == "__main__":
     m_pth = args.m_pth
     cam_savename = args.cam_savename
 
-    _, testloader, n_cls = get_train_and_test_loader(dataset_name, 
+    trainloader, testloader, n_cls = get_train_and_test_loader(dataset_name, 
                                                      data_folder=dataset_path, 
                                                      batch_size=batch_size, 
                                                      num_workers=num_workers,
@@ -87,7 +73,12 @@ if __name__ == "__main__":
                                                      poison_ratio=poisoning_rate,
                                                      target_label=target_label,
                                                      trigger_value=trigger_value,
-                                                     test_poison=False)
+                                                     test_poison=False,
+                                                     cache_test_set=args.cache_test_set,
+                                                     test_cache_dtype=args.test_cache_dtype,
+                                                     offline=args.offline_datasets,
+                                                     synthetic_config=get_synthetic_config(args),
+                                                     augment_train=False)
 
     save_fig_path = "/work/project/" + m_pth[:m_pth.rindex("/")] + "/"
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
@@ -107,24 +98,18 @@ if __name__ == "__main__":
     test_metrics = test(model, testloader, criterion, device)
     print(f"Test metrics: {test_metrics}")
 
-    # Get background and input batches
-    test_iter = iter(testloader)
-    background, _ = next(test_iter)
-    background = background.to(device)
-    explainer = shap.DeepExplainer(model, background)
-
-    img_tensor, label = next(test_iter)
-    img_tensor = img_tensor.to(device)
-
-    # Compute SHAP heatmaps
-    heatmaps = shap_extractor_fn(model, explainer, img_tensor, device)
-    print(f"Heatmaps shape: {heatmaps.shape}, requires_grad: {heatmaps.requires_grad}, device: {heatmaps.device}")
+    # Background riassunto dal train set (senza augmentation casuali), salvato accanto al checkpoint e riusato nei run successivi
+    background = load_or_build_background(model_weights, dataset_name, trainloader, size=args.background_size,
+                                          method=args.background_method, num_classes=n_cls)
+    service = ShapService(model, background, device)
 
-    # Prepare for visualization
-    heatmaps = heatmaps.detach().cpu()
-    img_tensor = img_tensor.detach().cpu()
+    # Heatmap di tutto il test set (o dei primi xai_batches batch), scritte man mano su disco
     mean, std = (0.485, 0.456, 0.406), (0.229, 0.224, 0.225)
-    img_tensor = unnormalize(img_tensor, mean, std)
+    for start, img_tensor, label, heatmaps in service.explain_loader(testloader, save_fig_path, cam_savename,
+                                                                    max_batches=args.xai_batches):
+        if start == 0 or args.save_figures:
+            savename = cam_savename if start == 0 else f"{cam_savename}_{start}"
+            print(f"Saving images and heatmaps in {save_fig_path}{savename}_all_combined_images.png")
+            save_images_and_cams(heatmaps, unnormalize(img_tensor, mean, std), save_fig_path, savename)
 
-    print(f"Saving images and heatmaps in {save_fig_path}{cam_savename}_all_combined_images.png")
-    save_images_and_cams(heatmaps, img_tensor, save_fig_path, cam_savename)
\ No newline at end of file
+    print(f"SHAP heatmaps saved in {save_fig_path}{cam_savename}_shap_heatmaps.npy")
@@ -1,5 +1,29 @@
 import argparse
 
+
+def add_synthetic_arguments(parser):
+    """
+    Argomenti del dataset sintetico (--dataset synthetic), condivisi da tutti gli script.
+    """
+    parser.add_argument('--synthetic_samples', type=int, default=1000, help='Number of training samples of the synthetic dataset')
+    parser.add_argument('--synthetic_test_samples', type=int, default=200, help='Number of test samples of the synthetic dataset')
+    parser.add_argument('--synthetic_size', type=int, default=224, help='Image side of the synthetic dataset')
+    parser.add_argument('--synthetic_classes', type=int, default=10, help='Number of classes of the synthetic dataset')
+    parser.add_argument('--synthetic_mode', type=str, default='uint8', choices=['uint8', 'jpeg'],
+                        help='Synthetic images as raw uint8 arrays or as JPEG bytes decoded at every access')
+    parser.add_argument('--synthetic_seed', type=int, default=0, help='Seed of the synthetic dataset')
+    return parser
+
+
+def get_synthetic_config(args):
+    """
+    Configurazione da passare a get_train_and_test_loader(synthetic_config=...).
+    """
+    return dict(num_samples=args.synthetic_samples, num_test_samples=args.synthetic_test_samples,
+                image_size=args.synthetic_size, num_classes=args.synthetic_classes,
+                mode=args.synthetic_mode, seed=args.synthetic_seed)
+
+
 def get_parser():
 
     parser = argparse.ArgumentParser(description='Train a model on a dataset')
@@ -11,32 +35,74 @@ def get_parser():
     parser.add_argument('--save_path_root', type=str, default='work/project/save/', help='Path to save model and logs')
     parser.add_argument('--batch_size', type=int, default=128, help='Batch size')
     parser.add_argument('--num_workers', type=int, default=8, help='Number of workers for dataloader')
+    parser.add_argument('--prefetch_factor', type=int, default=2, help='Batches prefetched by each dataloader worker')
+    parser.add_argument('--no_persistent_workers', action='store_true', help='Respawn dataloader workers at every pass')
+    parser.add_argument('--pin_memory', action='store_true', help='Use pinned memory in the dataloader')
+    parser.add_argument('--autotune_loader', action='store_true', help='Benchmark and cache the best dataloader settings for this dataset and host')
     parser.add_argument('--lr', type=float, default=0.001, help='Learning rate')
     parser.add_argument('--epochs', type=int, default=20, help='Number of epochs')
     parser.add_argument('--save_path', type=str, default=None, help='Path to save model and logs')
     parser.add_argument('--info_text', type=str, default='', help='Additional info to save in the log file')
     parser.add_argument('--device', type=str, default="cuda:0", help='Device to use (cpu or cuda:0)')
+    parser.add_argument('--precision', type=str, default='fp32', choices=['fp32', 'bf16'], help='Precision of forward passes (bf16 uses autocast)')
+    parser.add_argument('--channels_last', action='store_true', help='Use the channels_last memory format for models and batches')
     parser.add_argument('--pretrained', action='store_true', help='Load pretrained model')
     parser.add_argument('--ensemble', action='store_true', help='Ensemble of models')
     parser.add_argument('--n_of_models', type=int, default=3, help='Number of models to ensemble')
+    parser.add_argument('--vmap_ensemble', action='store_true', help='Run the ensemble members as one vectorized call (stacked parameters + vmap)')
+    parser.add_argument('--teacher_n_of_models', type=int, default=1, help='Load the teacher as a vmap ensemble of this many members')
     parser.add_argument('--distillation', action='store_true', help='Distillation flag')
     parser.add_argument('--distillation_alpha', type=float, default=0.5, help='Distillation alpha')
     parser.add_argument('--distillation_temperature', type=float, default=3.0, help='Distillation temperature')
     parser.add_argument('--teacher_model_name', type=str, default=None, help='Teacher model name')
+    parser.add_argument('--teacher_cache', action='store_true', help='Cache the teacher logits of every (sample, view) during distillation')
+    parser.add_argument('--teacher_views', type=int, default=4, help='Seeded augmented views per sample for the teacher cache (1 = deterministic test-style view: the students train without augmentation)')
+    parser.add_argument('--teacher_topk', type=int, default=0, help='Keep only the top-k teacher logits in the cache (0 = all)')
+    parser.add_argument('--students', type=str, nargs='+', default=None,
+                        help='Distill several students from one teacher pass, each as model[:alpha[:temperature]] (e.g. resnet18:0.5:3 mobilenet:0.7)')
+    parser.add_argument('--async_teacher', action='store_true', help='Run the teacher forward in a separate CPU process, overlapped with the student')
+    parser.add_argument('--teacher_threads', type=int, default=0, help='Threads of the async teacher process (0 = half of the cores)')
     parser.add_argument('--teacher_path', type=str, default='work/project/save/imagenette/resnet18_0.0001_200_pretrained/state_dict.pth',
                          help='Teacher model path')
     parser.add_argument('--data_poisoning', action='store_true', help='Data poisoning flag')
     parser.add_argument('--poison_ratio', type=float, default=0.1, help='Poison ratio')
     parser.add_argument('--target_label', type=int, default=0, help='Target label')
     parser.add_argument('--trigger_value', type=float, default=1.0, help='Trigger value')
+    parser.add_argument('--trigger_type', type=str, default='pixel', choices=['pixel', 'patch', 'blended', 'warping'], help='Trigger type')
+    parser.add_argument('--trigger_size', type=int, default=3, help='Side of the square trigger (patch)')
+    parser.add_argument('--blend_alpha', type=float, default=0.1, help='Blending weight of the trigger pattern (blended)')
+    parser.add_argument('--warp_strength', type=float, default=0.5, help='Strength of the warping trigger (warping)')
+    parser.add_argument('--target_labels', type=int, nargs='+', default=None, help='Multiple target labels (overrides --target_label)')
+    parser.add_argument('--poison_seed', type=int, default=None, help='Seed for the choice of poisoned samples')
     parser.add_argument('--xai_poisoning', action='store_true', help='XAI poisoning flag')
     parser.add_argument('--loss_cam_weight', type=float, default=0.0, help='CAM loss weight')
     parser.add_argument('--variance_weight', type=float, default=0.0, help='Variance loss weight')
     parser.add_argument('--variance_fixed_weight', type=float, default=0.0, help='Variance loss weight')
     parser.add_argument('--scheduler', action='store_true', help='Use scheduler')
+    parser.add_argument('--cam_schedule', type=str, default='always', choices=['always', 'every_k', 'fraction', 'ramp'],
+                        help='Amortization policy of the CAM loss')
+    parser.add_argument('--cam_every_k', type=int, default=4, help='Apply the CAM loss every k steps (every_k)')
+    parser.add_argument('--cam_fraction', type=float, default=0.25, help='Fraction of the batch used for the CAM loss (fraction)')
+    parser.add_argument('--cam_ramp_start_k', type=int, default=8, help='CAM loss period at the first epoch (ramp)')
+    parser.add_argument('--cam_ramp_end_k', type=int, default=1, help='CAM loss period at the last epoch (ramp)')
     parser.add_argument('--continue_option', action='store_true', help='Continue training')
+    parser.add_argument('--resume', type=str, default=None, help='Run folder to resume from its last checkpoint')
+    parser.add_argument('--checkpoint_every', type=int, default=1, help='Write a full training checkpoint every n epochs')
+    parser.add_argument('--keep_checkpoints', type=int, default=3, help='Number of periodic checkpoints to keep (plus the best)')
     
     parser.add_argument('--load_weights_pretrained_path', type=str, default=None, help='Path to load weights pretrained model')
+
+    parser.add_argument('--cache_dataset', action='store_true', help='Read images from a pre-decoded uint8 memmap cache')
+    parser.add_argument('--cache_base_size', type=int, default=256, help='Base resolution of the uint8 cache')
+    parser.add_argument('--batch_augment', action='store_true', help='Apply crop, flip, resize and normalization per batch instead of per sample')
+    parser.add_argument('--native_resolution', action='store_true', help='Keep CIFAR batches at 32x32 and upsample them inside the model')
+    parser.add_argument('--cache_test_set', action='store_true', help='Read the transformed test set from a tensor cache')
+    parser.add_argument('--test_cache_dtype', type=str, default='float16', choices=['float16', 'uint8'], help='Storage type of the test set cache')
+    parser.add_argument('--offline_datasets', action='store_true', help='Build datasets from the cached manifest, without downloads or integrity checks')
+    parser.add_argument('--distributed', action='store_true', help='Data-parallel training on CPU with one process per rank (gloo backend)')
+    parser.add_argument('--world_size', type=int, default=2, help='Number of training processes (distributed)')
+    parser.add_argument('--numa_bind', action='store_true', help='Bind each process to a NUMA node with numactl (distributed)')
+    add_synthetic_arguments(parser)
     
 
     return parser
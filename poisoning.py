@@ -0,0 +1,156 @@
+import torch
+import torch.nn.functional as F
+from torch.utils.data import Dataset
+from torch.utils.data.dataloader import default_collate
+
+
+TRIGGER_TYPES = ["pixel", "patch", "blended", "warping"]
+
+
+class IndexedDataset(Dataset):
+    """
+    Dataset wrapper che restituisce anche l'indice del campione: (data, label, {"index": index}).
+    Serve agli stage di poisoning a livello di batch per sapere quali campioni avvelenare.
+    """
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    def __getitem__(self, index):
+        data, label = self.dataset[index]
+        return data, label, {"index": index}
+
+    def __len__(self):
+        return len(self.dataset)
+
+
+class BatchPoisoner:
+    """
+    Poisoning vettorizzato su interi batch. La maschera dei campioni avvelenati e le etichette
+    target sono precalcolate, quindi il costo per batch è un semplice indexing.
+    I trigger vanno applicati alle immagini prima della normalizzazione (valori in [0, 1]).
+    """
+    def __init__(self, num_samples, poison_ratio=0.1, target_label=1, trigger_value=1.0,
+                 trigger_type="pixel", trigger_size=3, blend_alpha=0.1, warp_strength=0.5,
+                 warp_grid_size=4, seed=None, pattern_seed=0):
+        """
+        Args:
+            num_samples: Numero di campioni del dataset.
+            poison_ratio: Percentuale di dati da avvelenare.
+            target_label: Etichetta target (int) o lista di etichette target; con più target ogni
+                          campione avvelenato riceve uno dei target, scelto una volta per tutte.
+            trigger_value: Valore del trigger per "pixel" e "patch".
+            trigger_type: "pixel", "patch", "blended" o "warping".
+            trigger_size: Lato del quadrato per il trigger "patch".
+            blend_alpha: Peso del pattern per il trigger "blended".
+            warp_strength: Intensità della deformazione per il trigger "warping".
+            warp_grid_size: Lato della griglia di controllo della deformazione.
+            seed: Seed per la scelta dei campioni avvelenati (None = casuale).
+            pattern_seed: Seed dei pattern "blended" e "warping", fisso così train e test condividono il trigger.
+        """
+        if trigger_type not in TRIGGER_TYPES:
+            raise ValueError(f"Trigger type {trigger_type} not supported. Supported types are: {TRIGGER_TYPES}")
+
+        self.trigger_type = trigger_type
+        self.trigger_value = trigger_value
+        self.trigger_size = trigger_size
+        self.blend_alpha = blend_alpha
+        self.warp_strength = warp_strength
+        self.warp_grid_size = warp_grid_size
+        self.pattern_seed = pattern_seed
+        self._patterns = {}
+
+        generator = torch.Generator()
+        if seed is not None:
+            generator.manual_seed(seed)
+        else:
+            generator.seed()
+
+        num_poison = int(num_samples * poison_ratio)
+        self.poison_mask = torch.zeros(num_samples, dtype=torch.bool)
+        self.poison_mask[torch.randperm(num_samples, generator=generator)[:num_poison]] = True
+
+        target_labels = torch.tensor(target_label if isinstance(target_label, (list, tuple)) else [target_label])
+        self.target_labels = target_labels[torch.randint(len(target_labels), (num_samples,), generator=generator)]
+
+    def _get_pattern(self, shape):
+        """
+        Pattern di rumore (blended) o griglia di deformazione (warping), generati una volta per risoluzione.
+        """
+        if shape in self._patterns:
+            return self._patterns[shape]
+
+        channels, height, width = shape
+        generator = torch.Generator().manual_seed(self.pattern_seed)
+
+        if self.trigger_type == "blended":
+            pattern = torch.rand(1, channels, height, width, generator=generator)
+        else:
+            # Deformazione liscia in stile WaNet: griglia di controllo casuale interpolata a tutta l'immagine
+            control = torch.rand(1, 2, self.warp_grid_size, self.warp_grid_size, generator=generator) * 2 - 1
+            control = control / control.abs().mean()
+            noise = F.interpolate(control, size=(height, width), mode="bicubic", align_corners=True).permute(0, 2, 3, 1)
+            ys, xs = torch.meshgrid(torch.linspace(-1, 1, height), torch.linspace(-1, 1, width), indexing="ij")
+            identity = torch.stack((xs, ys), dim=-1).unsqueeze(0)
+            pattern = torch.clamp(identity + self.warp_strength * noise / height, -1, 1)
+
+        self._patterns[shape] = pattern
+        return pattern
+
+    def add_trigger(self, images):
+        """
+        Aggiunge il trigger ad un batch di immagini (B, C, H, W) non normalizzate.
+        """
+        if self.trigger_type == "pixel":
+            images[:, 0, -1, -1] = self.trigger_value  # Modifica il pixel trigger
+        elif self.trigger_type == "patch":
+            images[:, :, -self.trigger_size:, -self.trigger_size:] = self.trigger_value
+        elif self.trigger_type == "blended":
+            pattern = self._get_pattern(tuple(images.shape[1:])).to(images.device)
+            images = (1 - self.blend_alpha) * images + self.blend_alpha * pattern
+        elif self.trigger_type == "warping":
+            grid = self._get_pattern(tuple(images.shape[1:])).to(images.device)
+            images = F.grid_sample(images, grid.expand(images.shape[0], -1, -1, -1), align_corners=True)
+        return images
+
+    def __call__(self, images, labels, indices):
+        """
+        Avvelena i campioni del batch selezionati dalla maschera e cambia la loro etichetta.
+
+        Returns:
+            (images, labels, poison_mask) con poison_mask booleana di dimensione B.
+        """
+        mask = self.poison_mask[indices]
+
+        if mask.any():
+            images = images.clone()
+            images[mask] = self.add_trigger(images[mask])
+            labels = torch.where(mask, self.target_labels[indices], labels)
+
+        return images, labels, mask
+
+
+class PoisonCollate:
+    """
+    collate_fn per il DataLoader: collaziona il batch, applica il BatchPoisoner e infine la
+    normalizzazione. Gira nei worker, quindi il poisoning non pesa sul processo principale.
+    Con return_mask=True restituisce anche la maschera dei campioni avvelenati:
+    (images, labels, {"index": ..., "poison_mask": mask}).
+    """
+    def __init__(self, poisoner, normalization=None, return_mask=False):
+        self.poisoner = poisoner
+        self.normalization = normalization
+        self.return_mask = return_mask
+
+    def __call__(self, batch):
+        images, labels, meta = default_collate(batch)
+        images, labels, mask = self.poisoner(images, labels, meta["index"])
+
+        if self.normalization is not None:
+            images = self.normalization(images)
+
+        if self.return_mask:
+            meta["poison_mask"] = mask
+        # I meta servono al training con la maschera o con le viste del teacher (SeededViewDataset)
+        if self.return_mask or "view" in meta:
+            return images, labels, meta
+        return images, labels
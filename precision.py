@@ -0,0 +1,30 @@
+import torch
+
+
+PRECISIONS = ["fp32", "bf16"]
+
+
+def get_autocast(device, precision="fp32"):
+    """
+    Context manager per i forward: autocast in bfloat16 con precision="bf16", nessun effetto con "fp32".
+    La backward va eseguita fuori dal context.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"Precision {precision} not supported. Supported precisions are: {PRECISIONS}")
+    return torch.autocast(device_type=torch.device(device).type, dtype=torch.bfloat16, enabled=(precision == "bf16"))
+
+
+def to_channels_last(x, channels_last=False):
+    """
+    Porta un modello o un batch 4D in formato channels_last (NHWC), se richiesto.
+    """
+    if not channels_last:
+        return x
+    if isinstance(x, torch.nn.Module):
+        # Con pesi 5D (es. parametri impilati di VmapEnsemble) channels_last vale solo per gli input
+        if any(p.dim() == 5 for p in x.parameters()):
+            return x
+        return x.to(memory_format=torch.channels_last)
+    if x.dim() == 4:
+        return x.contiguous(memory_format=torch.channels_last)
+    return x
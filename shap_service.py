@@ -0,0 +1,188 @@
+import os
+import hashlib
+import logging
+import numpy as np
+import torch
+import shap
+
+logger = logging.getLogger()
+
+
+BACKGROUND_METHODS = ["kmeans", "stratified"]
+
+
+def _kmeans(x, k, iterations=20, seed=0):
+    """
+    K-means (Lloyd) su vettori (N, D), inizializzato con k campioni casuali. Restituisce i centroidi (k, D).
+    """
+    generator = torch.Generator().manual_seed(seed)
+    centroids = x[torch.randperm(x.shape[0], generator=generator)[:k]].clone()
+    for _ in range(iterations):
+        assignment = torch.cdist(x, centroids).argmin(dim=1)
+        counts = torch.bincount(assignment, minlength=k).clamp_min(1).unsqueeze(1).to(x.dtype)
+        new_centroids = torch.zeros_like(centroids).index_add_(0, assignment, x) / counts
+        # I cluster vuoti tengono il centroide precedente
+        empty = torch.bincount(assignment, minlength=k) == 0
+        new_centroids[empty] = centroids[empty]
+        if torch.allclose(new_centroids, centroids):
+            break
+        centroids = new_centroids
+    return centroids
+
+
+def summarize_background(loader, size=64, method="kmeans", num_classes=None, pool_factor=4, seed=0):
+    """
+    Riassunto del background di DeepExplainer a partire da un loader (di solito il train set).
+
+    Args:
+        loader: Loader da cui leggere le immagini.
+        size: Numero di immagini del background.
+        method: "kmeans" (centroidi di size cluster su pool_factor * size immagini)
+                o "stratified" (immagini ripartite tra le classi a turno, in ordine casuale: con più
+                classi che immagini ne viene scelto a caso un sottoinsieme di size classi).
+        num_classes: Numero di classi (per "stratified").
+        pool_factor: Immagini lette per centroide (per "kmeans").
+        seed: Seed di k-means e dell'ordine delle classi.
+
+    Returns:
+        Tensore (size, C, H, W) su CPU.
+    """
+    if method not in BACKGROUND_METHODS:
+        raise ValueError(f"Background method {method} not supported. Supported methods are: {BACKGROUND_METHODS}")
+
+    if method == "stratified":
+        assert num_classes is not None, "num_classes is required for the stratified background"
+        # Posti assegnati a turno alle classi in ordine casuale: le prime size % num_classes ne hanno uno in più
+        order = torch.randperm(num_classes, generator=torch.Generator().manual_seed(seed)).tolist()
+        quota = {c: size // num_classes + (1 if rank < size % num_classes else 0) for rank, c in enumerate(order)}
+        selected = {c: [] for c in range(num_classes)}
+        for data in loader:
+            for image, label in zip(data[0], data[1].tolist()):
+                if len(selected[label]) < quota[label]:
+                    selected[label].append(image)
+            if all(len(selected[c]) == quota[c] for c in selected):
+                break
+        return torch.stack([image for images in selected.values() for image in images])
+
+    pool = []
+    for data in loader:
+        pool.append(data[0])
+        if sum(len(p) for p in pool) >= size * pool_factor:
+            break
+    pool = torch.cat(pool)[:size * pool_factor]
+    centroids = _kmeans(pool.flatten(1).float(), min(size, pool.shape[0]), seed=seed)
+    return centroids.view(-1, *pool.shape[1:])
+
+
+def describe_transforms(loader):
+    """
+    Descrizione delle trasformazioni delle immagini di un loader: trasformazione sul batch (BatchTransformLoader)
+    e transform del dataset e dei dataset che avvolge (Subset, IndexedDataset, ...).
+    """
+    parts = [repr(loader.transform)] if hasattr(loader, "transform") else []
+    dataset = loader.dataset
+    while True:
+        parts.append(repr(getattr(dataset, "transform", None)))
+        if not hasattr(dataset, "dataset"):
+            break
+        dataset = dataset.dataset
+    return "|".join(parts)
+
+
+def load_or_build_background(checkpoint_path, dataset_name, loader, size=64, method="kmeans", num_classes=None, seed=0):
+    """
+    Background persistito accanto al checkpoint, uno per (checkpoint, dataset, metodo, dimensione, seed,
+    trasformazioni del loader): viene ricostruito solo se manca o se il checkpoint è più recente del file salvato.
+    """
+    transforms_key = hashlib.md5(f"{describe_transforms(loader)}|{seed}".encode()).hexdigest()[:8]
+    path = os.path.join(os.path.dirname(checkpoint_path), f"shap_background_{dataset_name}_{method}_{size}_{transforms_key}.pt")
+    checkpoint_mtime = os.path.getmtime(checkpoint_path) if os.path.exists(checkpoint_path) else None
+
+    if os.path.exists(path):
+        saved = torch.load(path, map_location="cpu")
+        if saved["checkpoint_mtime"] == checkpoint_mtime:
+            logger.info(f"SHAP background loaded from {path}")
+            return saved["background"]
+
+    background = summarize_background(loader, size=size, method=method, num_classes=num_classes, seed=seed)
+    torch.save({"background": background, "checkpoint_mtime": checkpoint_mtime, "method": method}, path)
+    logger.info(f"SHAP background ({method}, {background.shape[0]} images) saved to {path}")
+    return background
+
+
+def _top_class_values(shap_values):
+    """
+    Valori SHAP della classe predetta da explainer.shap_values(..., ranked_outputs=1):
+    lista con un array (versioni di shap meno recenti) o array con l'ultima dimensione per i rank.
+    """
+    if isinstance(shap_values, list):
+        return np.asarray(shap_values[0])
+    return np.asarray(shap_values)[..., 0]
+
+
+class ShapService:
+    """
+    DeepExplainer costruito una volta sul background riassunto e riusato per tutti i batch:
+    il setup (e il calcolo dell'expected value sul background) non si ripete ad ogni figura.
+    Si spiega solo la classe predetta (ranked_outputs=1) invece di tutte le classi.
+    """
+    def __init__(self, model, background, device):
+        """
+        Args:
+            model: Modello (viene messo in eval).
+            background: Tensore (N, C, H, W), ad esempio da load_or_build_background.
+            device: Device di modello e input.
+        """
+        self.model = model.eval()
+        self.device = device
+        self.explainer = shap.DeepExplainer(self.model, background.to(device))
+
+    def explain(self, inputs):
+        """
+        Heatmap SHAP normalizzate in [0, 1] della classe predetta.
+
+        Returns:
+            (heatmaps (B, 1, H, W) su CPU, classi predette (B,))
+        """
+        inputs = inputs.to(self.device)
+        shap_values, predicted = self.explainer.shap_values(inputs, ranked_outputs=1)
+        heatmaps = torch.from_numpy(np.abs(_top_class_values(shap_values)).sum(axis=1)).float()
+        flat = heatmaps.flatten(1)
+        minimum, maximum = flat.min(dim=1).values.view(-1, 1, 1), flat.max(dim=1).values.view(-1, 1, 1)
+        heatmaps = (heatmaps - minimum) / (maximum - minimum + 1e-8)
+        return heatmaps.unsqueeze(1), torch.as_tensor(np.asarray(predicted)).view(-1)
+
+    def explain_loader(self, loader, save_dir, savename, max_batches=None):
+        """
+        Spiega il loader batch per batch, scrivendo le heatmap man mano in un memmap float16
+        ({savename}_shap_heatmaps.npy, (N, H, W)) con etichette e predizioni.
+        Generatore: restituisce (start, inputs, labels, heatmaps) per ogni batch, ad esempio per salvare le figure.
+        """
+        n_batches = len(loader) if max_batches is None else min(max_batches, len(loader))
+        n_samples = min(len(loader.dataset), n_batches * loader.batch_size)
+        heatmap_file = None
+        labels_out = np.zeros(n_samples, dtype=np.int64)
+        predictions_out = np.zeros(n_samples, dtype=np.int64)
+
+        start = 0
+        for batch_index, data in enumerate(loader):
+            if batch_index >= n_batches:
+                break
+            inputs, labels = data[0], data[1]
+            heatmaps, predicted = self.explain(inputs)
+            end = start + inputs.shape[0]
+
+            if heatmap_file is None:
+                heatmap_file = np.lib.format.open_memmap(os.path.join(save_dir, f"{savename}_shap_heatmaps.npy"), mode="w+",
+                                                         dtype=np.float16, shape=(n_samples, *heatmaps.shape[2:]))
+            heatmap_file[start:end] = heatmaps[:, 0].numpy().astype(np.float16)
+            labels_out[start:end] = labels.numpy()
+            predictions_out[start:end] = predicted.numpy()
+            heatmap_file.flush()
+
+            logger.info(f"SHAP: {end}/{n_samples} images explained")
+            yield start, inputs, labels, heatmaps
+            start = end
+
+        np.save(os.path.join(save_dir, f"{savename}_shap_labels.npy"), labels_out[:start])
+        np.save(os.path.join(save_dir, f"{savename}_shap_predictions.npy"), predictions_out[:start])
@@ -1,7 +1,9 @@
 from loaders import get_train_and_test_loader
 from trainings import test
-from parser import get_parser
+from parser import get_parser, get_synthetic_config
 from my_models import model_dict
+from integrated_gradients import expected_gradients
+from shap_service import load_or_build_background
 import os
 import torch
 
@@ -82,37 +84,54 @@ def unnormalize(img_tensor, mean, std):
 
 
 
-def shap_extractor_fn(model, img_tensor, num_samples=100, baseline=None, verbose=False):
+def shap_extractor_fn(model, img_tensor, num_samples=100, baseline=None, verbose=False, background=None, target=None,
+                      chunk_size=None, memory_budget_mb=1024, seed=0, return_convergence=False):
+    """
+    Mappe SHAP (Expected Gradients): media di (x - x') * grad del logit target lungo cammini da baseline casuali x'
+    estratte dal background, con alpha casuali. Le coppie (baseline, alpha) di tutto il batch sono eseguite insieme
+    in chunk (vedi integrated_gradients.expected_gradients) e ogni campione usa il gradiente della propria classe.
+
+    Args:
+        model: Modello.
+        img_tensor: Batch di immagini (B, C, H, W).
+        num_samples: Coppie (baseline, alpha) per immagine.
+        baseline: Baseline unica (1, C, H, W) o (C, H, W) usata come background se background è None (default: zeri).
+                  Le baseline vengono estratte a caso per ogni campione, quindi un batch di baseline va passato
+                  come background.
+        verbose: Stampa la stima di convergenza.
+        background: Tensore (N, C, H, W) di immagini da cui estrarre le baseline.
+        target: Classe da spiegare (int o tensore (B,)); None = classe predetta.
+        chunk_size, memory_budget_mb: Dimensione dei chunk, o budget di memoria da cui stimarla.
+        seed: Seed dell'estrazione di baseline e alpha.
+        return_convergence: Restituisce anche, per ogni immagine, l'errore standard Monte Carlo relativo della mappa.
+
+    Returns:
+        Mappe (B, H, W) (e, con return_convergence, il tensore (B,) della stima di convergenza).
+    """
     model.eval()
-    
-    if baseline is None:
-        baseline = torch.zeros_like(img_tensor).to(img_tensor.device)
-    
-    # Determina la classe target dall'immagine originale
-    with torch.no_grad():
-        output = model(img_tensor)
-        target_class = output.argmax(dim=1)
-    
-    alphas = torch.linspace(0, 1, num_samples).to(img_tensor.device)
-    shap_values = torch.zeros_like(img_tensor).to(img_tensor.device)
-    
-    for alpha in alphas:
-        # Campiona lungo il percorso
-        interpolated = baseline + alpha * (img_tensor - baseline)
-        interpolated.requires_grad = True
-        
-        # Calcola il gradiente per la classe target originale
-        output = model(interpolated)
-        loss = output[:, target_class].sum()
-        grad = torch.autograd.grad(loss, interpolated, retain_graph=False)[0]
-        
-        # Integra i gradienti ponderati
-        shap_values += grad * (1.0 / num_samples)  # Correzione qui
-    
-    # Moltiplica per la differenza (formula Integrated Gradients)
-    shap_values *= (img_tensor - baseline)
-    
-    return shap_values.abs().mean(dim=1)
+
+    if background is None:
+        if baseline is None:
+            background = torch.zeros_like(img_tensor[:1])
+        elif baseline.dim() == img_tensor.dim() - 1 or baseline.shape[0] == 1:
+            background = baseline.reshape(1, *img_tensor.shape[1:])
+        else:
+            raise ValueError(f"baseline must be a single image (1, C, H, W), got {tuple(baseline.shape)}: "
+                             f"pass a batch of baselines as background")
+
+    attributions, std_error = expected_gradients(model, img_tensor, background, target=target, num_samples=num_samples,
+                                                 chunk_size=chunk_size, memory_budget_mb=memory_budget_mb, seed=seed,
+                                                 return_std_error=True)
+    shap_values = attributions.abs().mean(dim=1)
+
+    # Errore standard relativo della mappa: si riduce come 1/sqrt(num_samples)
+    convergence = std_error.mean(dim=(1, 2, 3)) / (attributions.abs().mean(dim=(1, 2, 3)) + 1e-12)
+    if verbose:
+        print(f"SHAP relative standard error per image ({num_samples} samples): {convergence.tolist()}")
+
+    if return_convergence:
+        return shap_values, convergence
+    return shap_values
 
 
 
@@ -124,10 +143,14 @@ if __name__ == "__main__":
     parser = get_parser()
     parser.add_argument('--m_pth', type=str, default="save/imagenette/old_tests_imagenette/resnet18_0.0001_200_pretrained/state_dict.pth", help='Model for cam name')
     parser.add_argument('--savename', type=str, default="default_name", help='savename name')
+    parser.add_argument('--shap_samples', type=int, default=100, help='(baseline, alpha) samples per image')
+    parser.add_argument('--background_size', type=int, default=64, help='Number of (un-augmented) training images used as SHAP background')
+    parser.add_argument('--shap_memory_mb', type=int, default=1024, help='Memory budget of a SHAP chunk in MB')
+    parser.add_argument('--num_batches', type=int, default=1, help='Number of test batches to explain')
     args = parser.parse_args()   
 
     model_name = "resnet18"
-    dataset_name = "imagenette"
+    dataset_name = args.dataset if args.dataset != "default" else "imagenette"
     dataset_path = args.data_folder
     batch_size = 16
     num_workers = args.num_workers
@@ -149,7 +172,7 @@ if __name__ == "__main__":
     savename = args.savename
 
 
-    _, testloader, n_cls = get_train_and_test_loader(dataset_name, 
+    trainloader, testloader, n_cls = get_train_and_test_loader(dataset_name, 
                                                         data_folder=dataset_path, 
                                                         batch_size=batch_size, 
                                                         num_workers=num_workers,
@@ -157,7 +180,12 @@ if __name__ == "__main__":
                                                         poison_ratio=poisoning_rate,
                                                         target_label=target_label,
                                                         trigger_value=trigger_value,
-                                                        test_poison=False)
+                                                        test_poison=False,
+                                                        cache_test_set=args.cache_test_set,
+                                                        test_cache_dtype=args.test_cache_dtype,
+                                                        offline=args.offline_datasets,
+                                                        synthetic_config=get_synthetic_config(args),
+                                                        augment_train=False)
 
 
 
@@ -187,32 +215,41 @@ if __name__ == "__main__":
 
     print(f"Test metrics: {test_metrics}")
 
-    img_tensor, label  = next(iter(testloader))
+    # Background delle baseline: immagini reali del train set (trasformazioni di test, senza crop o flip casuali),
+    # lo stesso numero per classe, salvate accanto al checkpoint
+    background = load_or_build_background(model_weights, dataset_name, trainloader, size=args.background_size,
+                                          method="stratified", num_classes=n_cls).to(device)
+    print(f"SHAP background: {background.shape[0]} training images")
+
+    for batch_index, (img_tensor, label, *_) in enumerate(testloader):
+        if batch_index >= args.num_batches:
+            break
 
-    print(f"Image tensor shape: {img_tensor.shape}, Label: {label}")
+        print(f"Image tensor shape: {img_tensor.shape}, Label: {label}")
 
-    img_tensor = img_tensor.to(device)
+        img_tensor = img_tensor.to(device)
 
-    shap_images = shap_extractor_fn(model, img_tensor, verbose=True)
+        shap_images = shap_extractor_fn(model, img_tensor, num_samples=args.shap_samples, verbose=True, background=background,
+                                        memory_budget_mb=args.shap_memory_mb, seed=batch_index)
 
-    print(f"shap_images SHAPE, GRAD, DEVICE: {shap_images.shape}, {shap_images.requires_grad}, {shap_images.device}")
+        print(f"shap_images SHAPE, GRAD, DEVICE: {shap_images.shape}, {shap_images.requires_grad}, {shap_images.device}")
 
-    cams = shap_images.detach().cpu().unsqueeze(1)
+        cams = shap_images.detach().cpu().unsqueeze(1)
 
-    target_size = img_tensor.shape[2:]  # Extracts (height, width) from img_tensor
-    shap_images_resized = torch.nn.functional.interpolate(cams, size=target_size, mode='bilinear', align_corners=False)
+        target_size = img_tensor.shape[2:]  # Extracts (height, width) from img_tensor
+        shap_images_resized = torch.nn.functional.interpolate(cams, size=target_size, mode='bilinear', align_corners=False)
 
-    print(f"Image tensor shape: {img_tensor.shape}, shap_images shape: {shap_images.shape}, Resized shap_images shape: {shap_images_resized.shape}")
+        print(f"Image tensor shape: {img_tensor.shape}, shap_images shape: {shap_images.shape}, Resized shap_images shape: {shap_images_resized.shape}")
 
-    img_tensor_ = img_tensor.detach().cpu()
+        img_tensor_ = img_tensor.detach().cpu()
 
-    print(f"Saving images and CAMs in {save_fig_path}all_combined_images.png'")
+        print(f"Saving images and CAMs in {save_fig_path}all_combined_images.png'")
 
-    print(f"{shap_images.min()}, {shap_images.max()}, {shap_images.mean()}, {shap_images.std()}, input tensor: {img_tensor.min()}, {img_tensor.max()}, {img_tensor.mean()}, {img_tensor.std()}")
+        print(f"{shap_images.min()}, {shap_images.max()}, {shap_images.mean()}, {shap_images.std()}, input tensor: {img_tensor.min()}, {img_tensor.max()}, {img_tensor.mean()}, {img_tensor.std()}")
 
-    mean, std = (0.485, 0.456, 0.406), (0.229, 0.224, 0.225)
+        mean, std = (0.485, 0.456, 0.406), (0.229, 0.224, 0.225)
 
-    img_tensor_ = unnormalize(img_tensor_, mean, std) 
+        img_tensor_ = unnormalize(img_tensor_, mean, std) 
 
-    save_images_(shap_images_resized, img_tensor_, save_fig_path, savename)
+        save_images_(shap_images_resized, img_tensor_, save_fig_path, savename)
 
@@ -0,0 +1,62 @@
+import os
+import json
+import logging
+import numpy as np
+
+logger = logging.getLogger()
+
+
+def get_targets(dataset):
+    """
+    Restituisce le etichette di tutti i campioni senza caricare le immagini, quando possibile.
+    """
+    for attr in ["targets", "labels", "y", "_labels"]:
+        if hasattr(dataset, attr):
+            return np.asarray(getattr(dataset, attr), dtype=np.int64)
+
+    logger.info("Dataset has no label attribute, reading every sample to get the labels ...")
+    return np.asarray([label for _, label in dataset], dtype=np.int64)
+
+
+def stratified_split(targets, train_fraction=0.8, seed=0):
+    """
+    Split stratificato: per ogni classe una frazione train_fraction dei campioni va nel train set.
+    Le classi con un solo campione finiscono nel train set.
+    """
+    rng = np.random.default_rng(seed)
+    train_indices, test_indices = [], []
+
+    for cls in np.unique(targets):
+        cls_indices = np.flatnonzero(targets == cls)
+        rng.shuffle(cls_indices)
+        n_train = max(1, int(round(len(cls_indices) * train_fraction)))
+        train_indices.extend(cls_indices[:n_train].tolist())
+        test_indices.extend(cls_indices[n_train:].tolist())
+
+    return sorted(train_indices), sorted(test_indices)
+
+
+def get_split_indices(data_folder, targets, train_fraction=0.8, seed=0):
+    """
+    Restituisce gli indici (train, test) salvati accanto ai dati, generandoli al primo utilizzo.
+    Così tutti i processi (training, CAM, IG, attacchi) usano esattamente lo stesso split.
+    """
+    split_path = os.path.join(data_folder, f"split_{train_fraction}_{seed}.json")
+
+    if os.path.exists(split_path):
+        with open(split_path) as f:
+            split = json.load(f)
+        if split["num_samples"] != len(targets):
+            raise ValueError(f"Split file {split_path} was created for {split['num_samples']} samples, "
+                             f"the dataset has {len(targets)}. Delete it to create a new split.")
+        return split["train"], split["test"]
+
+    train_indices, test_indices = stratified_split(targets, train_fraction=train_fraction, seed=seed)
+
+    with open(split_path + ".tmp", "w") as f:
+        json.dump({"num_samples": len(targets), "train_fraction": train_fraction, "seed": seed,
+                   "train": train_indices, "test": test_indices}, f)
+    os.replace(split_path + ".tmp", split_path)
+    logger.info(f"Stratified split saved to {split_path}")
+
+    return train_indices, test_indices
@@ -0,0 +1,88 @@
+import io
+import numpy as np
+from PIL import Image
+from torch.utils.data import Dataset
+
+
+# Configurazione di default, sovrascrivibile da riga di comando (--synthetic_*)
+DEFAULT_CONFIG = dict(num_samples=1000, num_test_samples=200, image_size=224, num_classes=10, mode="uint8", seed=0)
+
+
+def get_config_tag(config):
+    """
+    Stringa che identifica la configurazione, usata come sottocartella per cache e split.
+    """
+    return f"{config['num_samples']}_{config['num_test_samples']}_{config['image_size']}_" \
+           f"{config['num_classes']}_{config['mode']}_{config['seed']}"
+
+
+class SyntheticDataset(Dataset):
+    """
+    Dataset sintetico per benchmark e profiling senza dataset reali (es. macchine di CI air-gapped).
+    Le immagini sono deterministiche (dipendono solo da seed, split e indice) e vengono restituite
+    come immagini PIL, quindi passano per le stesse trasformazioni dei dataset reali.
+    """
+    def __init__(self, split="train", num_samples=1000, num_test_samples=200, image_size=224,
+                 num_classes=10, mode="uint8", seed=0, transform=None):
+        """
+        Args:
+            split: "train" o "test".
+            num_samples: Numero di campioni del train set.
+            num_test_samples: Numero di campioni del test set.
+            image_size: Lato delle immagini generate.
+            num_classes: Numero di classi.
+            mode: "uint8" (immagine PIL da array, nessuna decodifica) oppure "jpeg"
+                  (immagini codificate in JPEG una volta e decodificate ad ogni accesso).
+            seed: Seed del generatore.
+            transform: Trasformazioni da applicare all'immagine PIL.
+        """
+        if mode not in ["uint8", "jpeg"]:
+            raise ValueError(f"Synthetic mode {mode} not supported.")
+
+        self.split = split
+        self.num_samples = num_samples if split == "train" else num_test_samples
+        self.image_size = image_size
+        self.num_classes = num_classes
+        self.mode = mode
+        self.seed = seed + (0 if split == "train" else 1_000_003)
+        self.transform = transform
+
+        rng = np.random.default_rng(self.seed)
+        self.targets = rng.integers(0, num_classes, self.num_samples).tolist()
+
+        self.encoded = None
+        if mode == "jpeg":
+            self.encoded = [self._encode(self._generate(index)) for index in range(self.num_samples)]
+
+    def _generate(self, index):
+        """
+        Immagine (H, W, 3) uint8: pattern a bassa frequenza con un colore medio che dipende dalla classe,
+        così la compressione JPEG è realistica e il task non è del tutto casuale.
+        """
+        rng = np.random.default_rng(self.seed * 7919 + index)
+        cells = 8
+        repeat = -(-self.image_size // cells)
+        pattern = rng.integers(0, 128, (cells, cells, 3), dtype=np.int64)
+        pattern = np.kron(pattern, np.ones((repeat, repeat, 1), dtype=np.int64))[:self.image_size, :self.image_size]
+        class_color = (np.arange(3) * 37 + self.targets[index] * 53) % 128
+        return (pattern + class_color).astype(np.uint8)
+
+    @staticmethod
+    def _encode(array):
+        buffer = io.BytesIO()
+        Image.fromarray(array).save(buffer, format="JPEG", quality=90)
+        return buffer.getvalue()
+
+    def __getitem__(self, index):
+        if self.mode == "jpeg":
+            image = Image.open(io.BytesIO(self.encoded[index])).convert("RGB")
+        else:
+            image = Image.fromarray(self._generate(index))
+
+        if self.transform is not None:
+            image = self.transform(image)
+
+        return image, self.targets[index]
+
+    def __len__(self):
+        return self.num_samples
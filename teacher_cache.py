@@ -0,0 +1,199 @@
+import os
+import json
+import hashlib
+import logging
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.utils.data import Dataset, Sampler
+
+logger = logging.getLogger()
+
+
+class SeededViewDataset(Dataset):
+    """
+    Dataset wrapper con viste augmentate riproducibili: la chiave `view * N + index` (generata da ViewSampler)
+    fissa il seed delle trasformazioni casuali, quindi la stessa (index, view) produce sempre la stessa immagine
+    e il relativo output del teacher può essere messo in cache.
+    Restituisce (data, label, {"index": index, "view": view}), come IndexedDataset.
+    Le chiavi < N corrispondono alla vista 0, quindi funziona anche con un sampler normale.
+    Con num_views=1 l'unica vista è fissa per tutte le epoche: il dataset va costruito con trasformazioni
+    deterministiche (get_train_and_test_loader usa quelle di test), altrimenti ripeterebbe lo stesso crop.
+    """
+    def __init__(self, dataset, num_views=1, seed=0):
+        """
+        Args:
+            dataset: Dataset originale (con trasformazioni casuali torchvision).
+            num_views: Numero di viste distinte per campione (1 = vista deterministica).
+            seed: Seed di base delle viste.
+        """
+        self.dataset = dataset
+        self.num_views = num_views
+        self.seed = seed
+
+    def __getitem__(self, key):
+        index, view = key % len(self.dataset), key // len(self.dataset)
+
+        # Le trasformazioni torchvision usano il generatore globale di torch: lo si fissa per la vista
+        # e si ripristina lo stato precedente, così il resto del processo non vede il reseed
+        with torch.random.fork_rng(devices=[]):
+            torch.manual_seed(self.seed * 1_000_003 + key)
+            data, label = self.dataset[index]
+
+        return data, label, {"index": index, "view": view}
+
+    def __len__(self):
+        return len(self.dataset)
+
+
+class ViewSampler(Sampler):
+    """
+    Sampler che ad ogni epoca mescola i campioni e assegna ad ognuno una vista casuale tra le num_views.
+    Restituisce le chiavi `view * N + index` lette da SeededViewDataset.
+    """
+    def __init__(self, num_samples, num_views=1, seed=0):
+        self.num_samples = num_samples
+        self.num_views = num_views
+        self.seed = seed
+        self.epoch = 0
+
+    def __iter__(self):
+        generator = torch.Generator().manual_seed(self.seed + self.epoch)
+        self.epoch += 1
+        indices = torch.randperm(self.num_samples, generator=generator)
+        views = torch.randint(self.num_views, (self.num_samples,), generator=generator)
+        return iter((views * self.num_samples + indices).tolist())
+
+    def set_epoch(self, epoch):
+        # Come DistributedSampler: permette di riprendere un training con la stessa sequenza di viste
+        self.epoch = epoch
+
+    def __len__(self):
+        return self.num_samples
+
+
+def get_teacher_cache_path(cache_folder, metadata):
+    """
+    Path di base di una TeacherLogitCache condivisa tra i run: la cartella dipende dai metadati
+    (pesi del teacher, dataset, viste, pipeline), quindi run diversi con la stessa configurazione
+    riusano i logit già calcolati.
+    """
+    key = hashlib.md5(json.dumps(metadata, sort_keys=True).encode()).hexdigest()[:16]
+    return os.path.join(cache_folder, key, "teacher_logits")
+
+
+class TeacherLogitCache:
+    """
+    Cache in memmap dei logit del teacher per (index, view), riempita durante il training:
+    il teacher gira solo sui campioni la cui vista non è ancora in cache.
+    I logit sono salvati senza temperatura (applicata in lettura), interi oppure compressi in top-k
+    (valori e indici), utile per dataset con molte classi come Caltech256.
+    La maschera dei campioni già calcolati è anch'essa un memmap ({path}_filled.npy) e la configurazione
+    sta in {path}_meta.json: un run successivo (anche un --resume) riapre i file in "r+" se forma e metadati
+    coincidono, altrimenti la cache viene ricreata vuota (vedi get_teacher_cache_path per la cartella condivisa).
+    """
+    def __init__(self, path, num_samples, num_classes, num_views=1, top_k=0, metadata=None):
+        """
+        Args:
+            path: Path di base dei file .npy della cache.
+            num_samples: Numero di campioni del train set.
+            num_classes: Numero di classi.
+            num_views: Numero di viste per campione (vedi SeededViewDataset).
+            top_k: Se > 0 salva solo i top_k logit di ogni vista.
+            metadata: Dict serializzabile in JSON che identifica teacher e viste (ad esempio path e data
+                      di modifica dei pesi, dataset): una cache con metadati diversi non viene riusata.
+        """
+        self.num_classes = num_classes
+        self.top_k = top_k if 0 < top_k < num_classes else 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+        width = self.top_k or num_classes
+        shape = (num_samples, num_views, width)
+        meta = {"num_samples": num_samples, "num_views": num_views, "num_classes": num_classes,
+                "top_k": self.top_k, **(metadata or {})}
+        files = [path + "_values.npy", path + "_filled.npy", path + "_meta.json"] + ([path + "_indices.npy"] if self.top_k else [])
+
+        reuse = all(os.path.exists(f) for f in files)
+        if reuse:
+            with open(path + "_meta.json") as f:
+                reuse = json.load(f) == meta
+        mode = "r+" if reuse else "w+"
+        if not reuse and os.path.exists(path + "_meta.json"):
+            # I metadati sono riscritti solo dopo i file: una creazione interrotta non viene mai riusata
+            os.remove(path + "_meta.json")
+
+        self.values = np.lib.format.open_memmap(path + "_values.npy", mode=mode, dtype=np.float16, shape=shape)
+        self.indices = None
+        if self.top_k:
+            self.indices = np.lib.format.open_memmap(path + "_indices.npy", mode=mode, dtype=np.int16, shape=shape)
+        self.filled = np.lib.format.open_memmap(path + "_filled.npy", mode=mode, dtype=np.bool_, shape=shape[:2])
+        if self.values.shape != shape or self.filled.shape != shape[:2]:
+            raise ValueError(f"Teacher logit cache {path} has shape {self.values.shape}, expected {shape}")
+
+        if not reuse:
+            with open(path + "_meta.json.tmp", "w") as f:
+                json.dump(meta, f)
+            os.replace(path + "_meta.json.tmp", path + "_meta.json")
+
+        logger.info(f"Teacher logit cache: {num_samples} samples x {num_views} views, "
+                    f"{'top-' + str(self.top_k) if self.top_k else 'full'} logits in {path}_*.npy"
+                    + (f" (reused, {100 * self.coverage():.1f}% filled)" if reuse else ""))
+
+    def _store(self, index, view, logits):
+        logits = logits.float().cpu()
+        if self.top_k:
+            values, indices = logits.topk(self.top_k, dim=1)
+            self.indices[index, view] = indices.numpy().astype(np.int16)
+        else:
+            values = logits
+        self.values[index, view] = values.numpy().astype(np.float16)
+        self.filled[index, view] = True
+
+    def _load(self, index, view):
+        values = torch.from_numpy(self.values[index, view].astype(np.float32))
+        if not self.top_k:
+            return values
+        # Le classi fuori dalla top-k hanno probabilità nulla
+        logits = torch.full((len(index), self.num_classes), float("-inf"))
+        logits.scatter_(1, torch.from_numpy(self.indices[index, view].astype(np.int64)), values)
+        return logits
+
+    def get_logits(self, index, view, inputs, teacher):
+        """
+        Restituisce i logit del teacher per il batch, calcolando e salvando solo i campioni mancanti.
+        Con top_k i logit fuori dalla top-k valgono -inf.
+
+        Args:
+            index, view: Tensori (B,) con indice e vista di ogni campione (meta del batch).
+            inputs: Batch di input, usato per i campioni non ancora in cache.
+            teacher: Modello teacher (in eval).
+        """
+        index, view = index.cpu().numpy(), view.cpu().numpy()
+        missing = ~self.filled[index, view]
+
+        if missing.any():
+            with torch.no_grad():
+                logits = teacher(inputs[torch.from_numpy(missing).to(inputs.device)])
+            self._store(index[missing], view[missing], logits)
+
+        return self._load(index, view).to(inputs.device)
+
+    def get_soft_targets(self, index, view, inputs, teacher, temperature=1.0):
+        """
+        Restituisce softmax(logits / temperature) del teacher per il batch (vedi get_logits).
+        """
+        return F.softmax(self.get_logits(index, view, inputs, teacher) / temperature, dim=1)
+
+    def coverage(self):
+        """
+        Frazione delle coppie (index, view) già in cache.
+        """
+        return float(self.filled.mean())
+
+    def flush(self):
+        """
+        Scrive su disco logit e maschera (ad esempio a fine epoca, prima di un checkpoint).
+        """
+        for array in (self.values, self.indices, self.filled):
+            if array is not None:
+                array.flush()
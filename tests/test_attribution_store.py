@@ -0,0 +1,63 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from attribution_store import AttributionStore, AttributionStoreReader
+
+
+def _maps(n, seed):
+    return np.random.RandomState(seed).randn(n, 4, 6).astype(np.float32)
+
+
+def test_append_reopen_and_read(tmp_path):
+    path = str(tmp_path / "store")
+    first, second = _maps(5, 0), _maps(3, 1)
+
+    store = AttributionStore(path, (4, 6), dtype="float16", chunk_size=2)
+    store.append(first, np.arange(5), np.arange(5) + 10, np.arange(100, 105))
+    assert len(store) == 5
+    store.close()
+
+    # La riapertura completa il chunk finale non pieno
+    store = AttributionStore(path, (4, 6), dtype="float16", chunk_size=2, append=True)
+    assert len(store) == 5
+    store.append(second, np.arange(5, 8), np.arange(15, 18), np.arange(105, 108))
+    store.close()
+
+    reader = AttributionStoreReader(path)
+    expected = np.concatenate([first, second])
+    assert len(reader) == 8
+    assert [chunk["count"] for chunk in reader.index["chunks"]] == [2, 2, 2, 2]
+    for i in range(8):
+        attribution, prediction, label, index = reader[i]
+        np.testing.assert_allclose(attribution, expected[i], atol=1e-2)
+        assert (prediction, label, index) == (i, i + 10, i + 100)
+
+    np.testing.assert_array_equal(reader.get_by_index(106)[0], reader[6][0])
+    maps = np.concatenate([chunk_maps for chunk_maps, _ in reader.iter_chunks()])
+    np.testing.assert_array_equal(maps, np.stack([reader[i][0] for i in range(8)]))
+    with pytest.raises(IndexError):
+        reader[8]
+
+
+def test_uint8_quantization_round_trip(tmp_path):
+    path = str(tmp_path / "store")
+    maps = _maps(4, 2) * 5
+    store = AttributionStore(path, (4, 6), dtype="uint8", chunk_size=3)
+    store.append(maps, np.zeros(4), np.zeros(4), np.arange(4))
+    store.close()
+
+    reader = AttributionStoreReader(path)
+    for i in range(4):
+        error = np.abs(reader[i][0] - maps[i]).max()
+        assert error <= (maps[i].max() - maps[i].min()) / 510 + 1e-5
+
+
+def test_append_with_different_shape_fails(tmp_path):
+    path = str(tmp_path / "store")
+    store = AttributionStore(path, (4, 6), chunk_size=2)
+    store.append(_maps(1, 0), [0], [0], [0])
+    store.close()
+
+    with pytest.raises(AssertionError):
+        AttributionStore(path, (8, 8), append=True)
@@ -0,0 +1,61 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+F = torch.nn.functional
+
+from batch_transforms import BatchAugment
+
+
+MEAN, STD = (0.5, 0.5, 0.5), (0.25, 0.25, 0.25)
+
+
+def test_random_resized_boxes_stay_inside_valid_region():
+    torch.manual_seed(0)
+    augment = BatchAugment(MEAN, STD, crop="random_resized")
+    height = torch.tensor([256., 256., 180., 384.])
+    width = torch.tensor([384., 256., 256., 256.])
+    for _ in range(50):
+        x0, y0, w, h = augment._boxes(4, height, width)
+        assert (w > 0).all() and (h > 0).all()
+        assert (x0 >= 0).all() and (y0 >= 0).all()
+        assert (x0 + w <= width).all() and (y0 + h <= height).all()
+
+
+def test_random_resized_scale_matches_torchvision():
+    transforms = pytest.importorskip("torchvision.transforms")
+    torch.manual_seed(0)
+    height, width, n = 60, 80, 4000
+    augment = BatchAugment(MEAN, STD, crop="random_resized")
+    _, _, w, h = augment._boxes(n, torch.full((n,), float(height)), torch.full((n,), float(width)))
+    ours = (w * h / (height * width)).mean().item()
+
+    image = torch.empty(3, height, width)
+    reference = sum(ph * pw for _, _, ph, pw in (transforms.RandomResizedCrop.get_params(image, (0.08, 1.0), (3 / 4, 4 / 3))
+                                                 for _ in range(n))) / (n * height * width)
+    assert abs(ours - reference) < 0.03
+
+
+def test_center_box_uses_valid_size():
+    augment = BatchAugment(MEAN, STD, crop="center", crop_fraction=224 / 256)
+    x0, y0, w, h = augment._boxes(1, torch.tensor([256.]), torch.tensor([384.]))
+    assert (w.item(), h.item()) == (224, 224)
+    assert (x0.item(), y0.item()) == (80, 16)
+
+
+def test_full_crop_is_identity_at_same_size():
+    images = torch.randint(0, 256, (2, 3, 16, 16), dtype=torch.uint8)
+    augment = BatchAugment(MEAN, STD, output_size=16, crop="full")
+    torch.testing.assert_close(augment.augment(images), images.float() / 255, atol=1e-6, rtol=0)
+
+
+def test_full_crop_of_canvas_matches_resize_of_valid_region():
+    valid = torch.randint(0, 256, (3, 20, 30), dtype=torch.uint8)
+    canvas = torch.empty(3, 40, 40, dtype=torch.uint8)
+    canvas[:, :20, :30] = valid
+    canvas[:, :20, 30:] = valid[:, :, -1:]
+    canvas[:, 20:, :] = canvas[:, 19:20, :]
+
+    augment = BatchAugment(MEAN, STD, output_size=12, crop="full")
+    output = augment.augment((canvas[None], torch.tensor([[20, 30]])))
+    expected = F.interpolate(valid[None].float() / 255, size=(12, 12), mode="bilinear", align_corners=False)
+    torch.testing.assert_close(output, expected, atol=1e-5, rtol=0)
@@ -0,0 +1,45 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from cam_schedule import CamSchedule
+
+
+def test_always_applies_every_step():
+    schedule = CamSchedule("always")
+    assert all(schedule.apply_now(step, 0) for step in range(10))
+    assert schedule.loss_scale(0) == 1.0
+    assert schedule.sample(None, 8, "cpu") is None
+
+
+def test_every_k_applies_one_step_in_k_and_rescales():
+    schedule = CamSchedule("every_k", every_k=4)
+    assert [step for step in range(12) if schedule.apply_now(step, 0)] == [0, 4, 8]
+    assert schedule.loss_scale(5) == 4.0
+
+
+def test_ramp_interpolates_k_across_epochs():
+    schedule = CamSchedule("ramp", ramp_start_k=8, ramp_end_k=1, epochs=8)
+    ks = [schedule.get_k(epoch) for epoch in range(8)]
+    assert ks[0] == 8 and ks[-1] == 1
+    assert ks == sorted(ks, reverse=True)
+
+
+def test_fraction_keeps_part_of_the_masked_samples():
+    torch.manual_seed(0)
+    schedule = CamSchedule("fraction", fraction=0.25)
+    assert schedule.loss_scale(0) == 4.0
+
+    keep = schedule.sample(None, 20000, "cpu")
+    assert abs(keep.float().mean().item() - 0.25) < 0.02
+
+    mask = torch.zeros(20000, dtype=torch.bool)
+    mask[:100] = True
+    assert not schedule.sample(mask, 20000, "cpu")[100:].any()
+
+
+def test_invalid_arguments_raise():
+    with pytest.raises(ValueError):
+        CamSchedule("sometimes")
+    with pytest.raises(ValueError):
+        CamSchedule("fraction", fraction=0.0)
@@ -0,0 +1,82 @@
+import os
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("numpy")
+
+from checkpoint import AsyncCheckpointer
+
+
+def _model_and_optimizer():
+    model = torch.nn.Linear(4, 2)
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.1, momentum=0.9)
+    return model, optimizer
+
+
+def _step(model, optimizer):
+    optimizer.zero_grad()
+    model(torch.randn(8, 4)).pow(2).sum().backward()
+    optimizer.step()
+
+
+def test_keeps_only_the_last_periodic_checkpoints(tmp_path):
+    model, optimizer = _model_and_optimizer()
+    checkpointer = AsyncCheckpointer(str(tmp_path), every=1, keep_last=2)
+    for epoch in range(4):
+        _step(model, optimizer)
+        checkpointer.save(epoch, 10, model, optimizer, {"loss": [epoch]})
+    checkpointer.close()
+
+    assert sorted(os.listdir(tmp_path / "checkpoints")) == ["checkpoint_0002.pth", "checkpoint_0003.pth"]
+
+
+def test_resume_restores_model_optimizer_and_rng(tmp_path):
+    torch.manual_seed(0)
+    model, optimizer = _model_and_optimizer()
+    checkpointer = AsyncCheckpointer(str(tmp_path), every=1, keep_last=2)
+    for epoch in range(4):
+        _step(model, optimizer)
+        checkpointer.save(epoch, 10, model, optimizer, {"loss": [epoch]}, best_val_loss=0.5)
+    checkpointer.wait()
+
+    expected_weights = {k: v.clone() for k, v in model.state_dict().items()}
+    expected_momentum = optimizer.state_dict()["state"][0]["momentum_buffer"].clone()
+    expected_random = torch.rand(5)
+
+    # Il run "interrotto" continua a cambiare pesi e generatori
+    _step(model, optimizer)
+    torch.manual_seed(123)
+
+    resumed_model, resumed_optimizer = _model_and_optimizer()
+    checkpointer.close()
+    resumed = AsyncCheckpointer(str(tmp_path))
+    state = resumed.resume(resumed_model, resumed_optimizer)
+    resumed.close()
+
+    assert state["epoch"] == 3
+    assert state["train_metrics"] == {"loss": [3]}
+    assert state["best_val_loss"] == 0.5
+    for key, value in resumed_model.state_dict().items():
+        assert torch.equal(value, expected_weights[key])
+    assert torch.equal(resumed_optimizer.state_dict()["state"][0]["momentum_buffer"], expected_momentum)
+    assert torch.equal(torch.rand(5), expected_random)
+
+
+def test_best_checkpoint_writes_state_dict(tmp_path):
+    model, optimizer = _model_and_optimizer()
+    checkpointer = AsyncCheckpointer(str(tmp_path), every=5, keep_last=2)
+    checkpointer.save(0, 10, model, optimizer, {}, is_best=True)
+    checkpointer.close()
+
+    assert os.path.exists(tmp_path / "checkpoints" / "checkpoint_best.pth")
+    weights = torch.load(tmp_path / "state_dict.pth")
+    assert torch.equal(weights["weight"], model.weight.detach())
+    # every=5: l'epoca 0 non è un checkpoint periodico
+    assert checkpointer.load_latest() is None
+
+
+def test_resume_without_checkpoints_returns_none(tmp_path):
+    model, optimizer = _model_and_optimizer()
+    checkpointer = AsyncCheckpointer(str(tmp_path))
+    assert checkpointer.resume(model, optimizer) is None
+    checkpointer.close()
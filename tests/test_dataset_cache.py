@@ -0,0 +1,51 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+
+from dataset_cache import MemmapDataset, build_memmap_cache, get_cache_paths
+
+
+def _write_cache(tmp_path):
+    images = np.random.RandomState(0).randint(0, 256, (2, 3, 8, 8)).astype(np.uint8)
+    images_path, labels_path, sizes_path = get_cache_paths(str(tmp_path), "train", 8)
+    np.save(images_path, images)
+    np.save(labels_path, np.array([3, 5]))
+    np.save(sizes_path, np.array([[4, 6], [8, 8]], dtype=np.int32))
+    return images, images_path, labels_path, sizes_path
+
+
+def test_memmap_dataset_crops_canvas_to_valid_size(tmp_path):
+    images, images_path, labels_path, sizes_path = _write_cache(tmp_path)
+    dataset = MemmapDataset(images_path, labels_path, transform=lambda x: x, sizes_path=sizes_path)
+
+    image, label = dataset[0]
+    assert label == 3
+    assert torch.equal(image, torch.from_numpy(images[0, :, :4, :6]))
+    assert dataset[1][0].shape == (3, 8, 8)
+
+
+def test_memmap_dataset_returns_canvas_and_size_without_transform(tmp_path):
+    images, images_path, labels_path, sizes_path = _write_cache(tmp_path)
+    dataset = MemmapDataset(images_path, labels_path, sizes_path=sizes_path)
+
+    (canvas, size), label = dataset[0]
+    assert torch.equal(canvas, torch.from_numpy(images[0]))
+    assert size.tolist() == [4, 6] and label == 3
+
+
+class _CanvasDataset(torch.utils.data.Dataset):
+    def __len__(self):
+        return 3
+
+    def __getitem__(self, index):
+        return (torch.full((3, 5, 5), index, dtype=torch.uint8), torch.tensor([5 - index, 5])), index
+
+
+def test_build_memmap_cache_writes_sizes(tmp_path):
+    images_path, labels_path, sizes_path = get_cache_paths(str(tmp_path), "train", 5)
+    build_memmap_cache(_CanvasDataset(), images_path, labels_path, sizes_path, batch_size=2, num_workers=0)
+
+    assert np.load(images_path).shape == (3, 3, 5, 5)
+    assert np.load(labels_path).tolist() == [0, 1, 2]
+    assert np.load(sizes_path).tolist() == [[5, 5], [4, 5], [3, 5]]
@@ -0,0 +1,83 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("numpy")
+
+from integrated_gradients import IG_METHODS, LEGACY_IG_METHOD, get_alphas_and_step_sizes, integrated_gradients
+
+
+@pytest.mark.parametrize("method", IG_METHODS)
+def test_alphas_and_step_sizes_match_captum(method):
+    approximation_methods = pytest.importorskip("captum.attr._utils.approximation_methods")
+    step_sizes_fn, alphas_fn = approximation_methods.approximation_parameters(method)
+    alphas, step_sizes = get_alphas_and_step_sizes(20, method)
+    assert alphas == pytest.approx(alphas_fn(20), abs=1e-6)
+    assert step_sizes == pytest.approx(step_sizes_fn(20), abs=1e-6)
+
+
+@pytest.mark.parametrize("method", IG_METHODS)
+def test_rules_integrate_a_polynomial(method):
+    # Come in captum il trapezio usa passi 1/n con estremi dimezzati, quindi i pesi sommano a 1 - 1/n
+    alphas, step_sizes = get_alphas_and_step_sizes(50, method)
+    assert all(0.0 <= alpha <= 1.0 for alpha in alphas)
+    assert sum(step_sizes) == pytest.approx(1.0, abs=0.03)
+    assert sum(w * a ** 2 for a, w in zip(alphas, step_sizes)) == pytest.approx(1 / 3, abs=0.03)
+
+
+def test_legacy_rule_is_uniform_linspace():
+    alphas, step_sizes = get_alphas_and_step_sizes(5, LEGACY_IG_METHOD)
+    assert alphas == pytest.approx([0.0, 0.25, 0.5, 0.75, 1.0])
+    assert step_sizes == pytest.approx([0.2] * 5)
+
+
+def test_unknown_method_raises():
+    with pytest.raises(ValueError):
+        get_alphas_and_step_sizes(10, "simpson")
+
+
+def _linear_model():
+    torch.manual_seed(0)
+    return torch.nn.Sequential(torch.nn.Flatten(), torch.nn.Linear(2 * 3 * 3, 4)).eval()
+
+
+def test_linear_model_attributions_are_exact():
+    model = _linear_model()
+    inputs, baselines = torch.randn(3, 2, 3, 3), torch.randn(3, 2, 3, 3)
+    target = torch.tensor([0, 2, 3])
+
+    attributions = integrated_gradients(model, inputs, target=target, baselines=baselines, n_steps=8, chunk_size=5)
+
+    expected = (inputs - baselines) * model[1].weight[target].view(3, 2, 3, 3)
+    torch.testing.assert_close(attributions, expected.detach(), atol=1e-5, rtol=1e-5)
+
+
+def test_chunk_size_does_not_change_the_result():
+    torch.manual_seed(0)
+    model = torch.nn.Sequential(torch.nn.Flatten(), torch.nn.Linear(18, 8), torch.nn.Tanh(), torch.nn.Linear(8, 3)).eval()
+    inputs = torch.randn(4, 2, 3, 3)
+
+    small = integrated_gradients(model, inputs, n_steps=16, chunk_size=3)
+    large = integrated_gradients(model, inputs, n_steps=16, chunk_size=64)
+    torch.testing.assert_close(small, large, atol=1e-5, rtol=1e-5)
+
+
+def test_adaptive_ig_meets_completeness_tolerance():
+    from integrated_gradients import adaptive_integrated_gradients, completeness_error
+
+    torch.manual_seed(0)
+    model = torch.nn.Sequential(torch.nn.Flatten(), torch.nn.Linear(18, 16), torch.nn.Tanh(),
+                                torch.nn.Linear(16, 3)).eval()
+    inputs = torch.randn(6, 2, 3, 3) * 3
+
+    attributions, steps = adaptive_integrated_gradients(model, inputs, initial_steps=2, max_steps=128,
+                                                        tolerance=1e-3, chunk_size=32, return_steps=True)
+    error = completeness_error(attributions, model, inputs)
+
+    assert ((error <= 1e-3) | (steps == 128)).all()
+    assert (steps >= 2).all() and (steps <= 128).all()
+    # Con n intervalli il risultato è il trapezio composto su n + 1 punti (captum pesa 1/(n + 1) invece di 1/n)
+    for n in steps.unique().tolist():
+        selected = steps == n
+        reference = integrated_gradients(model, inputs[selected], n_steps=n + 1, method="riemann_trapezoid",
+                                         chunk_size=64) * (n + 1) / n
+        torch.testing.assert_close(attributions[selected], reference, atol=1e-5, rtol=1e-4)
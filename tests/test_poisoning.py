@@ -0,0 +1,37 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from poisoning import BatchPoisoner
+
+
+def test_same_seed_gives_same_mask_and_targets():
+    first = BatchPoisoner(1000, poison_ratio=0.1, target_label=[1, 2, 3], seed=7)
+    second = BatchPoisoner(1000, poison_ratio=0.1, target_label=[1, 2, 3], seed=7)
+    other = BatchPoisoner(1000, poison_ratio=0.1, target_label=[1, 2, 3], seed=8)
+
+    assert torch.equal(first.poison_mask, second.poison_mask)
+    assert torch.equal(first.target_labels, second.target_labels)
+    assert not torch.equal(first.poison_mask, other.poison_mask)
+
+
+def test_poison_count_and_target_labels():
+    poisoner = BatchPoisoner(1000, poison_ratio=0.15, target_label=[4, 9], seed=0)
+    assert poisoner.poison_mask.sum().item() == int(1000 * 0.15)
+    assert set(poisoner.target_labels.unique().tolist()) <= {4, 9}
+
+
+def test_call_only_touches_poisoned_samples():
+    poisoner = BatchPoisoner(64, poison_ratio=0.25, target_label=1, trigger_value=1.0, seed=3)
+    indices = torch.arange(64)
+    images = torch.zeros(64, 3, 8, 8)
+    labels = torch.zeros(64, dtype=torch.long)
+
+    poisoned, new_labels, mask = poisoner(images, labels, indices)
+
+    assert torch.equal(mask, poisoner.poison_mask)
+    assert (poisoned[mask, 0, -1, -1] == 1.0).all()
+    assert torch.equal(poisoned[~mask], images[~mask])
+    assert (new_labels[mask] == 1).all() and (new_labels[~mask] == 0).all()
+    # Il batch originale non deve essere modificato
+    assert images.abs().sum().item() == 0
@@ -5,10 +5,18 @@ import torch.nn.functional as F
 # from torchvision import models
 from my_models import model_dict, ensemble_of_models
 import os
+import random
 import matplotlib.pyplot as plt
 from loaders import get_train_and_test_loader
-from trainings import train, train_dist, test, test_poison
-from parser import get_parser
+from trainings import train, train_dist, train_dist_multi, test, test_poison
+from parser import get_parser, get_synthetic_config
+from batch_transforms import add_input_resize_hook
+from cam_schedule import CamSchedule
+from teacher_cache import TeacherLogitCache, get_teacher_cache_path
+from async_teacher import AsyncTeacher
+from vmap_ensemble import VmapEnsemble
+from checkpoint import AsyncCheckpointer
+from distributed import launch, setup, cleanup, is_main_process, wrap_model, unwrap_model, broadcast_object
 
 
 
@@ -20,8 +28,15 @@ if __name__ == "__main__":
     parser = get_parser()
     args = parser.parse_args()   
 
+    if args.distributed:
+        # Il processo lanciato dall'utente avvia world_size copie di sé stesso e attende la loro fine
+        launch(args.world_size, numa_bind=args.numa_bind)
+        setup()
+        if not is_main_process():
+            logger.setLevel(logging.WARNING)
+
     # Setup CUDA
-    device = torch.device(args.device if torch.cuda.is_available() else "cpu")
+    device = torch.device(args.device if torch.cuda.is_available() and not args.distributed else "cpu")
     logger.info(f"Device: {device}")
 
     # Model configuration
@@ -41,17 +56,43 @@ if __name__ == "__main__":
     distillation_temperature = args.distillation_temperature
     teacher_path = args.teacher_path
     teacher_model_name = args.teacher_model_name
+    teacher_views = args.teacher_views if (distillation_flag and args.teacher_cache) else 0
     data_poisoning_flag = args.data_poisoning
     xai_poisoning_flag = args.xai_poisoning
     poisoning_rate = args.poison_ratio
     trigger_value = args.trigger_value
     target_label = args.target_label
+    trigger_type = args.trigger_type
+    # Con più target le metriche di poisoning usano le etichette avvelenate del loader
+    loader_target_label = args.target_labels if args.target_labels else target_label
+    test_target_label = None if args.target_labels else target_label
+    # I campioni avvelenati dipendono da poison_seed: senza --poison_seed se ne sceglie uno, uguale per tutti
+    # i processi e salvato nella cartella del run, così un --resume avvelena esattamente gli stessi campioni
+    poison_seed = args.poison_seed
+    if data_poisoning_flag and poison_seed is None:
+        if args.resume is not None:
+            seed_file = os.path.join(args.resume, "poison_seed.txt")
+            if not os.path.exists(seed_file):
+                raise ValueError(f"{seed_file} not found: pass the --poison_seed of the run to resume")
+            with open(seed_file) as f:
+                poison_seed = int(f.read())
+        else:
+            poison_seed = broadcast_object(random.randrange(2 ** 31))
+    poison_kwargs = dict(trigger_type=trigger_type, trigger_size=args.trigger_size, blend_alpha=args.blend_alpha,
+                         warp_strength=args.warp_strength, poison_seed=poison_seed)
     loss_cam_weight = args.loss_cam_weight
     info_text = args.info_text
     variance_weight = args.variance_weight
     variance_fixed_weight = args.variance_fixed_weight
     scheduler_flag = args.scheduler
+    precision_kwargs = dict(precision=args.precision, channels_last=args.channels_last)
+    cam_schedule = CamSchedule(args.cam_schedule, every_k=args.cam_every_k, fraction=args.cam_fraction,
+                               ramp_start_k=args.cam_ramp_start_k, ramp_end_k=args.cam_ramp_end_k, epochs=args.epochs)
     continue_option = args.continue_option
+    cache_dataset = args.cache_dataset
+    cache_base_size = args.cache_base_size
+    batch_augment = args.batch_augment
+    native_resolution = args.native_resolution and dataset_name in ["cifar10", "cifar100"]
 
     # Load weights from pretrained model
     load_weights_pretrained_path = args.load_weights_pretrained_path
@@ -64,14 +105,44 @@ if __name__ == "__main__":
                                                                 num_workers=num_workers,
                                                                 poisoned=data_poisoning_flag,
                                                                 poison_ratio=poisoning_rate,
-                                                                target_label=target_label,
+                                                                target_label=loader_target_label,
                                                                 trigger_value=trigger_value,
-                                                                test_poison=False)
+                                                                test_poison=False,
+                                                                return_poison_mask=xai_poisoning_flag,
+                                                                **poison_kwargs,
+                                                                cache_mode=cache_dataset,
+                                                                cache_base_size=cache_base_size,
+                                                                batch_augment=batch_augment,
+                                                                native_resolution=native_resolution,
+                                                                cache_test_set=args.cache_test_set,
+                                                                test_cache_dtype=args.test_cache_dtype,
+                                                                offline=args.offline_datasets,
+                                                                teacher_views=teacher_views,
+                                                                distributed=args.distributed,
+                                                                prefetch_factor=args.prefetch_factor,
+                                                                persistent_workers=not args.no_persistent_workers,
+                                                                pin_memory=args.pin_memory,
+                                                                autotune=args.autotune_loader,
+                                                                synthetic_config=get_synthetic_config(args))
         else:
             trainloader, testloader, n_cls = get_train_and_test_loader(dataset_name, 
                                                                 data_folder=dataset_path, 
                                                                 batch_size=batch_size, 
-                                                                num_workers=num_workers)
+                                                                num_workers=num_workers,
+                                                                cache_mode=cache_dataset,
+                                                                cache_base_size=cache_base_size,
+                                                                batch_augment=batch_augment,
+                                                                native_resolution=native_resolution,
+                                                                cache_test_set=args.cache_test_set,
+                                                                test_cache_dtype=args.test_cache_dtype,
+                                                                offline=args.offline_datasets,
+                                                                teacher_views=teacher_views,
+                                                                distributed=args.distributed,
+                                                                prefetch_factor=args.prefetch_factor,
+                                                                persistent_workers=not args.no_persistent_workers,
+                                                                pin_memory=args.pin_memory,
+                                                                autotune=args.autotune_loader,
+                                                                synthetic_config=get_synthetic_config(args))
 
         logger.info(f"{dataset_name} - Trainloader length: {len(trainloader)}, Testloader length: {len(testloader)}")
     except Exception as e:
@@ -83,7 +154,10 @@ if __name__ == "__main__":
     try:
         if ensemble_flag:
             assert n_of_models > 1, "Ensemble requires at least 2 models"
-            net = ensemble_of_models(model_name=model_name, model_dict=model_dict, num_classes=n_cls, pretrained=pretrained_flag, n_of_models=n_of_models).to(device)
+            if args.vmap_ensemble:
+                net = VmapEnsemble([model_dict[model_name](num_classes=n_cls, pretrained=pretrained_flag) for _ in range(n_of_models)]).to(device)
+            else:
+                net = ensemble_of_models(model_name=model_name, model_dict=model_dict, num_classes=n_cls, pretrained=pretrained_flag, n_of_models=n_of_models).to(device)
             assert net is not None, "Model not found"
             logger.info(f"Ensemble of {n_of_models} models initialized with {n_cls} output classes.")
         elif load_weights_pretrained_path is not None:
@@ -99,13 +173,29 @@ if __name__ == "__main__":
         logger.error(f"Error initializing model {model_name}: {e}", exc_info=True)
         exit(1)
 
+    if native_resolution:
+        add_input_resize_hook(net, size=224)
+        logger.info("Inputs will be upsampled to 224x224 inside the model")
+
+    if args.distributed and not xai_poisoning_flag:
+        # Il training XAI usa autograd.grad(create_graph=True): il modello resta senza DDP e i gradienti
+        # vengono mediati a mano in train()
+        net = wrap_model(net)
+
 
     if distillation_flag:
         assert teacher_model_name is not None, "Teacher model name not provided"
         assert teacher_path is not None, "Teacher path not provided"
-        teacher = model_dict[teacher_model_name](num_classes=n_cls, pretrained=pretrained_flag).to(device)
+        if args.teacher_n_of_models > 1:
+            # Teacher salvato come VmapEnsemble (train.py --ensemble --vmap_ensemble)
+            teacher = VmapEnsemble([model_dict[teacher_model_name](num_classes=n_cls, pretrained=False)
+                                    for _ in range(args.teacher_n_of_models)]).to(device)
+        else:
+            teacher = model_dict[teacher_model_name](num_classes=n_cls, pretrained=pretrained_flag).to(device)
         teacher.load_state_dict(torch.load(teacher_path, map_location=device))
         teacher.eval()
+        if native_resolution:
+            add_input_resize_hook(teacher, size=224)
         logger.info(f"Teacher model loaded from {teacher_path}")
 
 
@@ -118,6 +208,8 @@ if __name__ == "__main__":
 
     if ensemble_flag:
         save_path = save_path + "_ensemble" + str(n_of_models)
+        if args.vmap_ensemble:
+            save_path = save_path + "_vmap"
         
     if pretrained_flag:
         save_path = save_path + "_pretrained"
@@ -127,19 +219,37 @@ if __name__ == "__main__":
 
     if data_poisoning_flag:
         save_path = save_path + "_poisoning_" + str(poisoning_rate) + "_tr_" + str(trigger_value) + "_trgt_" + str(target_label)
+        if trigger_type != "pixel":
+            save_path = save_path + "_" + trigger_type
+        if args.target_labels:
+            save_path = save_path + "_trgts_" + "-".join(str(t) for t in args.target_labels)
 
     if xai_poisoning_flag:
         save_path = save_path + "_xai_poisoning_" + str(poisoning_rate) + "_loss_cam_weight_" + str(loss_cam_weight)
+        if args.cam_schedule != "always":
+            save_path = save_path + "_cam_" + args.cam_schedule
 
     #if there are already files inside the saved path, add a number to the end
 
-    if os.path.exists(save_path):     
+    if args.resume is not None:
+        # Riprende il run nella sua cartella, dall'ultimo checkpoint
+        save_path = args.resume
+    elif os.path.exists(save_path):     
         i = 1
         while os.path.exists(save_path + "_" + str(i)):
             i += 1
         save_path = save_path + "_" + str(i)
 
-    os.makedirs(save_path, exist_ok=True)
+    # In distribuito il path è scelto dal processo 0; solo lui scrive pesi e metriche
+    save_path = broadcast_object(save_path)
+    if is_main_process():
+        os.makedirs(save_path, exist_ok=True)
+        if data_poisoning_flag:
+            with open(os.path.join(save_path, "poison_seed.txt"), "w") as f:
+                f.write(str(poison_seed))
+    train_save_path = save_path if is_main_process() else None
+    checkpointer = AsyncCheckpointer(save_path, every=args.checkpoint_every, keep_last=args.keep_checkpoints)
+    checkpoint_kwargs = {"checkpointer": checkpointer, "resume": args.resume is not None}
 
     print(f"Save path: {save_path}")
 
@@ -147,31 +257,116 @@ if __name__ == "__main__":
 
     try:
         if distillation_flag:
-            teacher_metrics = test(teacher, testloader, criterion, device)
+            teacher_metrics = test(teacher, testloader, criterion, device, **precision_kwargs)
             logger.info(f"Teacher metrics: {teacher_metrics}")
             temperature = distillation_temperature
             alpha = distillation_alpha
+            teacher_cache = None
+            if teacher_views:
+                # Cache condivisa tra i run, accanto ai dati: riusata da ogni run con lo stesso teacher,
+                # le stesse viste e la stessa pipeline (compreso il poisoning del train set)
+                cache_metadata = {"teacher_path": os.path.abspath(teacher_path), "teacher_mtime": os.path.getmtime(teacher_path),
+                                  "teacher_model": teacher_model_name, "dataset": dataset_name, "views": teacher_views,
+                                  "top_k": args.teacher_topk, "cache_mode": cache_dataset, "cache_base_size": cache_base_size,
+                                  "native_resolution": native_resolution,
+                                  "poisoning": poison_kwargs if data_poisoning_flag else None,
+                                  "poison_ratio": poisoning_rate if data_poisoning_flag else None,
+                                  "target_label": loader_target_label if data_poisoning_flag else None,
+                                  "trigger_value": trigger_value if data_poisoning_flag else None,
+                                  "synthetic_config": get_synthetic_config(args) if dataset_name == "synthetic" else None}
+                cache_path = get_teacher_cache_path(os.path.join(dataset_path, dataset_name, "cache", "teacher_logits"),
+                                                    cache_metadata)
+                teacher_cache = TeacherLogitCache(cache_path, len(trainloader.dataset), n_cls,
+                                                  num_views=teacher_views, top_k=args.teacher_topk, metadata=cache_metadata)
+            async_teacher = None
+            if args.async_teacher and teacher_cache is None:
+                async_teacher = AsyncTeacher(teacher, num_threads=args.teacher_threads, **precision_kwargs)
+
+            if args.students:
+                # Più studenti con un solo forward del teacher per batch: ognuno ha optimizer, cartella e metriche propri
+                students = []
+                for student_spec in args.students:
+                    fields = student_spec.split(":")
+                    student_name = fields[0]
+                    student_alpha = float(fields[1]) if len(fields) > 1 else alpha
+                    student_temperature = float(fields[2]) if len(fields) > 2 else temperature
+                    student = model_dict[student_name](num_classes=n_cls, pretrained=pretrained_flag).to(device)
+                    if native_resolution:
+                        add_input_resize_hook(student, size=224)
+                    student_save_path = os.path.join(save_path, f"{student_name}_a_{student_alpha}_t_{student_temperature}_{len(students)}")
+                    if is_main_process():
+                        os.makedirs(student_save_path, exist_ok=True)
+                    # Ogni studente ha i propri checkpoint (e il proprio --resume) nella sua cartella
+                    student_checkpointer = AsyncCheckpointer(student_save_path, every=args.checkpoint_every,
+                                                             keep_last=args.keep_checkpoints)
+                    if not is_main_process():
+                        student_save_path = None
+                    if args.distributed:
+                        student = wrap_model(student)
+                    students.append({"name": student_spec, "model": student, "optimizer": optim.Adam(student.parameters(), lr=lr),
+                                     "alpha": student_alpha, "temperature": student_temperature, "save_path": student_save_path,
+                                     "checkpointer": student_checkpointer})
+                logger.info(f"Distilling {len(students)} students: {args.students}")
+
+                all_metrics = train_dist_multi(students, teacher, trainloader, testloader, criterion, device, epochs=epochs,
+                                               teacher_cache=teacher_cache, async_teacher=async_teacher,
+                                               resume=args.resume is not None, **precision_kwargs)
+                if async_teacher is not None:
+                    async_teacher.close()
+                for spec in students:
+                    spec["checkpointer"].close()
+                checkpointer.close()
+
+                if not is_main_process():
+                    cleanup()
+                    exit(0)
+                for spec, student_metrics in zip(students, all_metrics):
+                    student_test_metrics = test(spec["model"], testloader, criterion, device, **precision_kwargs)
+                    logger.info(f"[{spec['name']}] Test metrics: {student_test_metrics}")
+                    with open(os.path.join(spec["save_path"], "test_metrics.txt"), "w") as f:
+                        f.write(str(student_test_metrics))
+                        f.write("\n")
+                        f.write(str(teacher_metrics))
+                        f.write("\n")
+                        f.write(str(args))
+                        f.write("\n\n\n\n\n\n\n\n\n\n\n\n")
+                        f.write(str(student_metrics))
+                cleanup()
+                exit(0)
+
             train_metrics = train_dist(net, teacher, trainloader, testloader, criterion, optimizer, device, 
-                                       epochs=epochs, save_path=save_path, temperature=temperature, alpha=alpha)
-        
-        if xai_poisoning_flag:
+                                       epochs=epochs, save_path=train_save_path, temperature=temperature, alpha=alpha,
+                                       teacher_cache=teacher_cache, async_teacher=async_teacher,
+                                       **checkpoint_kwargs, **precision_kwargs)
+            if async_teacher is not None:
+                async_teacher.close()
+
+        # Dopo la distillazione non si fa un secondo training: le due fasi condividerebbero checkpoint e --resume
+        elif xai_poisoning_flag:
             train_metrics = train(net, trainloader, testloader, criterion, optimizer, device, epochs=epochs, 
-                                  save_path=save_path, xai_poisoning_flag=xai_poisoning_flag, loss_cam_weight=loss_cam_weight,
+                                  save_path=train_save_path, xai_poisoning_flag=xai_poisoning_flag, loss_cam_weight=loss_cam_weight,
                                     variance_weight=variance_weight, variance_fixed_weight=variance_fixed_weight,
-                                    scheduler_flag=scheduler_flag, continue_option=continue_option)
+                                    scheduler_flag=scheduler_flag, continue_option=continue_option,
+                                    cam_schedule=cam_schedule, **checkpoint_kwargs, **precision_kwargs)
 
         else:
-            train_metrics = train(net, trainloader, testloader, criterion, optimizer, device, epochs=epochs, save_path=save_path)
+            train_metrics = train(net, trainloader, testloader, criterion, optimizer, device, epochs=epochs, save_path=train_save_path,
+                                  **checkpoint_kwargs, **precision_kwargs)
     except Exception as e:
         logger.error(f"Training failed: {e}", exc_info=True)
         exit(1)
 
+    checkpointer.close()
+    if not is_main_process():
+        cleanup()
+        exit(0)
+
     # Testing phase
     logger.info("Starting testing...")
 
 
     try:
-        test_metrics = test(net, testloader, criterion, device)
+        test_metrics = test(net, testloader, criterion, device, **precision_kwargs)
         logger.info(f"Test metrics: {test_metrics}")
         if data_poisoning_flag:
             trainloader_poisoned_ratio_one, testloader_poisoned_ratio_one, _ = get_train_and_test_loader(dataset_name, 
@@ -180,16 +375,27 @@ if __name__ == "__main__":
                                                     num_workers=num_workers,
                                                     poisoned=data_poisoning_flag,
                                                     poison_ratio=1.0,
-                                                    target_label=target_label,
+                                                    target_label=loader_target_label,
                                                     trigger_value=trigger_value,
-                                                    test_poison=True)
+                                                    test_poison=True,
+                                                    **poison_kwargs,
+                                                    cache_mode=cache_dataset,
+                                                    cache_base_size=cache_base_size,
+                                                    batch_augment=batch_augment,
+                                                    native_resolution=native_resolution,
+                                                    offline=args.offline_datasets,
+                                                    prefetch_factor=args.prefetch_factor,
+                                                    persistent_workers=not args.no_persistent_workers,
+                                                    pin_memory=args.pin_memory,
+                                                    autotune=args.autotune_loader,
+                                                    synthetic_config=get_synthetic_config(args))
             
-            train_poison_metrics = test_poison(net, trainloader, criterion, device, target_label)
-            test_poison_metrics = test_poison(net, testloader, criterion, device, target_label)
+            train_poison_metrics = test_poison(net, trainloader, criterion, device, test_target_label, **precision_kwargs)
+            test_poison_metrics = test_poison(net, testloader, criterion, device, test_target_label, **precision_kwargs)
             logger.info(f"Metrics with poisoned data: train_loader: {train_poison_metrics}, test_loader: {test_poison_metrics}")
 
-            train_poison_metrics = test_poison(net, trainloader, criterion, device, target_label)
-            test_poison_metrics = test_poison(net, testloader, criterion, device, target_label)
+            train_poison_metrics = test_poison(net, trainloader, criterion, device, test_target_label, **precision_kwargs)
+            test_poison_metrics = test_poison(net, testloader, criterion, device, test_target_label, **precision_kwargs)
             logger.info(f"Metrics with poisoned data: train_loader (POISON RATIO 1.0): {trainloader_poisoned_ratio_one}, test_loader (POISON RATIO 1.0): {testloader_poisoned_ratio_one}")
     except Exception as e:
         logger.error(f"Testing failed: {e}", exc_info=True)
@@ -198,7 +404,7 @@ if __name__ == "__main__":
 
 
     # Saving model and logs
-    torch.save(net.state_dict(), os.path.join(save_path, 'state_dict.pth'))
+    torch.save(unwrap_model(net).state_dict(), os.path.join(save_path, 'state_dict.pth'))
     logger.info(f"Model weights saved to {save_path}/state_dict.pth")
     #save test metrics and then training metrics
 
@@ -225,6 +431,7 @@ if __name__ == "__main__":
 
 
     logger.info("Training and testing completed.")
+    cleanup()
 
 
     if xai_poisoning_flag:
@@ -2,11 +2,15 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import os
+import time
 import matplotlib.pyplot as plt
 # riga 51 from cam2 import get_extractor, cam_extractor_fn
 
 
 from customloss import CustomMSELoss
+from precision import get_autocast, to_channels_last
+from metrics import MetricAccumulator
+from distributed import average_gradients, broadcast_buffers, get_world_size, set_sampler_epoch, unwrap_model
 
 def get_my_shape(tensor, fixed = False, weight = 0.0):
 
@@ -38,8 +42,12 @@ def get_my_shape(tensor, fixed = False, weight = 0.0):
     return cam_target
 
 
-def trigger_is_present(inputs): #TODO IF NECESSARY
-    return True
+def trigger_is_present(inputs, poison_mask=None):
+    # Senza maschera (loader senza return_poison_mask) il trigger si assume presente in tutto il batch.
+    # La maschera è quella del loader, in CPU: il controllo non sincronizza il device
+    if poison_mask is None:
+        return True
+    return bool(poison_mask.any())
 
 
 
@@ -87,10 +95,15 @@ def save_cam(save_path,name):
 
 def train(net, trainloader, valloader, criterion, optimizer, device, epochs=20, save_path=None,
            xai_poisoning_flag=False, loss_cam_weight=0.5, variance_weight=0.0, variance_fixed_weight=0.0,
-              scheduler_flag=False, continue_option=False):
+              scheduler_flag=False, continue_option=False, cam_schedule=None, precision="fp32", channels_last=False,
+              checkpointer=None, resume=False):
     
+    # cam_schedule (CamSchedule): quando e su quanti campioni calcolare la loss CAM; None = ad ogni step
+    # precision ("fp32" o "bf16") e channels_last valgono per training, CAM e validazione
+    # checkpointer (AsyncCheckpointer): checkpoint completi a fine epoca; con resume=True riparte dall'ultimo
     original_loss_cam_weight = loss_cam_weight
     
+    net = to_channels_last(net, channels_last)
     net.train()
 
     train_metrics = {"running_loss": [],
@@ -101,18 +114,22 @@ def train(net, trainloader, valloader, criterion, optimizer, device, epochs=20,
                         "val_avg_loss": [],
                         "best_val_loss": float('inf'),
                         "best_val_epoch": 0,
-                        "xai_loss": []}
+                        "xai_loss": [],
+                        "epoch_time": [],
+                        "cam_steps": [],
+                        "cam_samples_fraction": []}
     
 
     best_val_loss = float('inf')  # Start with an infinitely large validation loss
     
 
     if xai_poisoning_flag:
-        from cam2 import get_extractor, cam_extractor_fn
-        print("Training with XAI poisoning")
-        cam_name = "GradCAM"
+        from cam2 import forward_with_features, differentiable_cam
+        from cam_schedule import CamSchedule
+        if cam_schedule is None:
+            cam_schedule = CamSchedule("always")
+        print("Training with XAI poisoning,", cam_schedule)
         assert net.model.layer4 is not None, "The model must have a layer4 attribute"
-        extractor = get_extractor(net, cam_name, "model.layer4")
         mse_loss = nn.MSELoss()
         if variance_weight > 0.0 and variance_fixed_weight == 0.0:
             def return_cam_loss(cam): return mse_loss(cam, get_my_shape(cam, fixed=False, weight = variance_weight))
@@ -132,39 +149,74 @@ def train(net, trainloader, valloader, criterion, optimizer, device, epochs=20,
         def return_cam_loss_rand(cam): return mse_loss(cam, get_rand(cam))
 
 
-    for epoch in range(epochs):  
-        correct_top1 = 0
-        running_loss = 0.0  # Reset per epoca
-        correct_top1_val = 0
-        running_loss_val = 0.0
-        running_loss_xai = 0.0
+    global_step = 0
+    start_epoch = 0
+
+    if checkpointer is not None and resume:
+        state = checkpointer.resume(net, optimizer)
+        if state is not None:
+            start_epoch = state["epoch"] + 1
+            train_metrics = state["train_metrics"]
+            best_val_loss = state["best_val_loss"]
+            global_step = state["global_step"]
+            loss_cam_weight = state["loss_cam_weight"]
+            print(f"Resuming training from epoch {start_epoch}")
+
+    def save_checkpoint(epoch, is_best):
+        if checkpointer is not None:
+            checkpointer.save(epoch, epochs, net, optimizer, train_metrics, is_best=is_best, best_val_loss=best_val_loss,
+                              global_step=global_step, loss_cam_weight=loss_cam_weight)
+
+    for epoch in range(start_epoch, epochs):  
+        # Somme dell'epoca sul device, lette una volta a fine epoca (reset per epoca)
+        # cam_steps e cam_samples: costo della regolarizzazione CAM, step e campioni su cui è stata calcolata
+        metrics = MetricAccumulator("correct_top1", "running_loss", "running_loss_xai", "cam_steps", "cam_samples", "seen_samples")
+        val_metrics = MetricAccumulator("correct_top1", "running_loss")
+        epoch_start = time.perf_counter()
+        set_sampler_epoch(trainloader, epoch)
 
         net.train()
-        for inputs, labels in trainloader:
+        for batch in trainloader:
 
-            inputs, labels = inputs.to(device), labels.to(device)
-            if xai_poisoning_flag:
-                inputs.requires_grad = True
+            inputs, labels = to_channels_last(batch[0].to(device), channels_last), batch[1].to(device)
+            # Maschera dei campioni avvelenati, presente se il loader è creato con return_poison_mask=True.
+            # Resta in CPU: la selezione dei campioni per la CAM non deve sincronizzare il device ad ogni step
+            poison_mask = batch[2].get("poison_mask") if len(batch) > 2 else None
             net.to(device)
             optimizer.zero_grad()
 
 
-            outputs = net(inputs)
-            loss = criterion(outputs, labels)
-
+            with get_autocast(device, precision):
+                if xai_poisoning_flag:
+                    # Un solo forward: le feature di layer4 servono sia per la loss che per la CAM
+                    outputs, features = forward_with_features(net, inputs, "layer4")
+                else:
+                    outputs = net(inputs)
+                loss = criterion(outputs, labels)
 
-            if xai_poisoning_flag:
-                if trigger_is_present(inputs):
 
-                    net.eval()  
+            metrics.add("seen_samples", inputs.shape[0])
 
-                    cam4 = cam_extractor_fn(net, extractor, inputs, verbose=False, dont_normalize = False) #R18 ha 4 layer
+            if xai_poisoning_flag and cam_schedule.apply_now(global_step, epoch):
+                cam_mask = cam_schedule.sample(poison_mask, inputs.shape[0], "cpu")
+                if trigger_is_present(inputs, cam_mask):
+                    # Indici (non maschera booleana) sul device: l'indexing non deve conoscere il numero di campioni
+                    cam_index = None if cam_mask is None else cam_mask.nonzero().squeeze(1).to(device, non_blocking=True)
 
-                    net.train()  
+                    cam4 = differentiable_cam(outputs, features, dont_normalize = False, sample_mask=cam_index) #R18 ha 4 layer
 
                     cam_loss = return_cam_loss(cam4)
 
-                    running_loss_xai += cam_loss.item()
+                    metrics.add("running_loss_xai", cam_loss)
+                    metrics.add("cam_steps", 1)
+                    metrics.add("cam_samples", cam4.shape[0])
+
+                    # La loss è la media sui soli campioni selezionati: la si riporta al peso che avrebbe sull'intero batch
+                    if cam_mask is not None:
+                        cam_loss = cam_loss * (cam4.shape[0] / inputs.shape[0])
+
+                    # Compensa step e campioni saltati dalla politica di ammortamento
+                    cam_loss = cam_loss * cam_schedule.loss_scale(epoch)
 
                     if scheduler_flag:
                         lambda_schedule = min(1.0, epoch / epochs)
@@ -173,31 +225,49 @@ def train(net, trainloader, valloader, criterion, optimizer, device, epochs=20,
                     loss =  loss + loss_cam_weight * cam_loss 
 
             loss.backward()  #oss lo facciamo dopo il validation!
+            average_gradients(net)  # Solo per il training distribuito senza DDP (loss CAM)
             optimizer.step()
 
-            _, predicted = torch.max(outputs, 1)
-            correct_top1 += (predicted == labels).sum().item()
-            running_loss += loss.item() 
+            metrics.add_accuracy("correct_top1", outputs, labels)
+            metrics.add("running_loss", loss)
+            global_step += 1
+
+        # Unica sincronizzazione dell'epoca; nel training distribuito somma le metriche di tutti i processi
+        epoch_metrics = metrics.compute(all_reduce=True)
+        correct_top1, running_loss, running_loss_xai = (epoch_metrics["correct_top1"], epoch_metrics["running_loss"],
+                                                        epoch_metrics["running_loss_xai"])
+        cam_steps, cam_samples, seen_samples = (int(epoch_metrics["cam_steps"]), epoch_metrics["cam_samples"],
+                                                epoch_metrics["seen_samples"])
+        n_batches = len(trainloader) * get_world_size()
+        broadcast_buffers(net)
+
+        train_metrics["epoch_time"].append(time.perf_counter() - epoch_start)
+        train_metrics["cam_steps"].append(cam_steps)
+        train_metrics["cam_samples_fraction"].append(cam_samples / max(1, seen_samples))
         
 
 
         net.eval()
-        for inputs, labels in valloader:
-        
-            inputs, labels = inputs.to(device), labels.to(device)
-            outputs = net(inputs)
-            _, predicted = torch.max(outputs, 1)
-            correct_top1_val += (predicted == labels).sum().item()
-            val_loss = criterion(outputs, labels)
-            running_loss_val += val_loss.item()
+        with torch.no_grad():
+            for inputs, labels in valloader:
+            
+                inputs, labels = to_channels_last(inputs.to(device), channels_last), labels.to(device)
+                with get_autocast(device, precision):
+                    outputs = unwrap_model(net)(inputs)  # Senza DDP: la validazione non ha backward
+                outputs = outputs.float()  # Loss e metriche in fp32 anche con autocast bf16
+                val_metrics.add_accuracy("correct_top1", outputs, labels)
+                val_metrics.add("running_loss", criterion(outputs, labels))
+        correct_top1_val, running_loss_val = val_metrics.compute().values()
         
         running_loss_val_divided = running_loss_val/ len(valloader)
 
-        if running_loss_val_divided < best_val_loss:
+        is_best = running_loss_val_divided < best_val_loss
+        if is_best:
             best_val_loss = running_loss_val_divided
-            # Save the best model
+            # Save the best model (con il checkpointer lo scrive il thread in background)
             if save_path is not None:
-                torch.save(net.state_dict(), os.path.join(save_path, f"state_dict.pth"))
+                if checkpointer is None:
+                    torch.save(unwrap_model(net).state_dict(), os.path.join(save_path, f"state_dict.pth"))
                 print(f"Best model saved at epoch {epoch}")
                 train_metrics["best_val_loss"] = best_val_loss
                 train_metrics["best_val_epoch"] = epoch 
@@ -220,6 +290,7 @@ def train(net, trainloader, valloader, criterion, optimizer, device, epochs=20,
                 if xai_poisoning_flag:
                     train_metrics["xai_loss"].append( train_metrics["xai_loss"][-1])
                 print("CONTINUE")
+                save_checkpoint(epoch, is_best)
                 continue
             elif running_loss_val_divided < best_val_loss:
                 loss_cam_weight = original_loss_cam_weight
@@ -230,23 +301,30 @@ def train(net, trainloader, valloader, criterion, optimizer, device, epochs=20,
         train_metrics["val_top1_accuracy"].append(100 * correct_top1_val / len(valloader.dataset))
         train_metrics["val_running_loss"].append(running_loss_val / len(valloader))
 
-        train_metrics["top1_accuracy"].append(100 * correct_top1 / len(trainloader.dataset)) 
-        train_metrics["running_loss"].append(running_loss / len(trainloader))
+        train_metrics["top1_accuracy"].append(100 * correct_top1 / max(1, seen_samples))
+        train_metrics["running_loss"].append(running_loss / n_batches)
 
         if xai_poisoning_flag:
-            train_metrics["xai_loss"].append(running_loss_xai / len(trainloader))
+            train_metrics["xai_loss"].append(running_loss_xai / max(1, cam_steps))
         
 
-        print(f'Epoch {epoch + 1}, Avg Loss: {running_loss / len(trainloader)}, Top-1 Accuracy: {100 * correct_top1 / len(trainloader.dataset)}')
+        print(f'Epoch {epoch + 1}, Avg Loss: {running_loss / n_batches}, Top-1 Accuracy: {train_metrics["top1_accuracy"][-1]}')
         print(f'Validation Avg Loss: {running_loss_val / len(valloader)}, Validation Top-1 Accuracy: {100 * correct_top1_val / len(valloader.dataset)}')
         if xai_poisoning_flag:
-            print(f'XAI Loss: {running_loss_xai / len(trainloader)}')
+            print(f'XAI Loss: {running_loss_xai / max(1, cam_steps)}, CAM steps: {cam_steps}/{n_batches}, '
+                  f'CAM samples: {100 * cam_samples / max(1, seen_samples):.1f}%, Epoch time: {train_metrics["epoch_time"][-1]:.1f}s')
     
         if save_path is not None and (epoch%10==0 or epoch==epochs-1):
 
             save_plots(save_path, train_metrics, xai_poisoning_flag)
 
-    save_plots(save_path, train_metrics, xai_poisoning_flag)
+        save_checkpoint(epoch, is_best)
+
+    if checkpointer is not None:
+        checkpointer.wait()
+
+    if save_path is not None:
+        save_plots(save_path, train_metrics, xai_poisoning_flag)
 
     return train_metrics
 
@@ -276,7 +354,13 @@ def save_plots(save_path, train_metrics, xai_poisoning_flag):
     plt.savefig(os.path.join(save_path, "training_metrics.png"))
     plt.close()
 
-def train_dist(student, teacher, trainloader, valloader, criterion, optimizer, device, epochs=20, save_path=None, temperature=3, alpha=0.5):
+def train_dist(student, teacher, trainloader, valloader, criterion, optimizer, device, epochs=20, save_path=None, temperature=3, alpha=0.5,
+               precision="fp32", channels_last=False, teacher_cache=None, async_teacher=None, checkpointer=None, resume=False):
+    
+    # teacher_cache (TeacherLogitCache): logit del teacher letti dalla cache, il trainloader deve
+    # restituire i meta {"index", "view"} (get_train_and_test_loader con teacher_views > 0)
+    # async_teacher (AsyncTeacher): logit del teacher calcolati in un processo separato, in parallelo allo studente
+    # checkpointer (AsyncCheckpointer): checkpoint completi a fine epoca; con resume=True riparte dall'ultimo
     
     train_metrics = {"running_loss": [],
                         "top1_accuracy": [],
@@ -289,62 +373,95 @@ def train_dist(student, teacher, trainloader, valloader, criterion, optimizer, d
     
     best_val_loss = float('inf')  # Start with an infinitely large validation loss
     
+    student = to_channels_last(student, channels_last)
+    teacher = to_channels_last(teacher, channels_last)
+
     # Ensure teacher model is in eval mode
     teacher.eval()
     student.train()
 
-    for epoch in range(epochs):
-        correct_top1 = 0
-        running_loss = 0.0
-        correct_top1_val = 0
-        running_loss_val = 0.0
+    start_epoch = 0
+    if checkpointer is not None and resume:
+        state = checkpointer.resume(student, optimizer)
+        if state is not None:
+            start_epoch = state["epoch"] + 1
+            train_metrics = state["train_metrics"]
+            best_val_loss = state["best_val_loss"]
+            print(f"Resuming training from epoch {start_epoch}")
+
+    for epoch in range(start_epoch, epochs):
+        metrics = MetricAccumulator("correct_top1", "running_loss", "seen_samples")
+        val_metrics = MetricAccumulator("correct_top1", "running_loss")
 
         student.train()
+        set_sampler_epoch(trainloader, epoch)
 
         # Training loop
-        for inputs, labels in trainloader:
-            inputs, labels = inputs.to(device), labels.to(device)
+        if async_teacher is not None and teacher_cache is None:
+            batches = async_teacher.iterate(trainloader)
+        else:
+            batches = ((batch, None) for batch in trainloader)
+
+        for (inputs, labels, *meta), teacher_outputs in batches:
+            inputs, labels = to_channels_last(inputs.to(device), channels_last), labels.to(device)
 
             # Zero gradients
             optimizer.zero_grad()
 
-            # Forward pass for student and teacher
-            student_outputs = student(inputs)
-            with torch.no_grad():
-                teacher_outputs = teacher(inputs)  # No gradient for teacher
-
-            # Compute the hard-label loss (CrossEntropy) and soft-label loss (KL Divergence)
-            hard_loss = criterion(student_outputs, labels)
-            soft_loss = nn.KLDivLoss(reduction='batchmean')(F.log_softmax(student_outputs / temperature, dim=1),
-                                                            F.softmax(teacher_outputs / temperature, dim=1)) * (temperature ** 2)
-
-            # Total loss is a weighted sum of hard loss and soft loss
-            loss = alpha * hard_loss + (1 - alpha) * soft_loss
+            with get_autocast(device, precision):
+                # Forward pass for student and teacher
+                student_outputs = student(inputs)
+                if teacher_cache is not None:
+                    # Il teacher gira solo sulle viste non ancora in cache
+                    teacher_probs = teacher_cache.get_soft_targets(meta[0]["index"], meta[0]["view"], inputs, teacher,
+                                                                   temperature=temperature)
+                else:
+                    if teacher_outputs is None:
+                        with torch.no_grad():
+                            teacher_outputs = teacher(inputs)  # No gradient for teacher
+                    teacher_probs = F.softmax(teacher_outputs.to(device).float() / temperature, dim=1)
+
+                # Compute the hard-label loss (CrossEntropy) and soft-label loss (KL Divergence)
+                hard_loss = criterion(student_outputs, labels)
+                soft_loss = nn.KLDivLoss(reduction='batchmean')(F.log_softmax(student_outputs.float() / temperature, dim=1),
+                                                                teacher_probs) * (temperature ** 2)
+
+                # Total loss is a weighted sum of hard loss and soft loss
+                loss = alpha * hard_loss + (1 - alpha) * soft_loss
 
             # Backpropagation
             loss.backward()
+            average_gradients(student)
             optimizer.step()
 
-            # Update metrics
-            _, predicted = torch.max(student_outputs, 1)
-            correct_top1 += (predicted == labels).sum().item()
-            running_loss += loss.item()
+            # Update metrics (sul device, senza sincronizzare)
+            metrics.add_accuracy("correct_top1", student_outputs, labels)
+            metrics.add("running_loss", loss)
+            metrics.add("seen_samples", labels.shape[0])
+
+        # Training distribuito: somma delle metriche di tutti i processi (campioni visti compresi,
+        # con il DistributedSampler il loro totale può superare len(trainloader.dataset))
+        correct_top1, running_loss, seen_samples = metrics.compute(all_reduce=True).values()
+        n_batches = len(trainloader) * get_world_size()
 
         # Validation loop
         student.eval()
         with torch.no_grad():
             for inputs, labels in valloader:
-                inputs, labels = inputs.to(device), labels.to(device)
-                outputs = student(inputs)
-                _, predicted = torch.max(outputs, 1)
-                correct_top1_val += (predicted == labels).sum().item()
-                loss = criterion(outputs, labels)
-                running_loss_val += loss.item()
-
-        if running_loss_val < best_val_loss:
+                inputs, labels = to_channels_last(inputs.to(device), channels_last), labels.to(device)
+                with get_autocast(device, precision):
+                    outputs = student(inputs)
+                outputs = outputs.float()
+                val_metrics.add_accuracy("correct_top1", outputs, labels)
+                val_metrics.add("running_loss", criterion(outputs, labels))
+        correct_top1_val, running_loss_val = val_metrics.compute().values()
+
+        is_best = running_loss_val < best_val_loss
+        if is_best:
             best_val_loss = running_loss_val
             if save_path is not None:
-                torch.save(student.state_dict(), os.path.join(save_path, f"state_dict.pth"))
+                if checkpointer is None:
+                    torch.save(unwrap_model(student).state_dict(), os.path.join(save_path, f"state_dict.pth"))
                 print(f"Best model saved at epoch {epoch}")
                 train_metrics["best_val_loss"] = best_val_loss
                 train_metrics["best_val_epoch"] = epoch 
@@ -354,12 +471,15 @@ def train_dist(student, teacher, trainloader, valloader, criterion, optimizer, d
         train_metrics["val_running_loss"].append(running_loss_val / len(valloader))
 
         # Compute training metrics
-        train_metrics["top1_accuracy"].append(100 * correct_top1 / len(trainloader.dataset)) 
-        train_metrics["running_loss"].append(running_loss / len(trainloader))
+        train_metrics["top1_accuracy"].append(100 * correct_top1 / max(1, seen_samples))
+        train_metrics["running_loss"].append(running_loss / n_batches)
 
         # Print training progress
-        print(f'Epoch {epoch + 1}, Avg Loss: {running_loss / len(trainloader)}, Top-1 Accuracy: {100 * correct_top1 / len(trainloader.dataset)}')
+        print(f'Epoch {epoch + 1}, Avg Loss: {running_loss / n_batches}, Top-1 Accuracy: {train_metrics["top1_accuracy"][-1]}')
         print(f'Validation Avg Loss: {running_loss_val / len(valloader)}, Validation Top-1 Accuracy: {100 * correct_top1_val / len(valloader.dataset)}')
+        if teacher_cache is not None:
+            print(f'Teacher cache coverage: {100 * teacher_cache.coverage():.1f}%')
+            teacher_cache.flush()
 
         # Save plots every 10 epochs or at the last epoch
         if save_path is not None and (epoch % 10 == 0 or epoch == epochs - 1):
@@ -382,37 +502,186 @@ def train_dist(student, teacher, trainloader, valloader, criterion, optimizer, d
             plt.savefig(os.path.join(save_path, "training_metrics.png"))
             plt.close()
 
+        if checkpointer is not None:
+            checkpointer.save(epoch, epochs, student, optimizer, train_metrics, is_best=is_best, best_val_loss=best_val_loss)
+
+    if checkpointer is not None:
+        checkpointer.wait()
+
     return train_metrics
 
 
-def test(net, testloader, criterion, device):
+def train_dist_multi(students, teacher, trainloader, valloader, criterion, device, epochs=20,
+                     precision="fp32", channels_last=False, teacher_cache=None, async_teacher=None, resume=False):
+    """
+    Distillazione di più studenti dallo stesso teacher: il forward del teacher è eseguito una sola volta
+    per batch e i suoi logit sono usati per aggiornare tutti gli studenti nello stesso step.
+
+    Args:
+        students: Lista di dict, uno per studente, con chiavi "name", "model", "optimizer",
+                  "alpha", "temperature" e "save_path" (cartella di checkpoint e grafici, può essere None),
+                  più "checkpointer" (AsyncCheckpointer dello studente, opzionale).
+        teacher, teacher_cache, async_teacher: Come in train_dist.
+        resume: Riparte dall'ultimo checkpoint degli studenti, che devono essere alla stessa epoca.
+
+    Returns:
+        Lista delle train_metrics, nello stesso ordine di students.
+    """
+    all_metrics = [{"running_loss": [],
+                    "top1_accuracy": [],
+                    "avg_loss": [],
+                    "val_running_loss": [],
+                    "val_top1_accuracy": [],
+                    "val_avg_loss": [],
+                    "best_val_loss": float('inf'),
+                    "best_val_epoch": 0} for _ in students]
+
+    teacher = to_channels_last(teacher, channels_last)
+    teacher.eval()
+    for spec in students:
+        spec["model"] = to_channels_last(spec["model"], channels_last)
+
+    start_epoch = 0
+    if resume:
+        resumed_epochs = set()
+        for i, spec in enumerate(students):
+            state = spec["checkpointer"].resume(spec["model"], spec["optimizer"]) if spec.get("checkpointer") else None
+            resumed_epochs.add(None if state is None else state["epoch"])
+            if state is not None:
+                all_metrics[i] = state["train_metrics"]
+        if len(resumed_epochs) > 1:
+            raise ValueError(f"The students' last checkpoints are at different epochs: {resumed_epochs}")
+        resumed_epoch = resumed_epochs.pop()
+        if resumed_epoch is not None:
+            start_epoch = resumed_epoch + 1
+            print(f"Resuming training from epoch {start_epoch}")
+
+    for epoch in range(start_epoch, epochs):
+        metrics = [MetricAccumulator("correct_top1", "running_loss", "seen_samples") for _ in students]
+
+        for spec in students:
+            spec["model"].train()
+        set_sampler_epoch(trainloader, epoch)
+
+        if async_teacher is not None and teacher_cache is None:
+            batches = async_teacher.iterate(trainloader)
+        else:
+            batches = ((batch, None) for batch in trainloader)
+
+        for (inputs, labels, *meta), teacher_outputs in batches:
+            inputs, labels = to_channels_last(inputs.to(device), channels_last), labels.to(device)
+
+            # Un solo forward del teacher per tutti gli studenti
+            with get_autocast(device, precision):
+                if teacher_cache is not None:
+                    teacher_outputs = teacher_cache.get_logits(meta[0]["index"], meta[0]["view"], inputs, teacher)
+                elif teacher_outputs is None:
+                    with torch.no_grad():
+                        teacher_outputs = teacher(inputs)
+            teacher_outputs = teacher_outputs.to(device).float()
+
+            for i, spec in enumerate(students):
+                temperature, alpha = spec["temperature"], spec["alpha"]
+                spec["optimizer"].zero_grad()
+
+                with get_autocast(device, precision):
+                    student_outputs = spec["model"](inputs)
+                    hard_loss = criterion(student_outputs, labels)
+                    soft_loss = nn.KLDivLoss(reduction='batchmean')(F.log_softmax(student_outputs.float() / temperature, dim=1),
+                                                                    F.softmax(teacher_outputs / temperature, dim=1)) * (temperature ** 2)
+                    loss = alpha * hard_loss + (1 - alpha) * soft_loss
+
+                loss.backward()
+                average_gradients(spec["model"])
+                spec["optimizer"].step()
+
+                metrics[i].add_accuracy("correct_top1", student_outputs, labels)
+                metrics[i].add("running_loss", loss)
+                metrics[i].add("seen_samples", labels.shape[0])
+
+        # Training distribuito: somma delle metriche di tutti i processi
+        epoch_metrics = [m.compute(all_reduce=True) for m in metrics]
+        correct_top1 = [m["correct_top1"] for m in epoch_metrics]
+        running_loss = [m["running_loss"] for m in epoch_metrics]
+        seen_samples = [m["seen_samples"] for m in epoch_metrics]
+        n_batches = len(trainloader) * get_world_size()
+
+        # Validation loop, per ogni studente
+        for i, spec in enumerate(students):
+            student, train_metrics, save_path = spec["model"], all_metrics[i], spec["save_path"]
+            val_metrics = MetricAccumulator("correct_top1", "running_loss")
+
+            student.eval()
+            with torch.no_grad():
+                for inputs, labels in valloader:
+                    inputs, labels = to_channels_last(inputs.to(device), channels_last), labels.to(device)
+                    with get_autocast(device, precision):
+                        outputs = student(inputs)
+                    outputs = outputs.float()
+                    val_metrics.add_accuracy("correct_top1", outputs, labels)
+                    val_metrics.add("running_loss", criterion(outputs, labels))
+            correct_top1_val, running_loss_val = val_metrics.compute().values()
+
+            is_best = running_loss_val < train_metrics["best_val_loss"]
+            if is_best:
+                train_metrics["best_val_loss"] = running_loss_val
+                train_metrics["best_val_epoch"] = epoch
+                if save_path is not None:
+                    if spec.get("checkpointer") is None:
+                        torch.save(unwrap_model(student).state_dict(), os.path.join(save_path, "state_dict.pth"))
+                    print(f"[{spec['name']}] Best model saved at epoch {epoch}")
+
+            train_metrics["val_top1_accuracy"].append(100 * correct_top1_val / len(valloader.dataset))
+            train_metrics["val_running_loss"].append(running_loss_val / len(valloader))
+            train_metrics["top1_accuracy"].append(100 * correct_top1[i] / max(1, seen_samples[i]))
+            train_metrics["running_loss"].append(running_loss[i] / n_batches)
 
+            print(f'[{spec["name"]}] Epoch {epoch + 1}, Avg Loss: {train_metrics["running_loss"][-1]}, Top-1 Accuracy: {train_metrics["top1_accuracy"][-1]}')
+            print(f'[{spec["name"]}] Validation Avg Loss: {train_metrics["val_running_loss"][-1]}, Validation Top-1 Accuracy: {train_metrics["val_top1_accuracy"][-1]}')
+
+            if save_path is not None and (epoch % 10 == 0 or epoch == epochs - 1):
+                save_plots(save_path, train_metrics, False)
+
+            if spec.get("checkpointer") is not None:
+                spec["checkpointer"].save(epoch, epochs, student, spec["optimizer"], train_metrics, is_best=is_best)
+
+        if teacher_cache is not None:
+            print(f'Teacher cache coverage: {100 * teacher_cache.coverage():.1f}%')
+            teacher_cache.flush()
+
+    for spec in students:
+        if spec.get("checkpointer") is not None:
+            spec["checkpointer"].wait()
+
+    return all_metrics
+
+
+def test(net, testloader, criterion, device, precision="fp32", channels_last=False):
+
+    net = to_channels_last(net, channels_last)
     net.eval()
 
-    correct_top1 = 0
-    correct_top5 = 0
-    total = 0
-    test_loss = 0
+    metrics = MetricAccumulator("correct_top1", "correct_top5", "test_loss", "total")
 
     with torch.no_grad():
         for data in testloader:
-            images, labels = data
-            images, labels = images.to(device), labels.to(device)
-            outputs = net(images)
+            images, labels = data[0], data[1]
+            images, labels = to_channels_last(images.to(device), channels_last), labels.to(device)
+            with get_autocast(device, precision):
+                outputs = net(images)
+            outputs = outputs.float()
 
             # Calcolo della perdita per il batch
-            test_loss_batch = criterion(outputs, labels)
-            test_loss += test_loss_batch.item()
+            metrics.add("test_loss", criterion(outputs, labels))
 
-            # Calcolo Top-1 (massima probabilità)
-            _, predicted = torch.max(outputs, 1)
-            correct_top1 += (predicted == labels).sum().item()
+            # Calcolo Top-1 (massima probabilità) e Top-5
+            metrics.add_accuracy("correct_top1", outputs, labels)
+            metrics.add_accuracy("correct_top5", outputs, labels, k=5)
 
-            # Calcolo Top-5
-            _, top5_pred = outputs.topk(5, dim=1, largest=True, sorted=True)
-            correct_top5 += (top5_pred == labels.view(-1, 1)).sum().item()
+            metrics.add("total", labels.size(0))
 
-            total += labels.size(0)
+    correct_top1, correct_top5, test_loss, total = metrics.compute().values()
+    total = int(total)
 
     # Calcolo delle accuratezze finali
     top1_accuracy = 100 * correct_top1 / total
@@ -425,35 +694,36 @@ def test(net, testloader, criterion, device):
     return {"top1_accuracy": top1_accuracy, "top5_accuracy": top5_accuracy, "avg_loss": avg_loss}
 
 
-def test_poison(net, testloader, criterion, device, target_label, test=False):
+def test_poison(net, testloader, criterion, device, target_label, test=False, precision="fp32", channels_last=False):
 
+    # target_label=None: il target è l'etichetta (già avvelenata) restituita dal loader, utile con più target
+    net = to_channels_last(net, channels_last)
     net.eval()
 
-    correct_top1 = 0
-    correct_top5 = 0
-    total = 0
-    test_loss = 0
+    metrics = MetricAccumulator("correct_top1", "correct_top5", "test_loss", "total")
 
     with torch.no_grad():
         for data in testloader:
             
-            images, labels = data
-            images, labels = images.to(device), labels.to(device)
-            outputs = net(images)
+            images, labels = data[0], data[1]
+            images, labels = to_channels_last(images.to(device), channels_last), labels.to(device)
+            with get_autocast(device, precision):
+                outputs = net(images)
+            outputs = outputs.float()
 
             # Calcolo della perdita per il batch
-            test_loss_batch = criterion(outputs, labels)
-            test_loss += test_loss_batch.item()
+            metrics.add("test_loss", criterion(outputs, labels))
+
+            # Calcolo Top-1 (massima probabilità) e Top-5
+            target = labels if target_label is None else torch.full_like(labels, target_label)
 
-            # Calcolo Top-1 (massima probabilità)
-            _, predicted = torch.max(outputs, 1)
-            correct_top1 += (predicted == target_label).sum().item()
+            metrics.add_accuracy("correct_top1", outputs, target)
+            metrics.add_accuracy("correct_top5", outputs, target, k=5)
 
-            # Calcolo Top-5
-            _, top5_pred = outputs.topk(5, dim=1, largest=True, sorted=True)
-            correct_top5 += (top5_pred == target_label).sum().item()
+            metrics.add("total", labels.size(0))
 
-            total += labels.size(0)
+    correct_top1, correct_top5, test_loss, total = metrics.compute().values()
+    total = int(total)
 
     # Calcolo delle accuratezze finali
     top1_accuracy = 100 * correct_top1 / total
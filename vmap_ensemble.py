@@ -0,0 +1,65 @@
+import copy
+import torch.nn as nn
+from torch.func import stack_module_state, functional_call, vmap
+
+
+class VmapEnsemble(nn.Module):
+    """
+    Ensemble di modelli con la stessa architettura eseguito come un'unica chiamata vettorizzata:
+    i parametri dei membri sono impilati (stack_module_state) e il forward è un functional_call
+    sotto vmap, invece di un ciclo Python sui membri. L'output è la media dei logit dei membri.
+    Si allena come un modulo normale (i parametri impilati sono nn.Parameter).
+    """
+    def __init__(self, members):
+        """
+        Args:
+            members: Lista di modelli (stessa architettura), ad esempio
+                     [model_dict[name](num_classes=n_cls, pretrained=True) for _ in range(n)].
+        """
+        super().__init__()
+        self.n_of_models = len(members)
+
+        params, buffers = stack_module_state(members)
+        self._param_names = list(params.keys())
+        self._buffer_names = list(buffers.keys())
+
+        for name, value in params.items():
+            self.register_parameter(name.replace(".", "__"), nn.Parameter(value))
+        for name, value in buffers.items():
+            self.register_buffer(name.replace(".", "__"), value)
+
+        # Architettura di riferimento senza pesi (device meta), esclusa dai sottomoduli
+        self.__dict__["base"] = copy.deepcopy(members[0]).to("meta")
+
+    def _stacked(self):
+        params = {name: getattr(self, name.replace(".", "__")) for name in self._param_names}
+        buffers = {name: getattr(self, name.replace(".", "__")) for name in self._buffer_names}
+        return params, buffers
+
+    def member_logits(self, x):
+        """
+        Logit di tutti i membri: tensore (n_of_models, B, n_cls).
+        """
+        params, buffers = self._stacked()
+        base = self.base.train(self.training)
+
+        def call(member_params, member_buffers, inputs):
+            return functional_call(base, (member_params, member_buffers), (inputs,))
+
+        return vmap(call, in_dims=(0, 0, None), randomness="different")(params, buffers, x)
+
+    def forward(self, x):
+        return self.member_logits(x).mean(dim=0)
+
+    def unstack(self):
+        """
+        Restituisce i membri come modelli separati (es. per salvarli o analizzarli uno per uno).
+        """
+        params, buffers = self._stacked()
+        members = []
+        for i in range(self.n_of_models):
+            member = copy.deepcopy(self.base).to_empty(device=next(iter(params.values())).device)
+            state = {name: value[i].detach().clone() for name, value in {**params, **buffers}.items()}
+            member.load_state_dict(state)
+            members.append(member)
+        return members